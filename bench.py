@@ -0,0 +1,245 @@
+from __future__ import print_function, unicode_literals
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from rd import RD, Link, LinkList, PropertyList, jrd, xrd
+from rd.server import WEBFINGER_PATH, Server
+
+PWD = os.path.abspath(os.path.dirname(__file__))
+
+DEFAULT_SIZES = '10,1000,10000'
+
+
+#
+# fixtures
+#
+
+def load_examples():
+    examples = []
+    path = os.path.join(PWD, 'examples')
+    for filename in sorted(os.listdir(path)):
+        with open(os.path.join(path, filename)) as infile:
+            data = infile.read()
+        if filename.endswith('.json'):
+            examples.append((filename, jrd.loads(data)))
+        elif 'b2' not in filename:
+            examples.append((filename, xrd.loads(data)))
+    return examples
+
+
+def synthetic(links, titles=2, properties=2):
+    rd = RD(subject='acct:bench@example.com')
+    rd.aliases.append('http://example.com/bench')
+    rd.properties.append(('http://example.com/ns/type', 'person'))
+    for i in range(links):
+        link = Link(rel='http://example.com/rel/%d' % (i % 50),
+                    type='text/html',
+                    href='http://example.com/links/%d' % i)
+        for j in range(titles):
+            link.titles.append(('Link %d' % i, 'l%d' % j))
+        for j in range(properties):
+            link.properties.append(('http://example.com/ns/p%d' % j, 'value %d' % i))
+        rd.links.append(link)
+    return rd
+
+
+def fixtures(sizes):
+    docs = load_examples()
+    docs.extend(('synthetic-%d' % n, synthetic(n)) for n in sizes)
+    return docs
+
+
+#
+# cases
+#
+
+def cases(docs, backend=None):
+
+    # yields (name, func, input size in bytes or None)
+
+    for (name, rd) in docs:
+
+        jrd_content = jrd.dumps(rd, backend=backend)
+        jrd_size = len(jrd_content.encode('utf-8'))
+        xrd_content = xrd.tostring(rd)
+        xrd_size = len(xrd_content.encode('utf-8'))
+        rels = [link.rel for link in rd.links][::max(1, len(rd.links) // 10)] or ['missing']
+        links = list(rd.links)
+        props = [(p.type, p.value) for link in links for p in link.properties]
+
+        yield ('jrd.loads[%s]' % name,
+               lambda c=jrd_content: jrd.loads(c, backend=backend), jrd_size)
+        yield ('jrd.loads-lazy[%s]' % name,
+               lambda c=jrd_content: jrd.loads(c, lazy=True, backend=backend), jrd_size)
+        yield ('jrd.dumps[%s]' % name,
+               lambda rd=rd: jrd.dumps(rd, backend=backend), jrd_size)
+        yield ('xrd.loads[%s]' % name,
+               lambda c=xrd_content: xrd.loads(c), xrd_size)
+        yield ('xrd.dumps[%s]' % name,
+               lambda rd=rd: xrd.dumps(rd), xrd_size)
+        yield ('xrd.tostring[%s]' % name,
+               lambda rd=rd: xrd.tostring(rd), xrd_size)
+        yield ('RD.find_link[%s]' % name,
+               lambda rd=rd, rels=rels: [rd.find_link(rel) for rel in rels], None)
+        yield ('LinkList.append[%s]' % name,
+               lambda links=links: _append(LinkList(), links), None)
+        yield ('LinkList.extend[%s]' % name,
+               lambda links=links: LinkList().extend(links), None)
+        yield ('PropertyList.extend[%s]' % name,
+               lambda props=props: PropertyList().extend(props), None)
+        yield ('Server.respond[%s]' % name,
+               lambda server=Server({'bench': rd}): server.respond(
+                   'GET', WEBFINGER_PATH, 'resource=bench', {'accept': 'application/jrd+json'}),
+               jrd_size)
+
+
+def _append(lst, values):
+    for value in values:
+        lst.append(value)
+
+
+#
+# measurement
+#
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    pos = (len(samples) - 1) * pct / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(samples) - 1)
+    return samples[lower] + (samples[upper] - samples[lower]) * (pos - lower)
+
+
+def run_case(func, size, min_time, min_samples, max_samples):
+
+    # calls faster than a millisecond are timed in batches so the clock
+    # resolution doesn't dominate a sample
+    start = time.perf_counter()
+    func()
+    single = time.perf_counter() - start
+    batch = max(1, int(0.001 / single)) if single > 0 else 1000
+
+    samples = []
+    began = time.perf_counter()
+    while len(samples) < max_samples:
+        start = time.perf_counter()
+        for _ in range(batch):
+            func()
+        samples.append((time.perf_counter() - start) / batch)
+        if len(samples) >= min_samples and time.perf_counter() - began >= min_time:
+            break
+
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    mean = sum(samples) / len(samples)
+    result = {
+        'calls': len(samples) * batch,
+        'mean': mean,
+        'p50': percentile(samples, 50),
+        'p90': percentile(samples, 90),
+        'p99': percentile(samples, 99),
+        'ops_per_sec': 1.0 / mean,
+        'peak_bytes': peak,
+    }
+    if size:
+        result['bytes_per_sec'] = size / mean
+    return result
+
+
+#
+# reporting
+#
+
+def print_results(results):
+    print('%-44s %10s %10s %10s %12s %10s' % (
+        'case', 'p50 (us)', 'p90 (us)', 'p99 (us)', 'ops/s', 'peak KiB'))
+    for (name, r) in results.items():
+        print('%-44s %10.1f %10.1f %10.1f %12.1f %10.1f' % (
+            name, r['p50'] * 1e6, r['p90'] * 1e6, r['p99'] * 1e6,
+            r['ops_per_sec'], r['peak_bytes'] / 1024.0))
+
+
+def compare(results, baseline, threshold):
+
+    # returns the names of cases whose median latency or peak memory grew
+    # by more than threshold relative to the baseline
+
+    regressions = []
+    print()
+    print('%-44s %12s %12s' % ('case', 'p50 change', 'peak change'))
+    for (name, r) in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        time_change = r['p50'] / base['p50'] - 1
+        mem_change = 0.0
+        if base['peak_bytes']:
+            mem_change = r['peak_bytes'] / float(base['peak_bytes']) - 1
+        flag = ''
+        if time_change > threshold or mem_change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-44s %+11.1f%% %+11.1f%%%s' % (name, time_change * 100, mem_change * 100, flag))
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='benchmark parsing, serialization and lookups')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help='comma separated link counts for synthetic documents '
+                             '(default %s, up to 100000 is supported)' % DEFAULT_SIZES)
+    parser.add_argument('--filter', default=None, help='only run cases containing this string')
+    parser.add_argument('--backend', default=None, help='JSON backend to use')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per case')
+    parser.add_argument('--min-samples', type=int, default=5)
+    parser.add_argument('--max-samples', type=int, default=1000)
+    parser.add_argument('--output', default=None, help='write results to this JSON file')
+    parser.add_argument('--baseline', default=None, help='compare against a saved results file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fractional slowdown or memory growth counted as a regression')
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.sizes.split(',') if n]
+
+    results = {}
+    for (name, func, size) in cases(fixtures(sizes), args.backend):
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = run_case(func, size, args.min_time, args.min_samples, args.max_samples)
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({
+                'meta': {
+                    'timestamp': datetime.datetime.utcnow().isoformat(),
+                    'python': platform.python_version(),
+                    'implementation': platform.python_implementation(),
+                    'platform': platform.platform(),
+                    'backend': jrd.get_backend(args.backend).name,
+                },
+                'results': results,
+            }, outfile, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)['results']
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
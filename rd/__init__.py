@@ -1,6 +1,17 @@
 from rd.core import *
+from rd.delta import diff, patch
+from rd.merging import merge
 
 __author__ = "Jeremy Carbaugh (jcarbaugh@gmail.com)"
 __version__ = "0.1"
 __copyright__ = "Copyright (c) 2012 Jeremy Carbaugh"
 __license__ = "BSD"
+
+
+def __getattr__(name):
+    # rd.batch pulls in concurrent.futures and multiprocessing, so it's
+    # only imported once one of its names is used
+    if name in ('Result', 'dumps_many', 'loads_many'):
+        from rd import batch
+        return getattr(batch, name)
+    raise AttributeError("module 'rd' has no attribute %r" % name)
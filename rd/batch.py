@@ -0,0 +1,111 @@
+from __future__ import unicode_literals
+import collections
+import multiprocessing
+from concurrent import futures
+
+from rd.core import dumps, loads
+
+EXECUTORS = {
+    'thread': futures.ThreadPoolExecutor,
+    'process': futures.ProcessPoolExecutor,
+}
+
+Result = collections.namedtuple('Result', ('index', 'value', 'error'))
+
+
+def _with_content_type(items, content_type):
+    for item in items:
+        if isinstance(item, tuple):
+            yield item
+        else:
+            yield (item, content_type)
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _run_chunk(func, chunk):
+    results = []
+    for index, (obj, content_type) in chunk:
+        try:
+            value = func(obj, content_type)
+            if value is None:
+                # loads returns None for a document it can't recognize
+                raise ValueError('unrecognized document')
+            results.append(Result(index, value, None))
+        except Exception as e:
+            results.append(Result(index, None, e))
+    return results
+
+
+def _run(func, items, executor, max_workers, chunksize, ordered):
+
+    owned = not isinstance(executor, futures.Executor)
+    if owned:
+        executor = EXECUTORS[executor](max_workers=max_workers)
+
+    # only keep a couple of chunks per worker in flight so huge inputs
+    # aren't read into memory all at once
+    window = 2 * (max_workers or multiprocessing.cpu_count())
+    chunks = _chunks(enumerate(items), chunksize)
+
+    def submit():
+        chunk = next(chunks, None)
+        if chunk is not None:
+            return executor.submit(_run_chunk, func, chunk)
+
+    try:
+        if ordered:
+            pending = collections.deque()
+            while True:
+                while len(pending) < window:
+                    future = submit()
+                    if future is None:
+                        break
+                    pending.append(future)
+                if not pending:
+                    break
+                for result in pending.popleft().result():
+                    yield result
+        else:
+            pending = set()
+            while True:
+                while len(pending) < window:
+                    future = submit()
+                    if future is None:
+                        break
+                    pending.add(future)
+                if not pending:
+                    break
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    for result in future.result():
+                        yield result
+    finally:
+        if owned:
+            executor.shutdown()
+
+
+def loads_many(documents, content_type=None, executor='thread', max_workers=None,
+               chunksize=1, ordered=True):
+
+    # documents are either content or (content, content_type) pairs;
+    # yields a Result per document with the RD or the exception raised
+
+    items = _with_content_type(documents, content_type)
+    return _run(loads, items, executor, max_workers, chunksize, ordered)
+
+
+def dumps_many(rds, content_type='application/json', executor='thread', max_workers=None,
+               chunksize=1, ordered=True):
+
+    items = _with_content_type(rds, content_type)
+    return _run(dumps, items, executor, max_workers, chunksize, ordered)
@@ -0,0 +1,115 @@
+from __future__ import unicode_literals
+import calendar
+import collections
+import threading
+import time
+
+
+def expires_timestamp(rd):
+    if rd.expires is not None:
+        # naive datetimes are taken to be UTC
+        return calendar.timegm(rd.expires.utctimetuple())
+
+
+class DescriptorCache(object):
+
+    # LRU cache of parsed RD objects keyed by resource URI or subject.
+    # Entries expire at RD.expires, or default_ttl seconds after they are
+    # stored if the descriptor has no expiry. maxsize bounds the number of
+    # entries, or the total of getsizeof(rd) when getsizeof is given.
+
+    def __init__(self, maxsize=1024, default_ttl=3600, getsizeof=None, clock=time.time):
+        self.maxsize = maxsize
+        self.default_ttl = default_ttl
+        self.getsizeof = getsizeof
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        (rd, expires, size) = self._entries.pop(key)
+        self._size -= size
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, rd, ttl=None):
+
+        now = self.clock()
+        if ttl is not None:
+            expires = now + ttl
+        else:
+            expires = expires_timestamp(rd)
+            if expires is None:
+                expires = now + self.default_ttl
+
+        size = self.getsizeof(rd) if self.getsizeof else 1
+        if expires <= now or size > self.maxsize:
+            self.delete(key)
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (rd, expires, size)
+            self._size += size
+            while self._size > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_or_load(self, key, loader):
+        rd = self.get(key)
+        if rd is None:
+            rd = loader(key)
+            if rd is not None:
+                self.set(key, rd)
+        return rd
+
+    def purge(self):
+        # drop every expired entry rather than waiting for it to be read
+        with self._lock:
+            now = self.clock()
+            for key in [k for (k, entry) in self._entries.items() if entry[1] <= now]:
+                self._remove(key)
+                self.expirations += 1
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'entries': len(self._entries),
+            'size': self._size,
+        }
@@ -0,0 +1,148 @@
+from __future__ import unicode_literals
+import itertools
+
+# An in-memory set of descriptors with hash indexes over subject, aliases,
+# link rel, type and href, and property type, so a lookup doesn't scan
+# every descriptor and its links.
+#
+# Indexes are updated when descriptors are added, removed or replaced. An
+# RD edited in place keeps the keys it had when it was added until it's
+# passed to replace(rd, rd). Link criteria are matched by a single link:
+# each link is also indexed under every combination of its rel, type and
+# href, so a query for a rel and a type only finds descriptors having a
+# link of that rel and type.
+
+FIELDS = ('subject', 'alias', 'rel', 'type', 'href', 'property')
+LINK_FIELDS = ('rel', 'type', 'href')
+
+
+def _keys(rd):
+    keys = set()
+    if rd.subject:
+        keys.add(('subject', rd.subject))
+    for alias in rd.aliases:
+        keys.add(('alias', alias))
+    for link in rd.links:
+        values = [(field, getattr(link, field)) for field in LINK_FIELDS if getattr(link, field)]
+        keys.update(values)
+        for size in range(2, len(values) + 1):
+            keys.update(('link', combination) for combination in itertools.combinations(values, size))
+    for prop in rd.properties:
+        keys.add(('property', prop.type))
+    return keys
+
+
+def _criteria(*values):
+    # several link criteria become one composite key
+    criteria = [(field, value) for (field, value) in zip(FIELDS, values) if value is not None]
+    link = tuple((field, value) for (field, value) in criteria if field in LINK_FIELDS)
+    if len(link) > 1:
+        criteria = [(field, value) for (field, value) in criteria if field not in LINK_FIELDS]
+        criteria.append(('link', link))
+    return criteria
+
+
+class RDCollection(object):
+
+    def __init__(self, rds=()):
+        self._counter = itertools.count()
+        # position: (rd, keys); positions keep the order descriptors were
+        # added in, a replacement takes the replaced one's position
+        self._members = {}
+        self._positions = {}
+        self._index = dict((field, {}) for field in FIELDS + ('link',))
+        self.extend(rds)
+
+    def __len__(self):
+        return len(self._members)
+
+    def __iter__(self):
+        return (self._members[pos][0] for pos in sorted(self._members))
+
+    def __contains__(self, rd):
+        return id(rd) in self._positions
+
+    def _link(self, pos, rd, keys):
+        self._members[pos] = (rd, keys)
+        self._positions[id(rd)] = pos
+        for (field, value) in keys:
+            self._index[field].setdefault(value, set()).add(pos)
+
+    def _unlink(self, rd):
+        try:
+            pos = self._positions.pop(id(rd))
+        except KeyError:
+            raise ValueError('descriptor is not in the collection')
+        (_, keys) = self._members.pop(pos)
+        for (field, value) in keys:
+            index = self._index[field]
+            positions = index[value]
+            positions.discard(pos)
+            if not positions:
+                del index[value]
+        return pos
+
+    def add(self, rd):
+        if rd in self:
+            raise ValueError('descriptor is already in the collection')
+        self._link(next(self._counter), rd, _keys(rd))
+
+    def extend(self, rds):
+        for rd in rds:
+            self.add(rd)
+
+    def remove(self, rd):
+        self._unlink(rd)
+
+    def replace(self, old, new):
+        # new takes old's place; pass the same RD twice to reindex it
+        # after editing it in place
+        if new is not old and new in self:
+            raise ValueError('descriptor is already in the collection')
+        # keys first, old stays in the collection if they can't be read
+        keys = _keys(new)
+        self._link(self._unlink(old), new, keys)
+
+    def _matches(self, criteria):
+
+        # positions of the descriptors matching every criterion, starting
+        # from the smallest set so the intersection stays small
+
+        sets = []
+        for (field, value) in criteria:
+            positions = self._index[field].get(value)
+            if not positions:
+                return set()
+            sets.append(positions)
+
+        if not sets:
+            return set(self._members)
+
+        sets.sort(key=len)
+        matches = set(sets[0])
+        for positions in sets[1:]:
+            matches.intersection_update(positions)
+            if not matches:
+                break
+        return matches
+
+    def find(self, subject=None, alias=None, rel=None, type=None, href=None, property=None):
+
+        # descriptors matching all of the given criteria, in the order they
+        # were added; with none given, every descriptor
+
+        criteria = _criteria(subject, alias, rel, type, href, property)
+        return [self._members[pos][0] for pos in sorted(self._matches(criteria))]
+
+    def count(self, subject=None, alias=None, rel=None, type=None, href=None, property=None):
+        return len(self._matches(_criteria(subject, alias, rel, type, href, property)))
+
+    def get(self, key):
+
+        # the descriptor with subject key, or failing that alias key, added
+        # first; lets a collection be used as a Server store
+
+        for field in ('subject', 'alias'):
+            positions = self._index[field].get(key)
+            if positions:
+                return self._members[min(positions)][0]
@@ -1,43 +1,250 @@
+import bisect
+import codecs
 import datetime
+import io
+from collections import namedtuple
 import logging
+import mmap
+import os
+import re
 
-JRD_TYPES = ('application/json', 'application/xrd+json', 'text/json')
+JRD_TYPES = ('application/json', 'application/xrd+json', 'text/json', 'application/jrd+json')
 XRD_TYPES = ('application/xrd+xml', 'text/xml')
 
 logger = logging.getLogger("rd")
 
+# files at least this large are memory mapped by load()
+MMAP_THRESHOLD = 1024 * 1024
+
+
+def _key_changed(item):
+    # an indexed key (Link.rel, Property.type, Attribute.name) was
+    # reassigned, so the lists holding the item rebuild their indexes and
+    # drop their RDs' cached serializations
+    owner = item._owner
+    if owner is None:
+        return
+    for lst in ((owner,) if isinstance(owner, IndexedList) else owner):
+        lst._index = None
+        lst._changed()
+
+
+def _item_state(item):
+    # the owning lists aren't pickled with an item, they take it back
+    # when they're rebuilt
+    return (None, dict((name, getattr(item, name))
+                       for cls in type(item).__mro__ for name in getattr(cls, '__slots__', ())
+                       if name != '_owner'))
+
+
+def _set_item_state(item, state):
+    item._owner = None
+    for (name, value) in state[1].items():
+        setattr(item, name, value)
+
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
 
 def _is_str(s):
-    try:
-        return isinstance(s, basestring)
-    except NameError:
-        return isinstance(s, str)
+    return isinstance(s, _string_types)
+
+
+def _encoding_name(encoding):
+    if encoding:
+        return codecs.lookup(encoding).name
+
 
+def _iterencode(parts, encoding=None):
+    # text parts are passed through unless there's an encoding; one
+    # encoder encodes the whole stream, so a BOM is only written once
+    if not encoding:
+        for part in parts:
+            yield part
+        return
+    encoder = codecs.getincrementalencoder(encoding)()
+    for part in parts:
+        data = encoder.encode(part)
+        if data:
+            yield data
+    data = encoder.encode('', True)
+    if data:
+        yield data
 
-def loads(content, content_type):
+
+JRD = 'jrd'
+XRD = 'xrd'
+
+# first character that isn't whitespace, a NUL from UTF-16/32 or part of a BOM
+_SNIFF_BYTES = re.compile(b'[^ \t\r\n\x00\xef\xbb\xbf\xfe\xff]')
+_SNIFF_TEXT = re.compile('[^\\s\ufeff]')
+
+
+def sniff(content):
+    if _is_str(content):
+        match = _SNIFF_TEXT.search(content)
+    else:
+        match = _SNIFF_BYTES.search(content)
+    if match:
+        char = match.group()
+        if char in ('{', b'{'):
+            return JRD
+        if char in ('<', b'<'):
+            return XRD
+
+
+def content_format(content_type):
+    if not content_type:
+        return None
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type in JRD_TYPES or content_type.endswith('+json'):
+        return JRD
+    if content_type in XRD_TYPES or content_type.endswith('+xml') or content_type == 'application/xml':
+        return XRD
+
+
+def loads(content, content_type=None):
 
     from rd import jrd, xrd
 
-    content_type = content_type.split(";")[0]
+    # the content decides; the header is only consulted when it can't
+    fmt = sniff(content) or content_format(content_type)
 
-    if content_type in JRD_TYPES:
+    if fmt == JRD:
         logger.debug("loads() loading JRD")
         return jrd.loads(content)
 
-    elif content_type in XRD_TYPES:
+    elif fmt == XRD:
         logger.debug("loads() loading XRD")
         return xrd.loads(content)
 
 
+def load(source, content_type=None):
+
+    # source may be a path, a binary file object or a bytes-like object;
+    # everything is handed to the parsers as bytes or a memoryview so it
+    # is never decoded to str up front
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return loads(source, content_type)
+
+    if hasattr(source, 'read'):
+        return _load_file(source, content_type)
+
+    with open(source, 'rb') as infile:
+        return _load_file(infile, content_type)
+
+
+def _load_file(fp, content_type):
+
+    try:
+        fileno = fp.fileno()
+        pos = fp.tell()
+        size = os.fstat(fileno).st_size - pos
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        size = None
+
+    if not size or size < MMAP_THRESHOLD:
+        return loads(fp.read(), content_type)
+
+    # a JSON backend that doesn't take buffers would copy the whole map
+    # to bytes, the file is read the usual way for it instead
+    from rd import jrd
+    head = fp.read(1024)
+    fp.seek(pos)
+    if (sniff(head) or content_format(content_type)) == JRD and not jrd.get_backend().buffers:
+        return loads(fp.read(), content_type)
+
+    mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    try:
+        rd = loads(memoryview(mapped)[pos:], content_type)
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # a traceback still holds a view of the map, which is then
+            # closed when it's collected
+            pass
+
+    fp.seek(0, io.SEEK_END)
+    return rd
+
+
+def _descriptor_paths(paths):
+    # files, and the files in directories, in a stable order
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                if not filename.startswith('.'):
+                    yield os.path.join(path, filename)
+        else:
+            yield path
+
+
+def dumps(rd, content_type):
+
+    from rd import jrd, xrd
+
+    fmt = content_format(content_type)
+
+    if fmt == JRD:
+        return jrd.dumps(rd)
+
+    elif fmt == XRD:
+        return xrd.tostring(rd)
+
+    raise ValueError('unsupported content type: %s' % content_type)
+
+
+def iterdumps(rd, content_type, encoding=None):
+
+    from rd import jrd, xrd
+
+    fmt = content_format(content_type)
+
+    if fmt == JRD:
+        return jrd.iterdumps(rd, encoding=encoding)
+
+    elif fmt == XRD:
+        return xrd.iterdumps(rd, encoding=encoding)
+
+    raise ValueError('unsupported content type: %s' % content_type)
+
+
+def dump(rd, fp, content_type, encoding=None):
+    for part in iterdumps(rd, content_type, encoding):
+        fp.write(part)
+
+
 #
 # special XRD types
 #
 
 class Attribute(object):
 
+    __slots__ = ('_name', 'value', '_owner')
+
     def __init__(self, name, value):
-        self.name = name
+        self._name = name
         self.value = value
+        self._owner = None
+
+    def __getstate__(self):
+        return _item_state(self)
+
+    def __setstate__(self, state):
+        _set_item_state(self, state)
+
+    def get_name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+        _key_changed(self)
+    name = property(get_name, set_name)
 
     def __cmp__(self, other):
         return cmp(str(self), str(other))
@@ -48,17 +255,37 @@ class Attribute(object):
     def __str__(self):
         return "%s=%s" % (self.name, self.value)
 
+    def freeze(self):
+        return FrozenAttribute(self._name, self.value)
+
 
 class Element(object):
 
+    __slots__ = ('name', 'value', '_attrs')
+
     def __init__(self, name, value, attrs=None):
         self.name = name
         self.value = value
-        self.attrs = attrs or {}
+        self._attrs = attrs or None
+
+    def get_attrs(self):
+        if self._attrs is None:
+            self._attrs = {}
+        return self._attrs
+
+    def set_attrs(self, attrs):
+        self._attrs = attrs
+    attrs = property(get_attrs, set_attrs)
+
+    def freeze(self):
+        attrs = tuple(sorted(self._attrs.items())) if self._attrs else ()
+        return FrozenElement(self.name, _freeze_value(self.value), attrs)
 
 
 class Title(object):
 
+    __slots__ = ('value', 'lang')
+
     def __init__(self, value, lang=None):
         self.value = value
         self.lang = lang
@@ -74,12 +301,32 @@ class Title(object):
             return "%s:%s" % (self.lang, self.value)
         return self.value
 
+    def freeze(self):
+        return FrozenTitle(self.value, self.lang)
+
 
 class Property(object):
 
+    __slots__ = ('_type', 'value', '_owner')
+
     def __init__(self, type_, value=None):
-        self.type = type_
+        self._type = type_
         self.value = value
+        self._owner = None
+
+    def __getstate__(self):
+        return _item_state(self)
+
+    def __setstate__(self, state):
+        _set_item_state(self, state)
+
+    def get_type(self):
+        return self._type
+
+    def set_type(self, type_):
+        self._type = type_
+        _key_changed(self)
+    type = property(get_type, set_type)
 
     def __cmp__(self, other):
         return cmp(str(self), str(other))
@@ -92,6 +339,9 @@ class Property(object):
             return "%s:%s" % (self.type, self.value)
         return self.type
 
+    def freeze(self):
+        return FrozenProperty(self._type, self.value)
+
 
 #
 # special list types
@@ -99,25 +349,240 @@ class Property(object):
 
 class ListLikeObject(list):
 
+    # _cache is the serialization cache of the RD the list belongs to, if
+    # any, and is cleared on every change.
+
+    __slots__ = ('_cache',)
+
+    def __init__(self, *args):
+        super(ListLikeObject, self).__init__(*args)
+        self._cache = None
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),), (None, {'_cache': self._cache}))
+
+    def _changed(self):
+        if self._cache is not None:
+            self._cache.entries = None
+
     def __setitem__(self, key, value):
-        value = self.item(value)
+        if isinstance(key, slice):
+            value = [self.item(v) for v in value]
+        else:
+            value = self.item(value)
         super(ListLikeObject, self).__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super(ListLikeObject, self).__delitem__(key)
+        self._changed()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __imul__(self, n):
+        result = super(ListLikeObject, self).__imul__(n)
+        self._changed()
+        return result
 
     def append(self, value):
         value = self.item(value)
         super(ListLikeObject, self).append(value)
+        self._changed()
 
     def extend(self, values):
         values = (self.item(value) for value in values)
         super(ListLikeObject, self).extend(values)
+        self._changed()
+
+    def insert(self, pos, value):
+        super(ListLikeObject, self).insert(pos, self.item(value))
+        self._changed()
+
+    def pop(self, *args):
+        value = super(ListLikeObject, self).pop(*args)
+        self._changed()
+        return value
+
+    def remove(self, value):
+        super(ListLikeObject, self).remove(value)
+        self._changed()
+
+    def reverse(self):
+        super(ListLikeObject, self).reverse()
+        self._changed()
+
+    def sort(self, *args, **kwargs):
+        super(ListLikeObject, self).sort(*args, **kwargs)
+        self._changed()
+
+    def clear(self):
+        del self[:]
+
+    # python 2 slicing
+
+    def __setslice__(self, i, j, values):
+        self.__setitem__(slice(i, j), values)
+
+    def __delslice__(self, i, j):
+        self.__delitem__(slice(i, j))
+
+
+class IndexedList(ListLikeObject):
+
+    # Keeps a map of key -> positions for the attribute named by `key` so
+    # lookups don't scan the list. Appends update the index in place;
+    # anything that shifts positions drops it and it's rebuilt on the next
+    # lookup. Items know the lists they're in, from when they're added
+    # until they're removed, and drop those lists' indexes when their key
+    # is reassigned.
+
+    __slots__ = ('_index',)
+
+    key = None
+
+    def __init__(self, *args):
+        super(IndexedList, self).__init__(*args)
+        self._index = None
+        for item in list.__iter__(self):
+            self._take(item)
+
+    def _invalidate(self):
+        self._index = None
+
+    def _take(self, item):
+        owner = item._owner
+        if owner is None:
+            item._owner = self
+        elif owner is self:
+            pass
+        elif isinstance(owner, IndexedList):
+            item._owner = (owner, self)
+        elif not any(lst is self for lst in owner):
+            item._owner = owner + (self,)
+
+    def _release(self, items):
+        # removed items forget the list unless another copy is still in it
+        if not items:
+            return
+        remaining = set(map(id, list.__iter__(self)))
+        for item in items:
+            if id(item) in remaining:
+                continue
+            owner = item._owner
+            if owner is self:
+                item._owner = None
+            elif isinstance(owner, tuple):
+                owner = tuple(lst for lst in owner if lst is not self)
+                item._owner = owner if len(owner) > 1 else owner[0]
+
+    def _add(self, start):
+        index = self._index
+        key = self.key
+        for pos in range(start, len(self)):
+            item = list.__getitem__(self, pos)
+            self._take(item)
+            if index is not None:
+                index.setdefault(getattr(item, key), []).append(pos)
+
+    def _positions(self, key):
+        index = self._index
+        if index is None:
+            self._index = index = {}
+            key_name = self.key
+            for (pos, item) in enumerate(list.__iter__(self)):
+                index.setdefault(getattr(item, key_name), []).append(pos)
+        return index.get(key, ())
+
+    def lookup(self, key):
+        return [list.__getitem__(self, pos) for pos in self._positions(key)]
+
+    def first(self, keys):
+        found = [positions[0] for positions in (self._positions(key) for key in keys) if positions]
+        if found:
+            return list.__getitem__(self, min(found))
+
+    def __call__(self, key):
+        return iter(self.lookup(key))
+
+    # mutation
 
+    def __setitem__(self, key, value):
+        index = self._index
+        old = list.__getitem__(self, key)
+        if index is None or isinstance(key, slice):
+            super(IndexedList, self).__setitem__(key, value)
+            self._invalidate()
+            for item in list.__iter__(self):
+                self._take(item)
+            self._release(old if isinstance(key, slice) else [old])
+            return
+        if key < 0:
+            key += len(self)
+        super(IndexedList, self).__setitem__(key, value)
+        index[getattr(old, self.key)].remove(key)
+        item = list.__getitem__(self, key)
+        self._take(item)
+        bisect.insort(index.setdefault(getattr(item, self.key), []), key)
+        self._release([old])
+
+    def __delitem__(self, key):
+        old = list.__getitem__(self, key)
+        super(IndexedList, self).__delitem__(key)
+        self._invalidate()
+        self._release(old if isinstance(key, slice) else [old])
+
+    def __imul__(self, n):
+        old = list(list.__iter__(self)) if n <= 0 else None
+        result = super(IndexedList, self).__imul__(n)
+        self._invalidate()
+        self._release(old)
+        return result
+
+    def append(self, value):
+        super(IndexedList, self).append(value)
+        self._add(len(self) - 1)
+
+    def extend(self, values):
+        start = len(self)
+        super(IndexedList, self).extend(values)
+        self._add(start)
+
+    def insert(self, pos, value):
+        size = len(self)
+        super(IndexedList, self).insert(pos, value)
+        self._invalidate()
+        # where list.insert put it
+        pos = min(max(pos + size if pos < 0 else pos, 0), size)
+        self._take(list.__getitem__(self, pos))
+
+    def pop(self, *args):
+        value = super(IndexedList, self).pop(*args)
+        self._invalidate()
+        self._release([value])
+        return value
 
-class AttributeList(ListLikeObject):
+    def remove(self, value):
+        old = list.__getitem__(self, list.index(self, value))
+        super(IndexedList, self).remove(value)
+        self._invalidate()
+        self._release([old])
 
-    def __call__(self, name):
-        for attr in self:
-            if attr.name == name:
-                yield attr
+    def reverse(self):
+        super(IndexedList, self).reverse()
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        super(IndexedList, self).sort(*args, **kwargs)
+        self._invalidate()
+
+
+class AttributeList(IndexedList):
+
+    __slots__ = ()
+
+    key = 'name'
 
     def item(self, value):
         if isinstance(value, (list, tuple)):
@@ -127,8 +592,18 @@ class AttributeList(ListLikeObject):
         return value
 
 
+class AliasList(ListLikeObject):
+
+    __slots__ = ()
+
+    def item(self, value):
+        return value
+
+
 class ElementList(ListLikeObject):
 
+    __slots__ = ()
+
     def item(self, value):
         if not isinstance(value, Element):
             raise ValueError('value must be an instance of Type')
@@ -137,6 +612,8 @@ class ElementList(ListLikeObject):
 
 class TitleList(ListLikeObject):
 
+    __slots__ = ()
+
     def item(self, value):
         if _is_str(value):
             return Title(value)
@@ -147,25 +624,26 @@ class TitleList(ListLikeObject):
         return value
 
 
-class LinkList(ListLikeObject):
+class LinkList(IndexedList):
+
+    __slots__ = ()
 
-    def __call__(self, rel):
-        for link in self:
-            if link.rel == rel:
-                yield link
+    key = 'rel'
 
     def item(self, value):
         if not isinstance(value, Link):
             raise ValueError('value must be an instance of Link')
+        cache = self._cache
+        if value._cache is not cache:
+            value._adopt(cache)
         return value
 
 
-class PropertyList(ListLikeObject):
+class PropertyList(IndexedList):
 
-    def __call__(self, type_):
-        for prop in self:
-            if prop.type == type_:
-                yield prop
+    __slots__ = ()
+
+    key = 'type'
 
     def item(self, value):
         if _is_str(value):
@@ -183,62 +661,245 @@ class PropertyList(ListLikeObject):
 
 class Link(object):
 
+    # title and property lists are only created once they are accessed,
+    # most links carry neither. _cache is the cache of the RD the link was
+    # added to, or a _CacheGroup when it was added to several.
+
+    __slots__ = ('_rel', '_type', '_href', '_template', '_titles', '_properties', '_cache',
+                 '_owner')
+
     def __init__(self, rel=None, type=None, href=None, template=None):
-        self.rel = rel
-        self.type = type
-        self.href = href
-        self.template = template
-        self._titles = TitleList()
-        self._properties = PropertyList()
+        self._rel = rel
+        self._type = type
+        self._href = href
+        self._template = template
+        self._titles = None
+        self._properties = None
+        self._cache = None
+        self._owner = None
+
+    def __getstate__(self):
+        return _item_state(self)
+
+    def __setstate__(self, state):
+        _set_item_state(self, state)
+
+    def _changed(self):
+        if self._cache is not None:
+            self._cache.entries = None
+
+    def _adopt(self, cache):
+        current = self._cache
+        if cache is None or cache is current:
+            return
+        if current is None:
+            pass
+        elif isinstance(current, _CacheGroup):
+            current.caches.add(cache)
+            return
+        else:
+            cache = _CacheGroup((current, cache))
+        self._cache = cache
+        if self._titles is not None:
+            self._titles._cache = cache
+        if self._properties is not None:
+            self._properties._cache = cache
+
+    def get_rel(self):
+        return self._rel
+
+    def set_rel(self, rel):
+        self._rel = rel
+        _key_changed(self)
+        self._changed()
+    rel = property(get_rel, set_rel)
+
+    def get_type(self):
+        return self._type
+
+    def set_type(self, type_):
+        self._type = type_
+        self._changed()
+    type = property(get_type, set_type)
+
+    def get_href(self):
+        return self._href
+
+    def set_href(self, href):
+        self._href = href
+        self._changed()
+    href = property(get_href, set_href)
+
+    def get_template(self):
+        return self._template
+
+    def set_template(self, template):
+        self._template = template
+        self._changed()
+    template = property(get_template, set_template)
 
     def get_titles(self):
+        if self._titles is None:
+            self._titles = TitleList()
+            self._titles._cache = self._cache
         return self._titles
     titles = property(get_titles)
 
     def get_properties(self):
+        if self._properties is None:
+            self._properties = PropertyList()
+            self._properties._cache = self._cache
         return self._properties
     properties = property(get_properties)
 
+    def has_titles(self):
+        return bool(self._titles)
+
+    def has_properties(self):
+        return bool(self._properties)
+
+    def expand(self, values=None, **kwargs):
+        return _compiled_template(self._template).expand(values, **kwargs)
+
+    def expand_all(self, values):
+        return _compiled_template(self._template).expand_all(values)
+
+    def freeze(self, memo=None):
+        return _freeze_link(self, {} if memo is None else memo)
+
+
+def _compiled_template(template):
+    from rd.template import compile
+    if not template:
+        raise ValueError('link has no template')
+    return compile(template)
+
 
 #
 # main RD class
 #
 
+class _SerializationCache(object):
+
+    # Shared by an RD with its lists and links, so a change anywhere in
+    # the descriptor drops the entries without the parts referring back to
+    # the RD. The entries themselves are never pickled or copied.
+
+    __slots__ = ('entries',)
+
+    def __init__(self):
+        self.entries = None
+
+    def __reduce__(self):
+        return (_SerializationCache, ())
+
+
+class _CacheGroup(object):
+
+    # the caches of every RD a shared link was added to; a change to the
+    # link clears all of them
+
+    __slots__ = ('caches',)
+
+    def __init__(self, caches):
+        self.caches = set(caches)
+
+    def get_entries(self):
+        return None
+
+    def set_entries(self, entries):
+        for cache in self.caches:
+            cache.entries = entries
+    entries = property(get_entries, set_entries)
+
+
 class RD(object):
 
+    # Serialized forms are cached until the RD changes. Changes through
+    # the RD, its lists and links are tracked; values edited inside a
+    # Title, Property, Attribute or Element are not, call changed() after
+    # doing that.
+
     def __init__(self, xml_id=None, subject=None):
 
-        self.xml_id = xml_id
-        self.subject = subject
+        self._cache = _SerializationCache()
+        self._snapshot = None
+
+        self._xml_id = xml_id
+        self._subject = subject
         self._expires = None
-        self._aliases = []
-        self._properties = PropertyList()
-        self._links = LinkList()
+        self._aliases = self._own(AliasList())
+        self._properties = self._own(PropertyList())
+        self._links = self._own(LinkList())
         self._signatures = []
 
-        self._attributes = AttributeList()
-        self._elements = ElementList()
+        self._attributes = self._own(AttributeList())
+        self._elements = self._own(ElementList())
+
+    def _own(self, lst):
+        lst._cache = self._cache
+        return lst
+
+    def changed(self):
+        self._cache.entries = None
+    _changed = changed
+
+    def _cached(self, key, build):
+        # a change made while building replaces the entries, so the result
+        # lands in the dropped dict and is never served stale
+        cache = self._cache
+        entries = cache.entries
+        if entries is None:
+            entries = cache.entries = {}
+        try:
+            return entries[key]
+        except KeyError:
+            value = entries[key] = build()
+            return value
+
+    def _keep_source(self, fmt, content, encoding=None):
+        # the document this RD was parsed from is served until it changes;
+        # bytes are kept under the encoding they're in, text under None
+        if isinstance(content, bytes) and encoding:
+            self._cache.entries = {(fmt, _encoding_name(encoding)): content}
+        elif _is_str(content):
+            self._cache.entries = {(fmt, None): content}
+
+    def _serialized(self, fmt, encoding, build):
+        encoding = _encoding_name(encoding)
+        entries = self._cache.entries
+        if entries is not None and (fmt, encoding) not in entries:
+            for ((cached_fmt, cached_encoding), content) in list(entries.items()):
+                if cached_fmt != fmt or cached_encoding == encoding:
+                    continue
+                if encoding is None:
+                    return self._cached((fmt, None), lambda: content.decode(cached_encoding))
+                if fmt == JRD and cached_encoding is None:
+                    return self._cached((fmt, encoding), lambda: content.encode(encoding))
+        return self._cached((fmt, encoding), build)
 
     # ser/deser methods
 
-    def to_json(self):
+    def to_json(self, encoding=None):
         from rd import jrd
-        return jrd.dumps(self)
+        return self._serialized(JRD, encoding, lambda: jrd.dumps(self, encoding=encoding))
 
-    def to_xml(self):
+    def to_xml(self, dom=True, encoding=None):
         from rd import xrd
-        return xrd.dumps(self)
+        if dom:
+            # a DOM can be modified by the caller, so it's never cached
+            return xrd.dumps(self)
+        return self._serialized(XRD, encoding, lambda: xrd.tostring(self, encoding))
 
     # helper methods
 
     def find_link(self, rels, attr=None):
         if not isinstance(rels, (list, tuple)):
             rels = (rels,)
-        for link in self.links:
-            if link.rel in rels:
-                if attr:
-                    return getattr(link, attr, None)
-                return link
+        link = self.links.first(rels)
+        if link is not None and attr:
+            return getattr(link, attr, None)
+        return link
 
     # custom elements and attributes
 
@@ -252,6 +913,22 @@ class RD(object):
 
     # defined elements and attributes
 
+    def get_xml_id(self):
+        return self._xml_id
+
+    def set_xml_id(self, xml_id):
+        self._xml_id = xml_id
+        self._changed()
+    xml_id = property(get_xml_id, set_xml_id)
+
+    def get_subject(self):
+        return self._subject
+
+    def set_subject(self, subject):
+        self._subject = subject
+        self._changed()
+    subject = property(get_subject, set_subject)
+
     def get_expires(self):
         return self._expires
 
@@ -259,6 +936,7 @@ class RD(object):
         if not isinstance(expires, datetime.datetime):
             raise ValueError('expires must be a datetime object')
         self._expires = expires
+        self._changed()
     expires = property(get_expires, set_expires)
 
     def get_aliases(self):
@@ -276,3 +954,265 @@ class RD(object):
     def get_signatures(self):
         return self._signatures
     signatures = property(get_links)
+
+    # snapshots
+
+    def freeze(self):
+        return self._cached(('frozen', None), self._freeze)
+
+    def _freeze(self):
+
+        # Links, properties and titles equal to ones in the previous
+        # snapshot are reused from it, so consecutive snapshots share
+        # everything that didn't change.
+
+        previous = self._snapshot
+        memo = previous._memo() if previous is not None else {}
+
+        snapshot = FrozenRD(
+            xml_id=self.xml_id,
+            subject=self.subject,
+            expires=self._expires,
+            aliases=tuple(self.aliases),
+            properties=tuple(_intern(memo, prop.freeze()) for prop in self.properties),
+            links=tuple(_freeze_link(link, memo) for link in self.links),
+            elements=tuple(elem.freeze() for elem in self.elements),
+            attributes=tuple(attr.freeze() for attr in self.attributes),
+        )
+
+        if snapshot == previous:
+            return previous
+        self._snapshot = snapshot
+        return snapshot
+
+
+#
+# frozen snapshots
+#
+
+# Immutable, hashable counterparts of the model classes. They have the
+# same read-only interface, so they can be serialized and searched like
+# the mutable objects and shared between threads without copying.
+
+class FrozenAttribute(namedtuple('FrozenAttribute', 'name value')):
+
+    __slots__ = ()
+
+    def thaw(self):
+        return Attribute(self.name, self.value)
+
+
+class FrozenElement(namedtuple('FrozenElement', 'name value attrs')):
+
+    __slots__ = ()
+
+    def thaw(self):
+        return Element(self.name, _thaw_value(self.value), dict(self.attrs))
+
+
+class FrozenDict(dict):
+
+    # JRD extension objects in a snapshot; a dict, so it serializes like
+    # one, but immutable and hashable
+
+    __slots__ = ('_hash',)
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('FrozenDict is immutable')
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(frozenset(self.items()))
+            return self._hash
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def _freeze_value(value):
+    # JRD extension values can be any JSON; lists become tuples and
+    # objects FrozenDicts, all the way down
+    if isinstance(value, dict):
+        if isinstance(value, FrozenDict):
+            return value
+        return FrozenDict((k, _freeze_value(v)) for (k, v) in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_value(v) for v in value)
+    return value
+
+
+def _thaw_value(value):
+    if isinstance(value, dict):
+        return dict((k, _thaw_value(v)) for (k, v) in value.items())
+    if isinstance(value, tuple):
+        return [_thaw_value(v) for v in value]
+    return value
+
+
+class FrozenTitle(namedtuple('FrozenTitle', 'value lang')):
+
+    __slots__ = ()
+
+    def thaw(self):
+        return Title(self.value, self.lang)
+
+
+class FrozenProperty(namedtuple('FrozenProperty', 'type value')):
+
+    __slots__ = ()
+
+    def thaw(self):
+        return Property(self.type, self.value)
+
+
+class FrozenLink(namedtuple('FrozenLink', 'rel type href template titles properties')):
+
+    __slots__ = ()
+
+    def has_titles(self):
+        return bool(self.titles)
+
+    def has_properties(self):
+        return bool(self.properties)
+
+    def expand(self, values=None, **kwargs):
+        return _compiled_template(self.template).expand(values, **kwargs)
+
+    def expand_all(self, values):
+        return _compiled_template(self.template).expand_all(values)
+
+    def thaw(self):
+        link = Link(self.rel, self.type, self.href, self.template)
+        if self.titles:
+            link.titles.extend(title.thaw() for title in self.titles)
+        if self.properties:
+            link.properties.extend(prop.thaw() for prop in self.properties)
+        return link
+
+
+def _intern(memo, obj):
+    return memo.setdefault(obj, obj)
+
+
+def _freeze_link(link, memo):
+    titles = ()
+    if link.has_titles():
+        titles = tuple(_intern(memo, title.freeze()) for title in link.titles)
+    properties = ()
+    if link.has_properties():
+        properties = tuple(_intern(memo, prop.freeze()) for prop in link.properties)
+    return _intern(memo, FrozenLink(link.rel, link.type, link.href, link.template,
+                                    titles, properties))
+
+
+class FrozenRD(object):
+
+    __slots__ = ('xml_id', 'subject', 'expires', 'aliases', 'properties', 'links',
+                 'elements', 'attributes', '_hash', '_rels')
+
+    _fields = ('xml_id', 'subject', 'expires', 'aliases', 'properties', 'links',
+               'elements', 'attributes')
+
+    def __init__(self, xml_id=None, subject=None, expires=None, aliases=(), properties=(),
+                 links=(), elements=(), attributes=()):
+        setter = super(FrozenRD, self).__setattr__
+        setter('xml_id', xml_id)
+        setter('subject', subject)
+        setter('expires', expires)
+        setter('aliases', tuple(aliases))
+        setter('properties', tuple(properties))
+        setter('links', tuple(links))
+        setter('elements', tuple(elements))
+        setter('attributes', tuple(attributes))
+        setter('_hash', None)
+        setter('_rels', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FrozenRD is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('FrozenRD is immutable')
+
+    def __reduce__(self):
+        return (FrozenRD, self._key())
+
+    def _key(self):
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def _memo(self):
+        memo = {}
+        for prop in self.properties:
+            memo[prop] = prop
+        for link in self.links:
+            memo[link] = link
+            for title in link.titles:
+                memo[title] = title
+            for prop in link.properties:
+                memo[prop] = prop
+        return memo
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, FrozenRD):
+            return NotImplemented
+        return hash(self) == hash(other) and self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        # caching races are harmless, every thread computes the same value
+        if self._hash is None:
+            super(FrozenRD, self).__setattr__('_hash', hash(self._key()))
+        return self._hash
+
+    # the same read interface as RD
+
+    def to_json(self, encoding=None):
+        from rd import jrd
+        return jrd.dumps(self, encoding=encoding)
+
+    def to_xml(self, dom=True, encoding=None):
+        from rd import xrd
+        if dom:
+            return xrd.dumps(self)
+        return xrd.tostring(self, encoding)
+
+    def find_link(self, rels, attr=None):
+        if not isinstance(rels, (list, tuple)):
+            rels = (rels,)
+        if self._rels is None:
+            index = {}
+            for (pos, link) in enumerate(self.links):
+                index.setdefault(link.rel, pos)
+            super(FrozenRD, self).__setattr__('_rels', index)
+        positions = [self._rels[rel] for rel in rels if rel in self._rels]
+        if positions:
+            link = self.links[min(positions)]
+            if attr:
+                return getattr(link, attr, None)
+            return link
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        rd = RD(self.xml_id, self.subject)
+        if self.expires is not None:
+            rd.expires = self.expires
+        rd.aliases.extend(self.aliases)
+        rd.properties.extend(prop.thaw() for prop in self.properties)
+        rd.links.extend(link.thaw() for link in self.links)
+        rd.elements.extend(elem.thaw() for elem in self.elements)
+        rd.attributes.extend(attr.thaw() for attr in self.attributes)
+        rd._snapshot = self
+        rd._cache.entries = {('frozen', None): self}
+        return rd
@@ -0,0 +1,313 @@
+from __future__ import unicode_literals
+from collections import Counter
+
+import isodate
+
+from rd.core import Element, Link, _freeze_value, _thaw_value
+
+# A delta is a dict made of JSON types, so it can be encoded with any of
+# the JRD backends and sent to another node. Only members that differ are
+# present and an empty delta means the descriptors are equal; the order
+# of items within a member isn't compared.
+#
+#   subject, xml_id, expires   [old, new]
+#   aliases                    {"removed": [alias], "added": [alias]}
+#   properties                 {"removed": [[type, value]], "added": [...]}
+#   attributes, elements       {"removed": [[name, value]], "added": [...]}
+#   links                      {"removed": [ref], "added": [link],
+#                               "changed": [{"link": ref, "titles": {...},
+#                                            "properties": {...}}]}
+#
+# Links are matched by rel, type, href and template. A ref is those four
+# values followed by the link's position among links with the same four,
+# since a descriptor may repeat them.
+
+LINK_KEY = ('rel', 'type', 'href', 'template')
+
+
+def _link_key(link):
+    return (link.rel, link.type, link.href, link.template)
+
+
+def _titles(link):
+    if not link.has_titles():
+        return []
+    return [(title.value, title.lang) for title in link.titles]
+
+
+def _properties(obj):
+    return [(prop.type, prop.value) for prop in obj.properties]
+
+
+def _link_properties(link):
+    if not link.has_properties():
+        return []
+    return _properties(link)
+
+
+def _multiset_diff(old, new):
+
+    # items are compared as a multiset; added items keep the order they
+    # have in new
+
+    if old == new:
+        return {}
+
+    remaining = Counter(old)
+    added = []
+    for item in new:
+        if remaining[item] > 0:
+            remaining[item] -= 1
+        else:
+            added.append(item)
+
+    extra = Counter(new)
+    removed = []
+    for item in old:
+        if extra[item] > 0:
+            extra[item] -= 1
+        else:
+            removed.append(item)
+
+    changes = {}
+    if removed:
+        changes['removed'] = [_pair(item) for item in removed]
+    if added:
+        changes['added'] = [_pair(item) for item in added]
+    return changes
+
+
+def _pair(item):
+    if isinstance(item, tuple):
+        return [_thaw_value(value) for value in item]
+    return item
+
+
+def _elements(rd):
+    # extension values may be JSON objects and arrays, which are frozen so
+    # they can be counted
+    return [(elem.name, _freeze_value(elem.value)) for elem in rd.elements]
+
+
+def _group_links(links):
+    groups = {}
+    for link in links:
+        groups.setdefault(_link_key(link), []).append(link)
+    return groups
+
+
+def _link_doc(link):
+    doc = dict(zip(LINK_KEY, _link_key(link)))
+    titles = _titles(link)
+    if titles:
+        doc['titles'] = [list(title) for title in titles]
+    properties = _link_properties(link)
+    if properties:
+        doc['properties'] = [list(prop) for prop in properties]
+    return doc
+
+
+def _diff_links(old, new):
+
+    old_groups = _group_links(old)
+    new_groups = _group_links(new)
+
+    removed = []
+    changed = []
+    for (key, links) in old_groups.items():
+        others = new_groups.get(key, ())
+        for (pos, link) in enumerate(links):
+            if pos >= len(others):
+                removed.append(list(key) + [pos])
+                continue
+            if link is others[pos]:
+                # snapshots share links that didn't change
+                continue
+            entry = {}
+            titles = _multiset_diff(_titles(link), _titles(others[pos]))
+            if titles:
+                entry['titles'] = titles
+            properties = _multiset_diff(_link_properties(link), _link_properties(others[pos]))
+            if properties:
+                entry['properties'] = properties
+            if entry:
+                entry['link'] = list(key) + [pos]
+                changed.append(entry)
+
+    # links are paired by position within their key, so only the ones past
+    # the old count for their key are new
+    added = []
+    seen = Counter()
+    for link in new:
+        key = _link_key(link)
+        seen[key] += 1
+        if seen[key] > len(old_groups.get(key, ())):
+            added.append(_link_doc(link))
+
+    changes = {}
+    if removed:
+        changes['removed'] = removed
+    if added:
+        changes['added'] = added
+    if changed:
+        changes['changed'] = changed
+    return changes
+
+
+def _expires(rd):
+    if rd.expires is not None:
+        return rd.expires.isoformat()
+
+
+def diff(a, b):
+
+    # a and b may be RD or FrozenRD instances
+
+    delta = {}
+
+    for (name, old, new) in (('subject', a.subject, b.subject),
+                             ('xml_id', a.xml_id, b.xml_id),
+                             ('expires', _expires(a), _expires(b))):
+        if old != new:
+            delta[name] = [old, new]
+
+    members = (
+        ('aliases', list(a.aliases), list(b.aliases)),
+        ('properties', _properties(a), _properties(b)),
+        ('attributes', [(attr.name, attr.value) for attr in a.attributes],
+                       [(attr.name, attr.value) for attr in b.attributes]),
+        ('elements', _elements(a), _elements(b)),
+    )
+    for (name, old, new) in members:
+        changes = _multiset_diff(old, new)
+        if changes:
+            delta[name] = changes
+
+    links = _diff_links(a.links, b.links)
+    if links:
+        delta['links'] = links
+
+    return delta
+
+
+#
+# patching
+#
+
+def _check(expected, actual, what):
+    if expected != actual:
+        raise ValueError('delta does not apply: %s is %r, expected %r' % (what, actual, expected))
+
+
+def _item(item):
+    return tuple(item) if isinstance(item, list) else item
+
+
+def _patch_list(lst, changes, key, what, make=_item):
+
+    # removals are matched against the items present before anything is
+    # added, so an item added by the delta is never removed by it
+
+    removed = changes.get('removed')
+    if removed:
+        positions = {}
+        for (pos, existing) in enumerate(lst):
+            positions.setdefault(key(existing), []).append(pos)
+        drop = set()
+        for item in removed:
+            found = positions.get(_freeze_value(item))
+            if not found:
+                raise ValueError('delta does not apply: %s %r not found' % (what, item))
+            drop.add(found.pop(0))
+        lst[:] = [existing for (pos, existing) in enumerate(lst) if pos not in drop]
+
+    added = changes.get('added')
+    if added:
+        lst.extend(make(item) for item in added)
+
+
+def _resolve(groups, ref):
+    key = tuple(ref[:4])
+    links = groups.get(key, ())
+    if ref[4] >= len(links):
+        raise ValueError('delta does not apply: link %r not found' % (key,))
+    return links[ref[4]]
+
+
+def _new_link(doc):
+    link = Link(*(doc.get(name) for name in LINK_KEY))
+    for (value, lang) in doc.get('titles', ()):
+        link.titles.append((value, lang))
+    for (ptype, value) in doc.get('properties', ()):
+        link.properties.append((ptype, value))
+    return link
+
+
+def patch(rd, delta):
+
+    # Applies a delta from diff to rd in place. Raises ValueError, leaving
+    # rd partly patched, when rd isn't in the state the delta was made
+    # from.
+
+    if 'subject' in delta:
+        _check(delta['subject'][0], rd.subject, 'subject')
+        rd.subject = delta['subject'][1]
+
+    if 'xml_id' in delta:
+        _check(delta['xml_id'][0], rd.xml_id, 'xml_id')
+        rd.xml_id = delta['xml_id'][1]
+
+    if 'expires' in delta:
+        _check(delta['expires'][0], _expires(rd), 'expires')
+        expires = delta['expires'][1]
+        if expires is None:
+            rd._expires = None
+            rd.changed()
+        else:
+            rd.expires = isodate.parse_datetime(expires)
+
+    if 'aliases' in delta:
+        _patch_list(rd.aliases, delta['aliases'], lambda alias: alias, 'alias')
+
+    if 'properties' in delta:
+        _patch_list(rd.properties, delta['properties'],
+                    lambda prop: (prop.type, prop.value), 'property')
+
+    if 'attributes' in delta:
+        _patch_list(rd.attributes, delta['attributes'],
+                    lambda attr: (attr.name, attr.value), 'attribute')
+
+    if 'elements' in delta:
+        _patch_list(rd.elements, delta['elements'],
+                    lambda elem: (elem.name, _freeze_value(elem.value)), 'element',
+                    make=lambda item: Element(*item))
+
+    links = delta.get('links')
+    if links:
+        # refs point into the links as they were before patching
+        groups = _group_links(rd.links)
+        removed = set(id(_resolve(groups, ref)) for ref in links.get('removed', ()))
+        for change in links.get('changed', ()):
+            link = _resolve(groups, change['link'])
+            if 'titles' in change:
+                _patch_list(link.titles, change['titles'],
+                            lambda title: (title.value, title.lang), 'title')
+            if 'properties' in change:
+                _patch_list(link.properties, change['properties'],
+                            lambda prop: (prop.type, prop.value), 'property')
+        if removed:
+            rd.links[:] = [link for link in rd.links if id(link) not in removed]
+        rd.links.extend(_new_link(doc) for doc in links.get('added', ()))
+
+    return rd
+
+
+def changed_rels(delta):
+
+    # the rels of every link the delta adds, removes or changes
+
+    links = delta.get('links', {})
+    rels = set(ref[0] for ref in links.get('removed', ()))
+    rels.update(doc.get('rel') for doc in links.get('added', ()))
+    rels.update(change['link'][0] for change in links.get('changed', ()))
+    return rels
@@ -0,0 +1,144 @@
+from __future__ import unicode_literals
+import asyncio
+import functools
+from concurrent import futures
+from urllib.parse import urlsplit
+from xml.parsers.expat import ExpatError
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rd import template as uritemplate
+from rd.core import JRD_TYPES, XRD_TYPES, loads
+
+HOST_META_PATH = '/.well-known/host-meta'
+WEBFINGER_PATH = '/.well-known/webfinger'
+
+
+class DiscoveryError(Exception):
+    pass
+
+
+def accept_header(prefer='json'):
+    if prefer == 'json':
+        (preferred, fallback) = (JRD_TYPES, XRD_TYPES)
+    else:
+        (preferred, fallback) = (XRD_TYPES, JRD_TYPES)
+    types = list(preferred) + ['%s;q=0.5' % t for t in fallback]
+    return ', '.join(types)
+
+
+def resource_host(resource):
+    parts = urlsplit(resource)
+    if parts.netloc:
+        return parts.netloc.rsplit('@', 1)[-1]
+    if '@' in parts.path:
+        return parts.path.rsplit('@', 1)[-1]
+    raise DiscoveryError('unable to determine host of %s' % resource)
+
+
+class DiscoveryClient(object):
+
+    # Fetches host-meta, LRDD and WebFinger descriptors. Requests run on a
+    # thread pool through a shared requests.Session, so connections are
+    # kept alive and pooled per host; a semaphore bounds how many are in
+    # flight at once. Host-meta documents are kept in `cache` (a
+    # DescriptorCache) when one is given.
+
+    def __init__(self, scheme='https', max_concurrency=10, timeout=10.0,
+                 prefer='json', session=None, cache=None):
+
+        self.scheme = scheme
+        self.cache = cache
+        self.timeout = timeout
+        self.prefer = prefer
+        self.accept = accept_header(prefer)
+        self.max_concurrency = max_concurrency
+
+        self._owns_session = session is None
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_concurrency, pool_maxsize=max_concurrency)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._owns_session:
+            self.session.close()
+
+    def url(self, host, path):
+        return '%s://%s%s' % (self.scheme, host, path)
+
+    # fetching
+
+    def _fetch(self, url, params=None):
+
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout,
+                                        headers={'Accept': self.accept})
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise DiscoveryError('unable to fetch %s: %s' % (url, e))
+
+        content_type = response.headers.get('Content-Type', '')
+        try:
+            rd = loads(response.content, content_type)
+        except (ExpatError, AttributeError, KeyError, TypeError, ValueError) as e:
+            # malformed XML, JSON or dates, or JSON that isn't a JRD object
+            raise DiscoveryError('unable to parse %s: %s' % (url, e))
+        if rd is None:
+            raise DiscoveryError('unsupported content type from %s: %s' % (url, content_type))
+        return rd
+
+    async def fetch(self, url, params=None):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            return await loop.run_in_executor(
+                self._executor, functools.partial(self._fetch, url, params))
+
+    # discovery
+
+    async def host_meta(self, host):
+        url = self.url(host, HOST_META_PATH)
+        if self.cache is None:
+            return await self.fetch(url)
+        rd = self.cache.get(url)
+        if rd is None:
+            rd = await self.fetch(url)
+            self.cache.set(url, rd)
+        return rd
+
+    def lrdd_template(self, host_meta):
+        preferred = JRD_TYPES if self.prefer == 'json' else XRD_TYPES
+        templates = [link for link in host_meta.links('lrdd') if link.template]
+        for link in templates:
+            if link.type in preferred:
+                return link.template
+        if templates:
+            return templates[0].template
+
+    async def lrdd(self, resource, host=None):
+        host = host or resource_host(resource)
+        template = self.lrdd_template(await self.host_meta(host))
+        if template is None:
+            raise DiscoveryError('host-meta for %s has no lrdd template' % host)
+        return await self.fetch(uritemplate.compile(template).expand(uri=resource))
+
+    async def webfinger(self, resource, rels=None, host=None):
+        host = host or resource_host(resource)
+        params = [('resource', resource)]
+        params.extend(('rel', rel) for rel in rels or ())
+        return await self.fetch(self.url(host, WEBFINGER_PATH), params)
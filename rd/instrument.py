@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+import contextlib
+import logging
+import time
+
+logger = logging.getLogger("rd")
+
+# python 2 has no perf_counter
+clock = getattr(time, 'perf_counter', time.time)
+
+# callables invoked with a Probe after each instrumented loads/dumps call;
+# while this is empty instrumentation costs a single truthiness check
+listeners = []
+
+
+def add_listener(listener):
+    listeners.append(listener)
+
+
+def remove_listener(listener):
+    listeners.remove(listener)
+
+
+@contextlib.contextmanager
+def listening(listener):
+    add_listener(listener)
+    try:
+        yield listener
+    finally:
+        remove_listener(listener)
+
+
+class Probe(object):
+
+    # Collects per-phase timings, object counts and byte sizes for one
+    # call. Timings are the seconds elapsed since the previous mark.
+
+    __slots__ = ('operation', 'format', 'timings', 'counts', 'input_size',
+                 'output_size', '_last')
+
+    def __init__(self, operation, format):
+        self.operation = operation
+        self.format = format
+        self.timings = {}
+        self.counts = {}
+        self.input_size = None
+        self.output_size = None
+        self._last = clock()
+
+    def mark(self, phase):
+        now = clock()
+        self.timings[phase] = self.timings.get(phase, 0.0) + (now - self._last)
+        self._last = now
+
+    def count_rd(self, rd):
+        links = rd.links
+        self.counts['links'] = len(links)
+        self.counts['properties'] = len(rd.properties) + sum(
+            len(link.properties) for link in links if link.has_properties())
+        self.counts['titles'] = sum(len(link.titles) for link in links if link.has_titles())
+        self.counts['unknown'] = len(rd.elements)
+
+    @property
+    def total(self):
+        return sum(self.timings.values())
+
+    def emit(self):
+        for listener in list(listeners):
+            try:
+                listener(self)
+            except Exception:
+                logger.exception("instrumentation listener %r failed", listener)
+
+
+def probe(operation, format):
+    if listeners:
+        return Probe(operation, format)
+
+
+def size_of(content):
+    # in bytes, text is measured as UTF-8; None for files
+    if isinstance(content, memoryview):
+        return len(content) * content.itemsize
+    if isinstance(content, type('')):
+        return len(content.encode('utf-8'))
+    try:
+        return len(content)
+    except TypeError:
+        return None
@@ -1,17 +1,259 @@
 from __future__ import unicode_literals
+import codecs
 import json
 import isodate
 
-from rd.core import RD, Attribute, Element, Link, Property, Title
+try:
+    from json import detect_encoding
+except ImportError:
+    # python 2
+    def detect_encoding(b):
+        b = bytearray(b[:4])
+        if b[:4] in (codecs.BOM_UTF32_BE, codecs.BOM_UTF32_LE):
+            return 'utf-32'
+        if b[:2] in (codecs.BOM_UTF16_BE, codecs.BOM_UTF16_LE):
+            return 'utf-16'
+        if len(b) >= 4:
+            if not b[0]:
+                return 'utf-16-be' if b[1] else 'utf-32-be'
+            if not b[1]:
+                return 'utf-16-le' if b[2] or b[3] else 'utf-32-le'
+        elif len(b) == 2:
+            if not b[0]:
+                return 'utf-16-be'
+            if not b[1]:
+                return 'utf-16-le'
+        return 'utf-8'
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+from rd import instrument
+from rd.core import (JRD, RD, Attribute, Element, Link, LinkList, Property,
+                     PropertyList, Title, TitleList, _iterencode)
+
+
+#
+# JSON backends
+#
+
+class Backend(object):
+
+    # dumps returns text, dumps_bytes UTF-8 encoded bytes; codecs that
+    # produce bytes natively provide dumps_bytes directly so nothing is
+    # decoded and re-encoded on the way out. buffers is set when loads
+    # accepts memoryviews, otherwise they are copied to bytes first.
 
-def _clean_dict(d):
-    for key in list(d.keys()):
-        if not d[key]:
-            del d[key]
-
-
-def loads(content):
+    def __init__(self, name, loads, dumps, dumps_bytes=None, buffers=False):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.dumps_bytes = dumps_bytes or (lambda obj: dumps(obj).encode('utf-8'))
+        self.buffers = buffers
+
+
+BACKENDS = {}
+
+# fastest first, used to pick the default backend. Documents a faster
+# backend rejects are decoded again with the standard library, so the
+# inputs that are accepted don't depend on what is installed.
+PREFERRED_BACKENDS = ('orjson', 'ujson', 'simplejson', 'json')
+
+_default_backend = None
+
+
+def register_backend(backend):
+    BACKENDS[backend.name] = backend
+
+
+def get_backend(name=None):
+    if name is None:
+        return _default_backend
+    if isinstance(name, Backend):
+        return name
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError('unknown JSON backend: %s' % name)
+
+
+def set_backend(name=None):
+    # None selects the fastest installed backend
+    global _default_backend
+    if name is None:
+        name = [n for n in PREFERRED_BACKENDS if n in BACKENDS][0]
+    _default_backend = get_backend(name)
+
+
+register_backend(Backend('json', json.loads, json.dumps))
+
+if orjson is not None:
+    register_backend(Backend(
+        'orjson',
+        orjson.loads,
+        lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8'),
+        lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS),
+        buffers=True,
+    ))
+
+if ujson is not None:
+    register_backend(Backend(
+        'ujson',
+        ujson.loads,
+        lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False),
+    ))
+
+if simplejson is not None:
+    register_backend(Backend('simplejson', simplejson.loads, simplejson.dumps))
+
+set_backend()
+
+
+def _load_titles(titles, val):
+    titles.extend(Title(tvalue, None if tlang == 'default' else tlang)
+                  for tlang, tvalue in val.items())
+
+
+def _load_properties(properties, val):
+    properties.extend(Property(ptype, pvalue) for ptype, pvalue in val.items())
+
+
+def _load_link(val):
+    link = Link(
+        rel=val.get('rel', None),
+        type=val.get('type', None),
+        href=val.get('href', None),
+        template=val.get('template', None),
+    )
+    if 'titles' in val:
+        _load_titles(link.titles, val['titles'])
+    if 'properties' in val:
+        _load_properties(link.properties, val['properties'])
+    return link
+
+
+#
+# lazy loading
+#
+
+class LazyLink(Link):
+
+    # titles and properties are built from the decoded JSON on first access
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data):
+        super(LazyLink, self).__init__(
+            rel=data.get('rel', None),
+            type=data.get('type', None),
+            href=data.get('href', None),
+            template=data.get('template', None),
+        )
+        self._data = data
+
+    # lists are filled before they share the RD's cache, building them
+    # isn't a change
+
+    def get_titles(self):
+        if self._titles is None:
+            titles = TitleList()
+            _load_titles(titles, self._data.get('titles', {}))
+            titles._cache = self._cache
+            self._titles = titles
+        return self._titles
+    titles = property(get_titles)
+
+    def get_properties(self):
+        if self._properties is None:
+            properties = PropertyList()
+            _load_properties(properties, self._data.get('properties', {}))
+            properties._cache = self._cache
+            self._properties = properties
+        return self._properties
+    properties = property(get_properties)
+
+    def has_titles(self):
+        if self._titles is None:
+            return bool(self._data.get('titles'))
+        return bool(self._titles)
+
+    def has_properties(self):
+        if self._properties is None:
+            return bool(self._data.get('properties'))
+        return bool(self._properties)
+
+
+class LazyRD(RD):
+
+    # links and properties are built from the decoded JSON on first access;
+    # find_link only builds the links it returns until then
+
+    def __init__(self, links=None, properties=None):
+        super(LazyRD, self).__init__()
+        self._links = None
+        self._properties = None
+        self._link_data = links or []
+        self._property_data = properties or {}
+        self._built = {}
+
+    def _link(self, pos):
+        link = self._built.get(pos)
+        if link is None:
+            # edits to a link handed out before the list is built still
+            # clear the RD's cached serializations
+            link = self._built[pos] = LazyLink(self._link_data[pos])
+            link._adopt(self._cache)
+        return link
+
+    # building the lists isn't a change, cached serializations are kept
+
+    def get_links(self):
+        if self._links is None:
+            entries = self._cache.entries
+            links = self._own(LinkList())
+            links.extend(self._link(pos) for pos in range(len(self._link_data)))
+            self._cache.entries = entries
+            self._links = links
+            self._built = None
+        return self._links
+    links = property(get_links)
+
+    def get_properties(self):
+        if self._properties is None:
+            entries = self._cache.entries
+            properties = self._own(PropertyList())
+            _load_properties(properties, self._property_data)
+            self._cache.entries = entries
+            self._properties = properties
+        return self._properties
+    properties = property(get_properties)
+
+    def find_link(self, rels, attr=None):
+        if self._links is not None:
+            return super(LazyRD, self).find_link(rels, attr)
+        if not isinstance(rels, (list, tuple)):
+            rels = (rels,)
+        for pos, data in enumerate(self._link_data):
+            if data.get('rel', None) in rels:
+                link = self._link(pos)
+                if attr:
+                    return getattr(link, attr, None)
+                return link
+
+
+def loads(content, lazy=False, backend=None):
 
     def expires_handler(key, val, obj):
         obj.expires = isodate.parse_datetime(val)
@@ -24,27 +266,13 @@ def loads(content):
             obj.aliases.append(alias)
 
     def properties_handler(key, val, obj):
-        for ptype, pvalue in val.items():
-            obj.properties.append(Property(ptype, pvalue))
+        _load_properties(obj.properties, val)
 
     def titles_handler(key, val, obj):
-        for tlang, tvalue in val.items():
-            if tlang == 'default':
-                tlang = None
-            obj.titles.append(Title(tvalue, tlang))
+        _load_titles(obj.titles, val)
 
     def links_handler(key, val, obj):
-        for link in val:
-            l = Link()
-            l.rel = link.get('rel', None)
-            l.type = link.get('type', None)
-            l.href = link.get('href', None)
-            l.template = link.get('template', None)
-            if 'titles' in link:
-                titles_handler('title', link['titles'], l)
-            if 'properties' in link:
-                properties_handler('property', link['properties'], l)
-            obj.links.append(l)
+        obj.links.extend(map(_load_link, val))
 
     def namespace_handler(key, val, obj):
         for namespace in val:
@@ -52,6 +280,9 @@ def loads(content):
             ns_uri = list(namespace.values())[0]
             obj.attributes.append(Attribute("xmlns:%s" % ns, ns_uri))
 
+    def deferred_handler(key, val, obj):
+        pass
+
     handlers = {
         'expires': expires_handler,
         'subject': subject_handler,
@@ -68,33 +299,123 @@ def loads(content):
             key = "%s:%s" % (ns, name.capitalize())
         obj.elements.append(Element(key, val))
 
-    doc = json.loads(content)
-
-    rd = RD()
+    if content[:3] == codecs.BOM_UTF8:
+        content = content[3:]
+    elif content[:1] == '\ufeff':
+        content = content[1:]
+
+    probe = instrument.probe('loads', 'jrd')
+
+    source = content
+    backend = get_backend(backend)
+    if isinstance(content, memoryview) and not backend.buffers:
+        content = content.tobytes()
+
+    # UTF-16 and UTF-32 are detected like json does and decoded here, the
+    # other backends, and json on python 2, only read UTF-8 bytes
+    encoding = detect_encoding(content[:4]) if isinstance(content, bytes) else None
+    if encoding not in (None, 'utf-8'):
+        content = content.decode(encoding)
+
+    try:
+        doc = backend.loads(content)
+    except (TypeError, ValueError):
+        if backend is BACKENDS['json']:
+            raise
+        fallback = content.tobytes() if isinstance(content, memoryview) else content
+        doc = json.loads(fallback)
+
+    if probe:
+        probe.mark('decode')
+
+    if lazy:
+        rd = LazyRD(doc.get('links'), doc.get('properties'))
+        handlers['links'] = deferred_handler
+        handlers['properties'] = deferred_handler
+    else:
+        rd = RD()
 
     for key, value in doc.items():
         handler = handlers.get(key, unknown_handler)
         handler(key, value, rd)
 
+    if isinstance(source, bytes):
+        # kept under the encoding it is really in
+        rd._keep_source(JRD, source, encoding)
+    else:
+        rd._keep_source(JRD, source)
+
+    if probe:
+        probe.mark('build')
+        probe.input_size = instrument.size_of(content)
+        _count_doc(probe, doc, handlers)
+        probe.emit()
+
     return rd
 
 
-def dumps(xrd):
+def _count_doc(probe, doc, known):
+    # counted from the decoded document so lazy loading isn't defeated
+    links = doc.get('links') or ()
+    probe.counts['links'] = len(links)
+    probe.counts['properties'] = len(doc.get('properties') or ()) + sum(
+        len(link.get('properties') or ()) for link in links)
+    probe.counts['titles'] = sum(len(link.get('titles') or ()) for link in links)
+    probe.counts['unknown'] = sum(1 for key in doc if key not in known)
 
-    doc = {
-        "aliases": [],
-        "links": [],
-        "namespace": [],
-        "properties": {},
-        "titles": [],
-    }
 
-    #list_keys = doc.keys()
+def _link_doc(link):
+
+    # key order matches what earlier versions produced
+    doc = {}
+
+    if link.has_titles():
+        titles = doc['titles'] = {}
+        for title in link.titles:
+            titles[title.lang or "default"] = title.value
+
+    if link.has_properties():
+        properties = doc['properties'] = {}
+        for prop in link.properties:
+            properties[prop.type] = prop.value
+
+    if link.rel:
+        doc['rel'] = link.rel
+
+    if link.type:
+        doc['type'] = link.type
+
+    if link.href:
+        doc['href'] = link.href
+
+    if link.template:
+        doc['template'] = link.template
+
+    return doc
+
+
+def _document(xrd, links=True):
+
+    # only non-empty members are added, in the same order earlier versions
+    # produced them
+
+    doc = {}
+
+    if xrd.aliases:
+        doc['aliases'] = list(xrd.aliases)
+
+    if links and xrd.links:
+        doc['links'] = list(map(_link_doc, xrd.links))
 
     for attr in xrd.attributes:
         if attr.name.startswith("xmlns:"):
             ns = attr.name.split(":")[1]
-            doc['namespace'].append({ns: attr.value})
+            doc.setdefault('namespace', []).append({ns: attr.value})
+
+    if xrd.properties:
+        properties = doc['properties'] = {}
+        for prop in xrd.properties:
+            properties[prop.type] = prop.value
 
     if xrd.expires:
         doc['expires'] = xrd.expires.isoformat()
@@ -102,45 +423,93 @@ def dumps(xrd):
     if xrd.subject:
         doc['subject'] = xrd.subject
 
-    for alias in xrd.aliases:
-        doc['aliases'].append(alias)
+    for elem in xrd.elements:
+        if elem.value:
+            doc[elem.name.lower()] = elem.value
+        else:
+            doc.pop(elem.name.lower(), None)
+
+    return doc
 
-    for prop in xrd.properties:
-        doc['properties'][prop.type] = prop.value
 
-    for link in xrd.links:
+def dumps(xrd, backend=None, encoding=None):
 
-        link_doc = {
-            'titles': {},
-            'properties': {},
-        }
+    probe = instrument.probe('dumps', 'jrd')
 
-        if link.rel:
-            link_doc['rel'] = link.rel
+    doc = _document(xrd)
 
-        if link.type:
-            link_doc['type'] = link.type
+    if probe:
+        probe.mark('build')
 
-        if link.href:
-            link_doc['href'] = link.href
+    backend = get_backend(backend)
+    if encoding is None:
+        content = backend.dumps(doc)
+    elif encoding.lower().replace('-', '') == 'utf8':
+        content = backend.dumps_bytes(doc)
+    else:
+        content = backend.dumps(doc).encode(encoding)
 
-        if link.template:
-            link_doc['template'] = link.template
+    if probe:
+        probe.mark('encode')
+        probe.count_rd(xrd)
+        probe.output_size = instrument.size_of(content)
+        probe.emit()
 
-        for prop in link.properties:
-            link_doc['properties'][prop.type] = prop.value
+    return content
 
-        for title in link.titles:
-            lang = title.lang or "default"
-            link_doc['titles'][lang] = title.value
 
-        _clean_dict(link_doc)
+def iterdumps(xrd, backend=None, encoding=None):
 
-        doc['links'].append(link_doc)
+    # Yields the same document as dumps, a link at a time. The members
+    # around the links are serialized on their own and spliced in as
+    # text, then the whole stream goes through one encoder.
 
-    for elem in xrd.elements:
-        doc[elem.name.lower()] = elem.value
+    return _iterencode(_iterdumps(xrd, get_backend(backend)), encoding)
+
+
+def _iterdumps(xrd, backend):
+
+    encode = backend.dumps
+    doc = _document(xrd, links=False)
+
+    if not xrd.links:
+        yield encode(doc)
+        return
+
+    head = {}
+    if 'aliases' in doc:
+        head['aliases'] = doc.pop('aliases')
+
+    if head:
+        yield encode(head)[:-1] + ', "links": ['
+    else:
+        yield '{"links": ['
+
+    for (pos, link) in enumerate(xrd.links):
+        if pos:
+            yield ', ' + encode(_link_doc(link))
+        else:
+            yield encode(_link_doc(link))
+
+    if doc:
+        yield '], ' + encode(doc)[1:]
+    else:
+        yield ']}'
+
+
+def dump(xrd, fp, backend=None, encoding=None):
+
+    probe = instrument.probe('dumps', 'jrd')
+    size = 0
 
-    _clean_dict(doc)
+    for part in iterdumps(xrd, backend, encoding):
+        fp.write(part)
+        if probe:
+            size += instrument.size_of(part)
 
-    return json.dumps(doc)
+    if probe:
+        # building and encoding are interleaved when streaming
+        probe.mark('encode')
+        probe.count_rd(xrd)
+        probe.output_size = size
+        probe.emit()
@@ -0,0 +1,227 @@
+from __future__ import unicode_literals
+import itertools
+
+from rd.core import RD, Element, IndexedList, Link
+
+# Combines a host-wide descriptor (host-meta) with a resource-specific one
+# (LRDD, WebFinger) as described in RFC 6415. Precedence is decided per
+# link rel and per property type:
+#
+#   OVERLAY  the overlay's entries replace the base's when it has any
+#   BASE     the base's entries replace the overlay's when it has any
+#   BOTH     entries from both are kept
+#
+# Overlay entries come first in the result, so find_link prefers the
+# resource-specific links. Aliases are combined, the overlay's subject
+# wins and the earlier expiry is kept.
+
+OVERLAY = 'overlay'
+BASE = 'base'
+BOTH = 'both'
+
+POLICIES = (OVERLAY, BASE, BOTH)
+
+
+class _Precedence(object):
+
+    def __init__(self, rules, default):
+        rules = dict(rules or {})
+        for policy in itertools.chain(rules.values(), [default]):
+            if policy not in POLICIES:
+                raise ValueError('unknown precedence: %s' % policy)
+        self.rules = rules
+        self.default = default
+
+    def __call__(self, key):
+        return self.rules.get(key, self.default)
+
+
+def _keep(overlay_items, base_items, key, precedence):
+
+    # yields the overlay's items, then the base's, skipping the ones whose
+    # key the other side takes precedence for
+
+    overlay_keys = set(key(item) for item in overlay_items)
+    base_keys = set(key(item) for item in base_items)
+
+    for item in overlay_items:
+        k = key(item)
+        if precedence(k) != BASE or k not in base_keys:
+            yield item
+
+    for item in base_items:
+        k = key(item)
+        if precedence(k) != OVERLAY or k not in overlay_keys:
+            yield item
+
+
+def _link_rel(link):
+    return link.rel
+
+
+def _property_type(prop):
+    return prop.type
+
+
+def _element_name(elem):
+    return elem.name
+
+
+def _attribute_name(attr):
+    return attr.name
+
+
+def _aliases(base, overlay):
+    seen = set()
+    for alias in itertools.chain(overlay.aliases, base.aliases):
+        if alias not in seen:
+            seen.add(alias)
+            yield alias
+
+
+def _expires(base, overlay):
+    dates = [rd.expires for rd in (base, overlay) if rd.expires is not None]
+    if dates:
+        return min(dates)
+
+
+def _copy_link(link):
+    # links report changes to the RD holding them, so the merged RD gets
+    # its own rather than taking over the inputs'
+    copy = Link(link.rel, link.type, link.href, link.template)
+    if link.has_titles():
+        copy.titles.extend((title.value, title.lang) for title in link.titles)
+    if link.has_properties():
+        copy.properties.extend((prop.type, prop.value) for prop in link.properties)
+    return copy
+
+
+def merge(base, overlay, rels=None, properties=None, default=OVERLAY, view=False):
+
+    # rels and properties map a link rel or property type to a precedence,
+    # default applies to everything else. With view, a read-only MergedRD
+    # over the two descriptors is returned instead of a new RD.
+
+    rel_precedence = _Precedence(rels, default)
+    property_precedence = _Precedence(properties, default)
+
+    if view:
+        return MergedRD(base, overlay, rel_precedence, property_precedence)
+
+    rd = RD(overlay.xml_id or base.xml_id, overlay.subject or base.subject)
+
+    expires = _expires(base, overlay)
+    if expires is not None:
+        rd.expires = expires
+
+    rd.aliases.extend(_aliases(base, overlay))
+    rd.properties.extend(
+        (prop.type, prop.value) for prop in
+        _keep(overlay.properties, base.properties, _property_type, property_precedence))
+    rd.attributes.extend(
+        (attr.name, attr.value) for attr in
+        _keep(overlay.attributes, base.attributes, _attribute_name, _Precedence(None, OVERLAY)))
+    rd.elements.extend(
+        Element(elem.name, elem.value) for elem in
+        _keep(overlay.elements, base.elements, _element_name, _Precedence(None, OVERLAY)))
+    rd.links.extend(
+        _copy_link(link) for link in
+        _keep(overlay.links, base.links, _link_rel, rel_precedence))
+
+    return rd
+
+
+#
+# merged view
+#
+
+def _first(links, rels):
+    if isinstance(links, IndexedList):
+        return links.first(rels)
+    for link in links:
+        if link.rel in rels:
+            return link
+
+
+class MergedRD(object):
+
+    # Reads through to base and overlay, so it reflects later changes to
+    # either and shares their links instead of copying them. find_link
+    # uses the inputs' rel indexes and doesn't build the merged list.
+
+    def __init__(self, base, overlay, rels, properties):
+        self.base = base
+        self.overlay = overlay
+        self._rels = rels
+        self._properties = properties
+
+    @property
+    def xml_id(self):
+        return self.overlay.xml_id or self.base.xml_id
+
+    @property
+    def subject(self):
+        return self.overlay.subject or self.base.subject
+
+    @property
+    def expires(self):
+        return _expires(self.base, self.overlay)
+
+    @property
+    def aliases(self):
+        return tuple(_aliases(self.base, self.overlay))
+
+    @property
+    def properties(self):
+        return tuple(_keep(self.overlay.properties, self.base.properties,
+                           _property_type, self._properties))
+
+    @property
+    def attributes(self):
+        return tuple(_keep(self.overlay.attributes, self.base.attributes,
+                           _attribute_name, _Precedence(None, OVERLAY)))
+
+    @property
+    def elements(self):
+        return tuple(_keep(self.overlay.elements, self.base.elements,
+                           _element_name, _Precedence(None, OVERLAY)))
+
+    @property
+    def links(self):
+        return tuple(_keep(self.overlay.links, self.base.links, _link_rel, self._rels))
+
+    def find_link(self, rels, attr=None):
+
+        if not isinstance(rels, (list, tuple)):
+            rels = (rels,)
+
+        (overlay, base) = (self.overlay.links, self.base.links)
+
+        # a rel the other side takes precedence for is skipped only when
+        # the other side has a link with it
+        overlay_rels = [rel for rel in rels
+                        if self._rels(rel) != BASE or _first(base, (rel,)) is None]
+        link = _first(overlay, overlay_rels) if overlay_rels else None
+
+        if link is None:
+            base_rels = [rel for rel in rels
+                         if self._rels(rel) != OVERLAY or _first(overlay, (rel,)) is None]
+            link = _first(base, base_rels) if base_rels else None
+
+        if link is not None and attr:
+            return getattr(link, attr, None)
+        return link
+
+    def to_json(self):
+        from rd import jrd
+        return jrd.dumps(self)
+
+    def to_xml(self, dom=True):
+        from rd import xrd
+        if dom:
+            return xrd.dumps(self)
+        return xrd.tostring(self)
+
+    def to_rd(self):
+        return merge(self.base, self.overlay, self._rels.rules, self._properties.rules,
+                     self._rels.default)
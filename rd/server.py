@@ -0,0 +1,357 @@
+from __future__ import unicode_literals
+import argparse
+import collections
+import hashlib
+import time
+from http import HTTPStatus
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server as _make_server
+
+from rd.cache import DescriptorCache, expires_timestamp
+from rd.core import JRD, JRD_TYPES, XRD, XRD_TYPES, FrozenRD, _descriptor_paths, load
+
+# Serves WebFinger (RFC 7033) and host-meta (RFC 6415) documents from a
+# store, any object whose get(resource) returns an RD, a FrozenRD or None;
+# a dict works. Each descriptor version is serialized once per format and
+# kept with its ETag, so a request for an unchanged descriptor doesn't
+# serialize or hash anything.
+
+HOST_META_PATH = '/.well-known/host-meta'
+HOST_META_JSON_PATH = '/.well-known/host-meta.json'
+WEBFINGER_PATH = '/.well-known/webfinger'
+
+CONTENT_TYPES = {
+    JRD: 'application/jrd+json',
+    XRD: 'application/xrd+xml',
+}
+
+# application/xml is the generic XML type, but an XRD is what it gets
+FORMAT_TYPES = {
+    JRD: JRD_TYPES,
+    XRD: XRD_TYPES + ('application/xml',),
+}
+
+CACHE_SIZE = 4096
+
+_Entry = collections.namedtuple('_Entry', 'snapshot body etag expires')
+
+
+#
+# content negotiation
+#
+
+def _media_ranges(accept):
+    for item in accept.split(','):
+        params = item.split(';')
+        mtype = params[0].strip().lower()
+        if not mtype:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            (name, _, value) = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        yield (mtype, q)
+
+
+def _quality(ranges, types):
+    # the q of the most specific range matching any of types
+    best = (-1, 0.0)
+    for (mtype, q) in ranges:
+        if mtype in types:
+            specificity = 2
+        elif mtype == '*/*':
+            specificity = 0
+        elif mtype.endswith('/*') and any(t.startswith(mtype[:-1]) for t in types):
+            specificity = 1
+        else:
+            continue
+        if specificity > best[0]:
+            best = (specificity, q)
+    return best[1]
+
+
+def negotiate(accept, default=JRD, formats=(JRD, XRD)):
+
+    # returns the format to respond with, or None when the client accepts
+    # none of them; ties go to default
+
+    if not accept:
+        return default
+
+    ranges = list(_media_ranges(accept))
+    best = None
+    best_q = 0.0
+    for fmt in sorted(formats, key=lambda fmt: fmt != default):
+        q = _quality(ranges, FORMAT_TYPES[fmt])
+        if q > best_q:
+            (best, best_q) = (fmt, q)
+    return best
+
+
+def _etag_matches(header, etag):
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*' or tag == etag or (tag.startswith('W/') and tag[2:] == etag):
+            return True
+    return False
+
+
+def _not_modified(headers, entry):
+    if_none_match = headers.get('if-none-match')
+    if if_none_match:
+        return _etag_matches(if_none_match, entry.etag)
+    return False
+
+
+#
+# responses
+#
+
+def _filtered(snapshot, rels):
+    # WebFinger rel parameters limit the links returned
+    return FrozenRD(snapshot.xml_id, snapshot.subject, snapshot.expires, snapshot.aliases,
+                    snapshot.properties, [link for link in snapshot.links if link.rel in rels],
+                    snapshot.elements, snapshot.attributes)
+
+
+def _body(source, fmt):
+    if fmt == JRD:
+        return source.to_json(encoding='utf-8')
+    return source.to_xml(dom=False, encoding='utf-8')
+
+
+def _error(status, message, headers=()):
+    body = message.encode('utf-8')
+    headers = [
+        ('Content-Type', 'text/plain; charset=utf-8'),
+        ('Content-Length', '%d' % len(body)),
+    ] + list(headers)
+    return (status, headers, body)
+
+
+def _status_line(status):
+    return '%d %s' % (status, HTTPStatus(status).phrase)
+
+
+class Server(object):
+
+    # host_meta is served at /.well-known/host-meta; without it that path
+    # is a 404. Descriptors without an expiry are sent with max_age, or
+    # no-cache when it's None, so clients revalidate with the ETag.
+
+    def __init__(self, store, host_meta=None, max_age=None, maxsize=CACHE_SIZE, clock=time.time):
+        self.store = store
+        self.host_meta = host_meta
+        self.max_age = max_age
+        self.maxsize = maxsize
+        self.clock = clock
+        self._entries = DescriptorCache(maxsize=maxsize, clock=clock)
+
+    def _entry(self, key, rd, fmt, rels):
+
+        # freeze() returns the same snapshot until the descriptor changes,
+        # so it identifies the version the cached body was made from
+
+        snapshot = rd.freeze()
+        entry = self._entries.get(key)
+        if entry is not None and entry.snapshot is snapshot:
+            return entry
+
+        # an unfiltered RD may still hold the document it was loaded from
+        source = _filtered(snapshot, rels) if rels else rd
+        body = _body(source, fmt)
+        entry = _Entry(
+            snapshot=snapshot,
+            body=body,
+            etag='"%s"' % hashlib.sha1(body).hexdigest(),
+            expires=expires_timestamp(snapshot),
+        )
+
+        # least recently used entries are evicted; they're checked against
+        # the descriptor, so they never expire
+        self._entries.set(key, entry, ttl=float('inf'))
+        return entry
+
+    def _cache_control(self, entry):
+        if entry.expires is not None:
+            return 'public, max-age=%d' % max(0, int(entry.expires - self.clock()))
+        if self.max_age is not None:
+            return 'public, max-age=%d' % self.max_age
+        return 'no-cache'
+
+    def respond(self, method, path, query='', headers=None):
+
+        # returns (status, headers, body); request headers are given as a
+        # dict with lowercased names
+
+        headers = headers or {}
+
+        if method not in ('GET', 'HEAD'):
+            return _error(405, 'method not allowed', [('Allow', 'GET, HEAD')])
+
+        rels = ()
+        formats = (JRD, XRD)
+        if path == WEBFINGER_PATH:
+            params = parse_qs(query)
+            if not params.get('resource'):
+                return _error(400, 'resource parameter required')
+            resource = params['resource'][0]
+            rels = tuple(sorted(set(params.get('rel', ()))))
+            default = JRD
+            rd = self.store.get(resource)
+        elif path == HOST_META_PATH:
+            (resource, default, rd) = (None, XRD, self.host_meta)
+        elif path == HOST_META_JSON_PATH:
+            (resource, default, rd) = (None, JRD, self.host_meta)
+            formats = (JRD,)
+        else:
+            return _error(404, 'not found')
+
+        # host-meta.json is JRD whatever the client asks for
+        fmt = negotiate(headers.get('accept'), default, formats) if len(formats) > 1 else default
+        if fmt is None:
+            return _error(406, 'not acceptable')
+        if rd is None:
+            return _error(404, 'no descriptor for %s' % (resource or 'host-meta'))
+
+        entry = self._entry((path, resource, fmt, rels), rd, fmt, rels)
+
+        response_headers = [
+            ('ETag', entry.etag),
+            ('Cache-Control', self._cache_control(entry)),
+            ('Access-Control-Allow-Origin', '*'),
+        ]
+        if len(formats) > 1:
+            response_headers.append(('Vary', 'Accept'))
+
+        if _not_modified(headers, entry):
+            return (304, response_headers, b'')
+
+        response_headers.append(('Content-Type', CONTENT_TYPES[fmt]))
+        response_headers.append(('Content-Length', '%d' % len(entry.body)))
+        return (200, response_headers, b'' if method == 'HEAD' else entry.body)
+
+    # WSGI
+
+    def __call__(self, environ, start_response):
+        headers = {
+            'accept': environ.get('HTTP_ACCEPT'),
+            'if-none-match': environ.get('HTTP_IF_NONE_MATCH'),
+        }
+        (status, response_headers, body) = self.respond(
+            environ['REQUEST_METHOD'], environ.get('PATH_INFO', ''),
+            environ.get('QUERY_STRING', ''), headers)
+        start_response(_status_line(status), response_headers)
+        return [body]
+
+    # ASGI; store.get is called on the event loop, so it shouldn't block
+
+    async def asgi(self, scope, receive, send):
+
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+
+        if scope['type'] != 'http':
+            raise ValueError('unsupported ASGI scope: %s' % scope['type'])
+
+        headers = {}
+        for (name, value) in scope.get('headers', ()):
+            name = name.decode('latin-1').lower()
+            value = value.decode('latin-1')
+            headers[name] = '%s, %s' % (headers[name], value) if name in headers else value
+
+        (status, response_headers, body) = self.respond(
+            scope['method'], scope['path'], scope.get('query_string', b'').decode('latin-1'),
+            headers)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1'))
+                        for (name, value) in response_headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+#
+# local serving
+#
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(server, host='127.0.0.1', port=8000, quiet=True):
+    # a threaded wsgiref server for trying out and load testing a Server;
+    # call serve_forever() on the result
+    handler = _QuietHandler if quiet else WSGIRequestHandler
+    return _make_server(host, port, server, server_class=_ThreadingWSGIServer,
+                        handler_class=handler)
+
+
+def load_store(paths):
+
+    # a dict store of frozen descriptors from files and directories,
+    # keyed by subject and aliases
+
+    store = {}
+    for path in _descriptor_paths(paths):
+        snapshot = load(path).freeze()
+        for key in (snapshot.subject,) + snapshot.aliases:
+            if key:
+                store[key] = snapshot
+    return store
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='serve WebFinger and host-meta descriptors')
+    parser.add_argument('paths', nargs='*', help='descriptor files or directories of them')
+    parser.add_argument('--store', default=None, help='serve from an RDStore database instead')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--host-meta', default=None, help='descriptor served as host-meta')
+    parser.add_argument('--max-age', type=int, default=None,
+                        help='seconds clients may cache descriptors without an expiry')
+    parser.add_argument('--verbose', action='store_true', help='log requests')
+    args = parser.parse_args()
+
+    host_meta = load(args.host_meta).freeze() if args.host_meta else None
+    if args.store:
+        from rd.store import RDStore
+        store = RDStore(args.store, readonly=True)
+    elif args.paths:
+        store = load_store(args.paths)
+    else:
+        parser.error('descriptor paths or --store are required')
+    server = Server(store, host_meta=host_meta, max_age=args.max_age)
+
+    httpd = make_server(server, args.host, args.port, quiet=not args.verbose)
+    print('serving on http://%s:%d' % httpd.server_address[:2])
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
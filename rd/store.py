@@ -0,0 +1,329 @@
+from __future__ import unicode_literals
+import argparse
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from urllib.parse import quote
+
+import isodate
+
+from rd.core import (FrozenAttribute, FrozenElement, FrozenLink, FrozenProperty, FrozenRD,
+                     FrozenTitle, _descriptor_paths, _freeze_value, load)
+
+logger = logging.getLogger("rd")
+
+# Descriptors persisted in a SQLite database, indexed by subject, alias
+# and link rel. The database is in WAL mode, so any number of threads and
+# processes can read while one of them writes.
+#
+# Each descriptor is stored as a zlib compressed JSON array of its
+# snapshot's fields. Unlike JRD this keeps everything an RD holds, and it
+# decodes without going through the JRD handlers. It is always written
+# with the standard json module, so the stored bytes don't depend on the
+# JRD backend in use. Replacing a descriptor
+# gives it a new id, so decoded snapshots are cached by id and a lookup of
+# an unchanged descriptor only reads the keys index.
+
+SCHEMA_VERSION = 1
+CACHE_SIZE = 4096
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS descriptors (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        subject TEXT,
+        data BLOB NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS keys (
+        key TEXT PRIMARY KEY,
+        id INTEGER NOT NULL
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS keys_id ON keys (id)',
+    '''CREATE TABLE IF NOT EXISTS rels (
+        rel TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        PRIMARY KEY (rel, id)
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS rels_id ON rels (id)',
+)
+
+
+#
+# encoding
+#
+
+def _encode(snapshot):
+    doc = [
+        snapshot.xml_id,
+        snapshot.subject,
+        snapshot.expires.isoformat() if snapshot.expires is not None else None,
+        list(snapshot.aliases),
+        [list(prop) for prop in snapshot.properties],
+        [[link.rel, link.type, link.href, link.template,
+          [list(title) for title in link.titles],
+          [list(prop) for prop in link.properties]] for link in snapshot.links],
+        [[elem.name, elem.value, [list(attr) for attr in elem.attrs]] for elem in snapshot.elements],
+        [list(attr) for attr in snapshot.attributes],
+    ]
+    return zlib.compress(json.dumps(doc, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+
+def _decode(data):
+    (xml_id, subject, expires, aliases, properties, links, elements, attributes) = \
+        json.loads(zlib.decompress(data).decode('utf-8'))
+    return FrozenRD(
+        xml_id=xml_id,
+        subject=subject,
+        expires=isodate.parse_datetime(expires) if expires else None,
+        aliases=aliases,
+        properties=[FrozenProperty(*prop) for prop in properties],
+        links=[FrozenLink(rel, type_, href, template,
+                          tuple(FrozenTitle(*title) for title in titles),
+                          tuple(FrozenProperty(*prop) for prop in props))
+               for (rel, type_, href, template, titles, props) in links],
+        elements=[FrozenElement(name, _freeze_value(value), tuple(tuple(attr) for attr in attrs))
+                  for (name, value, attrs) in elements],
+        attributes=[FrozenAttribute(*attr) for attr in attributes],
+    )
+
+
+def _keys(snapshot, keys=()):
+    return set(key for key in itertools.chain((snapshot.subject,), snapshot.aliases, keys) if key)
+
+
+#
+# store
+#
+
+class RDStore(object):
+
+    # Descriptors are returned as FrozenRD snapshots, call thaw() on one to
+    # edit it and put() it back. Putting a descriptor replaces every stored
+    # descriptor that shares its subject or one of its aliases.
+
+    def __init__(self, path, readonly=False, timeout=30.0, maxsize=CACHE_SIZE):
+
+        self.path = path
+        self.readonly = readonly
+        self.timeout = timeout
+        self.maxsize = maxsize
+
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._snapshots = {}
+
+        conn = self._connection()
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        if readonly:
+            if version != SCHEMA_VERSION:
+                raise ValueError('%s is not a descriptor store' % path)
+            return
+
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError('%s has unsupported store version %d' % (path, version))
+        conn.execute('PRAGMA journal_mode=WAL')
+        with self._write_lock:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.execute('PRAGMA user_version=%d' % SCHEMA_VERSION)
+
+    def _connection(self):
+
+        # one connection per thread, sqlite connections aren't shared
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if self.readonly:
+                conn = sqlite3.connect('file:%s?mode=ro' % quote(os.path.abspath(self.path)), uri=True,
+                                       timeout=self.timeout, isolation_level=None,
+                                       check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                       check_same_thread=False)
+                conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # reading
+
+    def _snapshot(self, id_, data):
+        snapshot = self._snapshots.get(id_)
+        if snapshot is None:
+            snapshot = _decode(data)
+            self._cache([(id_, snapshot)])
+        return snapshot
+
+    def get(self, key):
+
+        # key is a subject or an alias; returns None when nothing has it
+
+        conn = self._connection()
+        row = conn.execute('SELECT id FROM keys WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        snapshot = self._snapshots.get(row[0])
+        if snapshot is not None:
+            return snapshot
+
+        # the descriptor may have been replaced since the first query
+        row = conn.execute('SELECT d.id, d.data FROM keys k JOIN descriptors d ON d.id = k.id '
+                           'WHERE k.key = ?', (key,)).fetchone()
+        if row is not None:
+            return self._snapshot(*row)
+
+    def find(self, rel):
+        # descriptors with a link of rel, in the order they were stored
+        rows = self._connection().execute(
+            'SELECT d.id, d.data FROM rels r JOIN descriptors d ON d.id = r.id '
+            'WHERE r.rel = ? ORDER BY d.id', (rel,))
+        return [self._snapshot(id_, data) for (id_, data) in rows]
+
+    def __contains__(self, key):
+        return self._connection().execute(
+            'SELECT 1 FROM keys WHERE key = ?', (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM descriptors').fetchone()[0]
+
+    # writing
+
+    def _write(self, func):
+
+        # a single writer per store object; other processes are serialized
+        # by sqlite's own locking
+
+        if self.readonly:
+            raise ValueError('store is read-only')
+        conn = self._connection()
+        with self._write_lock:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        return result
+
+    def _delete_ids(self, conn, ids):
+        for id_ in ids:
+            conn.execute('DELETE FROM keys WHERE id = ?', (id_,))
+            conn.execute('DELETE FROM rels WHERE id = ?', (id_,))
+            conn.execute('DELETE FROM descriptors WHERE id = ?', (id_,))
+            self._snapshots.pop(id_, None)
+
+    def _put(self, conn, rd, keys=()):
+
+        snapshot = rd.freeze()
+
+        keys = _keys(snapshot, keys)
+        if not keys:
+            raise ValueError('descriptor has no subject, aliases or keys to store it under')
+
+        # every descriptor sharing a key is replaced as a whole, so no
+        # descriptor is left with only some of its keys, or none
+        placeholders = ', '.join('?' * len(keys))
+        rows = conn.execute('SELECT DISTINCT id FROM keys WHERE key IN (%s)' % placeholders,
+                            list(keys)).fetchall()
+        self._delete_ids(conn, [row[0] for row in rows])
+
+        id_ = conn.execute('INSERT INTO descriptors (subject, data) VALUES (?, ?)',
+                           (snapshot.subject, _encode(snapshot))).lastrowid
+
+        conn.executemany('INSERT INTO keys (key, id) VALUES (?, ?)',
+                         [(key, id_) for key in keys])
+        rels = set(link.rel for link in snapshot.links if link.rel)
+        conn.executemany('INSERT INTO rels (rel, id) VALUES (?, ?)',
+                         [(rel, id_) for rel in rels])
+
+        return (id_, snapshot)
+
+    def _cache(self, stored):
+        # only after the commit, a rolled back id is handed out again
+        for (id_, snapshot) in stored:
+            if len(self._snapshots) >= self.maxsize:
+                self._snapshots.clear()
+            self._snapshots[id_] = snapshot
+
+    def put(self, rd, keys=()):
+        # rd may be an RD or a FrozenRD; keys are looked up like its subject
+        # and aliases, which is how a host-meta without either is stored
+        self._cache([self._write(lambda conn: self._put(conn, rd, keys))])
+
+    def put_many(self, rds):
+        # all in one transaction; returns the number stored
+        stored = self._write(lambda conn: [self._put(conn, rd) for rd in rds])
+        self._cache(stored)
+        return len(stored)
+
+    def delete(self, key):
+        # removes the descriptor with the subject or alias key, returns
+        # whether there was one
+        def delete(conn):
+            row = conn.execute('SELECT id FROM keys WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self._delete_ids(conn, [row[0]])
+            return row is not None
+        return self._write(delete)
+
+    def import_paths(self, paths, skip_errors=False):
+
+        # loads XRD and JRD files, and the files in directories, into the
+        # store in one transaction. With skip_errors, files that don't
+        # parse are logged and left out instead of aborting the import.
+        # Descriptors without a subject or aliases can't be looked up and
+        # are left out too; put() them with keys.
+
+        def descriptors():
+            for path in _descriptor_paths(paths):
+                try:
+                    rd = load(path)
+                except Exception:
+                    if not skip_errors:
+                        raise
+                    logger.warning('import_paths() skipping %s', path, exc_info=True)
+                    continue
+                if not rd.subject and not rd.aliases:
+                    logger.warning('import_paths() skipping %s, it has no subject or aliases', path)
+                    continue
+                yield rd
+
+        return self.put_many(descriptors())
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='import descriptors into an RDStore')
+    parser.add_argument('database', help='store database, created if missing')
+    parser.add_argument('paths', nargs='+', help='XRD and JRD files or directories of them')
+    parser.add_argument('--skip-errors', action='store_true',
+                        help="leave out files that don't parse")
+    args = parser.parse_args()
+
+    with RDStore(args.database) as store:
+        count = store.import_paths(args.paths, skip_errors=args.skip_errors)
+        print('imported %d descriptors, %d in store' % (count, len(store)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+from __future__ import unicode_literals
+import re
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+# RFC 6570 URI templates, levels 1 to 4. A template is parsed once into
+# literal text and expressions, and compiled templates are cached by their
+# text, so expanding the same Link.template for many resources never
+# re-parses it.
+
+CACHE_SIZE = 1024
+
+RESERVED = ":/?#[]@!$&'()*+,;="
+
+# operator: (first, separator, named, if empty, allow reserved)
+OPERATORS = {
+    '': ('', ',', False, '', False),
+    '+': ('', ',', False, '', True),
+    '#': ('#', ',', False, '', True),
+    '.': ('.', '.', False, '', False),
+    '/': ('/', '/', False, '', False),
+    ';': (';', ';', True, '', False),
+    '?': ('?', '&', True, '=', False),
+    '&': ('&', '&', True, '=', False),
+}
+
+_EXPRESSION = re.compile(r'\{([^{}]*)\}')
+_VARSPEC = re.compile(r'^((?:[A-Za-z0-9_]|%[0-9A-Fa-f]{2})(?:\.?(?:[A-Za-z0-9_]|%[0-9A-Fa-f]{2}))*)'
+                      r'(?:(\*)|:([1-9][0-9]{0,3}))?$')
+_PCT_ENCODED = re.compile(r'(%[0-9A-Fa-f]{2})')
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def _quote(value):
+    return quote(value.encode('utf-8'), safe='')
+
+
+def _quote_reserved(value):
+    # reserved characters and existing percent-encoded triplets are kept
+    parts = _PCT_ENCODED.split(value)
+    parts[::2] = [quote(part.encode('utf-8'), safe=RESERVED) for part in parts[::2]]
+    return ''.join(parts)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '%s' % value
+
+
+class _Expression(object):
+
+    __slots__ = ('first', 'separator', 'named', 'if_empty', 'encode', 'variables')
+
+    def __init__(self, operator, variables):
+        (self.first, self.separator, self.named, self.if_empty, reserved) = OPERATORS[operator]
+        self.encode = _quote_reserved if reserved else _quote
+        # (name, explode, prefix length or None)
+        self.variables = variables
+
+    def expand(self, values):
+
+        parts = []
+        encode = self.encode
+        named = self.named
+
+        for (name, explode, prefix) in self.variables:
+
+            value = values.get(name)
+            if value is None:
+                continue
+
+            if isinstance(value, dict):
+                items = [(_text(k), _text(v)) for (k, v) in value.items()]
+                if not items:
+                    continue
+                if explode:
+                    parts.extend('%s=%s' % (encode(k), encode(v)) for (k, v) in items)
+                    continue
+                joined = ','.join('%s,%s' % (encode(k), encode(v)) for (k, v) in items)
+
+            elif isinstance(value, (list, tuple)):
+                items = [_text(v) for v in value]
+                if not items:
+                    continue
+                if explode:
+                    if named:
+                        parts.extend('%s=%s' % (name, encode(v)) if v else name + self.if_empty
+                                     for v in items)
+                    else:
+                        parts.extend(encode(v) for v in items)
+                    continue
+                joined = ','.join(encode(v) for v in items)
+
+            else:
+                value = _text(value)
+                if prefix:
+                    value = value[:prefix]
+                joined = encode(value)
+
+            if named:
+                parts.append('%s=%s' % (name, joined) if joined else name + self.if_empty)
+            else:
+                parts.append(joined)
+
+        if parts:
+            return self.first + self.separator.join(parts)
+        return ''
+
+
+def _parse_expression(body, template):
+
+    operator = body[:1]
+    if operator in OPERATORS and operator:
+        body = body[1:]
+    elif operator in '=,!@|':
+        raise TemplateError('reserved operator %s in %s' % (operator, template))
+    else:
+        operator = ''
+
+    variables = []
+    for varspec in body.split(','):
+        match = _VARSPEC.match(varspec)
+        if match is None:
+            raise TemplateError('invalid variable %r in %s' % (varspec, template))
+        (name, explode, prefix) = match.groups()
+        variables.append((name, bool(explode), int(prefix) if prefix else None))
+
+    return _Expression(operator, variables)
+
+
+class URITemplate(object):
+
+    __slots__ = ('template', 'variables', '_parts', '_single')
+
+    def __init__(self, template):
+
+        self.template = template
+        self._parts = []
+
+        pos = 0
+        for match in _EXPRESSION.finditer(template):
+            self._literal(template[pos:match.start()])
+            self._parts.append(_parse_expression(match.group(1), template))
+            pos = match.end()
+        self._literal(template[pos:])
+
+        self.variables = []
+        for part in self._parts:
+            if isinstance(part, _Expression):
+                for (name, _, _) in part.variables:
+                    if name not in self.variables:
+                        self.variables.append(name)
+
+        # the common {uri} style template: literal text around a single
+        # simple variable, expanded without going through the general path
+        self._single = None
+        expressions = [part for part in self._parts if isinstance(part, _Expression)]
+        if len(expressions) == 1 and len(expressions[0].variables) == 1:
+            expression = expressions[0]
+            (name, explode, prefix) = expression.variables[0]
+            if not (explode or prefix or expression.named or expression.first):
+                pos = self._parts.index(expression)
+                self._single = (
+                    ''.join(self._parts[:pos]),
+                    expression.encode,
+                    ''.join(self._parts[pos + 1:]),
+                )
+
+    def _literal(self, text):
+        if '{' in text or '}' in text:
+            raise TemplateError('unbalanced braces in %s' % self.template)
+        if text:
+            self._parts.append(_quote_reserved(text))
+
+    def _values(self, values, kwargs):
+        if values is None:
+            values = {}
+        elif not isinstance(values, dict):
+            # a lone value is bound to the template's only variable
+            if len(self.variables) != 1:
+                raise TemplateError('%s has %d variables, values must be named'
+                                    % (self.template, len(self.variables)))
+            values = {self.variables[0]: values}
+        if kwargs:
+            values = dict(values, **kwargs)
+        return values
+
+    def expand(self, values=None, **kwargs):
+
+        if self._single is not None:
+            # kwargs are left as they are, a list or dict given as one
+            # still goes through the general path
+            value = values
+            if kwargs:
+                value = kwargs.get(self.variables[0]) if values is None and len(kwargs) == 1 else None
+            if value is not None and not isinstance(value, (dict, list, tuple)):
+                (prefix, encode, suffix) = self._single
+                return prefix + encode(_text(value)) + suffix
+
+        values = self._values(values, kwargs)
+        return ''.join(part if not isinstance(part, _Expression) else part.expand(values)
+                       for part in self._parts)
+
+    def expand_all(self, values):
+        # values is an iterable of mappings or, for single variable
+        # templates, of plain values; expansions are yielded in order
+        expand = self.expand
+        for value in values:
+            yield expand(value)
+
+    def __repr__(self):
+        return 'URITemplate(%r)' % self.template
+
+
+_cache = {}
+
+
+def compile(template):
+    try:
+        return _cache[template]
+    except KeyError:
+        pass
+    compiled = URITemplate(template)
+    if len(_cache) >= CACHE_SIZE:
+        _cache.clear()
+    _cache[template] = compiled
+    return compiled
+
+
+def expand(template, values=None, **kwargs):
+    return compile(template).expand(values, **kwargs)
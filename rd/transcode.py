@@ -0,0 +1,311 @@
+from __future__ import unicode_literals
+import codecs
+
+import isodate
+
+from rd import jrd
+from rd.core import _is_str
+from rd.xrd import (XRD_NAMESPACE, _attrs_dict, _chunks, _declaration, _link_xml,
+                    _make_parser, _property_xml, _start_tag, _text_element)
+
+# Converts between XRD and JRD without building RD objects, applying the
+# same mapping rules as xrd.loads/jrd.dumps and jrd.loads/xrd.tostring.
+# Anything the target format has no place for raises TranscodeError
+# instead of being dropped.
+
+LINK_ATTRIBUTES = ('rel', 'type', 'href', 'template')
+JRD_LINK_KEYS = frozenset(LINK_ATTRIBUTES + ('titles', 'properties'))
+JRD_MEMBERS = frozenset(('aliases', 'links', 'namespace', 'properties', 'expires', 'subject'))
+
+
+class TranscodeError(ValueError):
+    pass
+
+
+#
+# XRD to JRD
+#
+
+class _JRDWriter(object):
+
+    # Receives expat events and writes JRD. Each link is encoded as soon
+    # as it closes, so links come first in the output; the remaining
+    # members are small and written at the end.
+
+    def __init__(self, backend):
+
+        self.encode = jrd.get_backend(backend).dumps
+        self.out = []
+
+        self.depth = 0
+        self.capture = None
+        self.text = []
+        self.link = None
+        self.link_count = 0
+
+        self.aliases = []
+        self.namespace = []
+        self.properties = {}
+        self.expires = None
+        self.subject = None
+        self.elements = {}
+
+    def start(self, name, attrs):
+
+        self.depth += 1
+
+        if self.capture is not None:
+            raise TranscodeError('nested element %s in %s cannot be represented in JRD'
+                                 % (name, self.capture[1]))
+
+        attrs = _attrs_dict(attrs)
+
+        if self.depth == 1:
+            if name != 'XRD':
+                raise TranscodeError('expected an XRD document, found %s' % name)
+            for (key, value) in attrs.items():
+                if key.startswith('xmlns:'):
+                    self.namespace.append({key.split(':', 1)[1]: value})
+                elif key != 'xmlns':
+                    raise TranscodeError('XRD attribute %s cannot be represented in JRD' % key)
+
+        elif self.depth == 2 and name == 'Link':
+            self.check_attrs(name, attrs, LINK_ATTRIBUTES)
+            self.link = {'attrs': attrs, 'titles': {}, 'properties': {}}
+
+        elif self.depth == 2:
+            if name == 'Property':
+                self.check_attrs(name, attrs, ('type', 'xsi:nil'))
+            else:
+                self.check_attrs(name, attrs, ())
+            self.capture = (self.depth, name, attrs)
+
+        elif self.depth == 3 and name == 'Title':
+            self.check_attrs(name, attrs, ('xml:lang',))
+            self.capture = (self.depth, name, attrs)
+
+        elif self.depth == 3 and name == 'Property':
+            self.check_attrs(name, attrs, ('type', 'xsi:nil'))
+            self.capture = (self.depth, name, attrs)
+
+        else:
+            raise TranscodeError('element %s cannot be represented in JRD' % name)
+
+    def check_attrs(self, name, attrs, allowed):
+        for key in attrs:
+            if key not in allowed:
+                raise TranscodeError('attribute %s of %s cannot be represented in JRD' % (key, name))
+
+    def end(self, name):
+
+        depth = self.depth
+        self.depth -= 1
+
+        if self.capture is not None:
+            (_, _, attrs) = self.capture
+            text = ''.join(self.text).strip() or None
+            self.capture = None
+            self.text = []
+            if depth == 3:
+                self.link_child(name, attrs, text)
+            else:
+                self.member(name, attrs, text)
+
+        elif depth == 2:
+            self.write_link()
+
+        elif depth == 1:
+            self.finish()
+
+    def data(self, text):
+        if self.capture is not None:
+            self.text.append(text)
+
+    def link_child(self, name, attrs, text):
+        if name == 'Title':
+            self.put(self.link['titles'], attrs.get('xml:lang') or 'default', text, 'title')
+        else:
+            self.put(self.link['properties'], attrs.get('type', ''), text, 'property')
+
+    def member(self, name, attrs, text):
+        if name == 'Alias':
+            self.aliases.append(text)
+        elif name == 'Property':
+            self.put(self.properties, attrs.get('type', ''), text, 'property')
+        elif name == 'Expires':
+            if self.expires is not None:
+                raise TranscodeError('duplicate Expires cannot be represented in JRD')
+            self.expires = isodate.parse_datetime(text).isoformat()
+        elif name == 'Subject':
+            if self.subject is not None:
+                raise TranscodeError('duplicate Subject cannot be represented in JRD')
+            self.subject = text
+        elif text:
+            key = name.lower()
+            if key in JRD_MEMBERS:
+                raise TranscodeError('element %s collides with the JRD %s member' % (name, key))
+            self.put(self.elements, key, text, 'element')
+
+    def put(self, target, key, value, kind):
+        if key in target:
+            raise TranscodeError('duplicate %s %s cannot be represented in JRD' % (kind, key))
+        target[key] = value
+
+    def write_link(self):
+
+        # same members and key order as jrd.dumps
+        (attrs, titles, properties) = (self.link['attrs'], self.link['titles'], self.link['properties'])
+        self.link = None
+
+        doc = {}
+        if titles:
+            doc['titles'] = titles
+        if properties:
+            doc['properties'] = properties
+        for key in LINK_ATTRIBUTES:
+            if attrs.get(key):
+                doc[key] = attrs[key]
+
+        self.out.append(('{"links": [' if not self.link_count else ', ') + self.encode(doc))
+        self.link_count += 1
+
+    def finish(self):
+
+        doc = {}
+        if self.aliases:
+            doc['aliases'] = self.aliases
+        if self.namespace:
+            doc['namespace'] = self.namespace
+        if self.properties:
+            doc['properties'] = self.properties
+        if self.expires:
+            doc['expires'] = self.expires
+        if self.subject:
+            doc['subject'] = self.subject
+        doc.update(self.elements)
+
+        members = self.encode(doc)
+        if not self.link_count:
+            self.out.append(members)
+        elif doc:
+            self.out.append('], ' + members[1:])
+        else:
+            self.out.append(']}')
+
+
+def iter_xrd_to_jrd(content, backend=None):
+    writer = _JRDWriter(backend)
+    parser = _make_parser(writer)
+    for chunk in _chunks(content):
+        parser.Parse(chunk, False)
+        if writer.out:
+            for part in writer.out:
+                yield part
+            del writer.out[:]
+    parser.Parse(b'', True)
+    for part in writer.out:
+        yield part
+
+
+def xrd_to_jrd(content, backend=None):
+    return ''.join(iter_xrd_to_jrd(content, backend))
+
+
+#
+# JRD to XRD
+#
+
+def _element_name(key):
+    # mirrors jrd.loads, which capitalizes the local part of prefixed names
+    if ':' in key:
+        (ns, name) = key.split(':')
+        return "%s:%s" % (ns, name.capitalize())
+    return key
+
+
+def _check_str(value, what):
+    if value is not None and not _is_str(value):
+        raise TranscodeError('%s must be a string to be represented in XRD' % what)
+    return value
+
+
+def _iter_link(link):
+
+    if not isinstance(link, dict):
+        raise TranscodeError('link must be an object')
+    for key in link:
+        if key not in JRD_LINK_KEYS:
+            raise TranscodeError('link member %s cannot be represented in XRD' % key)
+
+    titles = []
+    for (lang, value) in (link.get('titles') or {}).items():
+        _check_str(value, 'title')
+        titles.append((value, None if lang == 'default' else lang))
+
+    properties = []
+    for (ptype, value) in (link.get('properties') or {}).items():
+        properties.append((ptype, value))
+
+    attrs = [_check_str(link.get(key), key) for key in LINK_ATTRIBUTES]
+
+    try:
+        return _link_xml(*attrs, titles=titles, properties=properties)
+    except ValueError as e:
+        raise TranscodeError(str(e))
+
+
+def iter_jrd_to_xrd(content, backend=None):
+
+    if content[:3] == codecs.BOM_UTF8:
+        content = content[3:]
+    elif content[:1] == '\ufeff':
+        content = content[1:]
+
+    doc = jrd.get_backend(backend).loads(content)
+    if not isinstance(doc, dict):
+        raise TranscodeError('JRD document must be an object')
+
+    attrs = [('xmlns', XRD_NAMESPACE)]
+    for namespace in doc.get('namespace') or ():
+        if not isinstance(namespace, dict) or len(namespace) != 1:
+            raise TranscodeError('namespace entries must map one prefix to a URI')
+        for (prefix, uri) in namespace.items():
+            attrs.append(('xmlns:%s' % prefix, uri))
+
+    elements = []
+    for (key, value) in doc.items():
+        if key in JRD_MEMBERS:
+            continue
+        if key == 'titles':
+            raise TranscodeError('descriptor titles cannot be represented in XRD')
+        _check_str(value, key)
+        elements.append(_text_element(_element_name(key), value))
+
+    yield _start_tag('XRD', attrs)
+
+    if doc.get('expires'):
+        yield _text_element('Expires', isodate.parse_datetime(doc['expires']).isoformat())
+
+    if doc.get('subject'):
+        yield _text_element('Subject', _check_str(doc['subject'], 'subject'))
+
+    for alias in doc.get('aliases') or ():
+        yield _text_element('Alias', _check_str(alias, 'alias'))
+
+    for (ptype, value) in (doc.get('properties') or {}).items():
+        yield _property_xml(ptype, value)
+
+    for element in elements:
+        yield element
+
+    for link in doc.get('links') or ():
+        yield _iter_link(link)
+
+    yield '</XRD>'
+
+
+def jrd_to_xrd(content, backend=None, encoding=None):
+    content = _declaration(encoding) + ''.join(iter_jrd_to_xrd(content, backend))
+    if encoding:
+        return content.encode(encoding)
+    return content
@@ -1,89 +1,290 @@
 from __future__ import unicode_literals
-from xml.dom.minidom import getDOMImplementation, parseString, Node
+import codecs
+import itertools
+import re
+from xml.dom.minidom import getDOMImplementation
+from xml.parsers import expat
 
-from rd.core import RD, Element, Link, Property, Title
+from rd import instrument
+from rd.core import RD, XRD, Element, Link, Property, Title, _iterencode
 
 XRD_NAMESPACE = "http://docs.oasis-open.org/ns/xri/xrd-1.0"
+XRDS_NAMESPACE = "xri://$xrds"
 
+CHUNK_SIZE = 64 * 1024
 
-def _get_text(root):
-    text = ''
-    for node in root.childNodes:
-        if node.nodeType == Node.TEXT_NODE and node.nodeValue:
-            text += node.nodeValue
-        else:
-            text += _get_text(node)
-    return text.strip() or None
 
+def _attrs_dict(attrs):
+    return dict(zip(attrs[::2], attrs[1::2]))
 
-def loads(content):
 
-    import isodate
+class _XRDBuilder(object):
 
-    def expires_handler(node, obj):
-        obj.expires = isodate.parse_datetime(_get_text(node))
+    # Receives expat events and builds the RD as elements close. Only the
+    # text of the element currently being captured is kept in memory; the
+    # Link being built is attached to the RD once its end tag is seen.
 
-    def subject_handler(node, obj):
-        obj.subject = _get_text(node)
+    def __init__(self):
 
-    def alias_handler(node, obj):
-        obj.aliases.append(_get_text(node))
+        import isodate
 
-    def property_handler(node, obj):
-        obj.properties.append(Property(node.getAttribute('type'), _get_text(node)))
+        def expires_handler(name, attrs, text, obj):
+            obj.expires = isodate.parse_datetime(text)
 
-    def title_handler(node, obj):
-        obj.titles.append(Title(_get_text(node), node.getAttribute('xml:lang')))
+        def subject_handler(name, attrs, text, obj):
+            obj.subject = text
 
-    def link_handler(node, obj):
-        l = Link()
-        l.rel = node.getAttribute('rel')
-        l.type = node.getAttribute('type')
-        l.href = node.getAttribute('href')
-        l.template = node.getAttribute('template')
-        obj.links.append(l)
+        def alias_handler(name, attrs, text, obj):
+            obj.aliases.append(text)
 
-    handlers = {
-        'Expires': expires_handler,
-        'Subject': subject_handler,
-        'Alias': alias_handler,
-        'Property': property_handler,
-        'Link': link_handler,
-        'Title': title_handler,
-    }
+        def property_handler(name, attrs, text, obj):
+            obj.properties.append(Property(attrs.get('type', ''), text))
 
-    def unknown_handler(node, obj):
-        obj.elements.append(Element(
-            name=node.tagName,
-            value=_get_text(node),
-        ))
+        def title_handler(name, attrs, text, obj):
+            obj.titles.append(Title(text, attrs.get('xml:lang', '')))
 
-    def handle_node(node, obj):
-        handler = handlers.get(node.nodeName, unknown_handler)
-        if handler and node.nodeType == node.ELEMENT_NODE:
-            handler(node, obj)
+        def unknown_handler(name, attrs, text, obj):
+            obj.elements.append(Element(name=name, value=text))
+
+        self.rd_handlers = {
+            'Expires': expires_handler,
+            'Subject': subject_handler,
+            'Alias': alias_handler,
+            'Property': property_handler,
+        }
+        self.rd_unknown_handler = unknown_handler
+
+        self.link_handlers = {
+            'Title': title_handler,
+            'Property': property_handler,
+        }
+
+        self.rd = None
+        self.link = None
+        self.depth = 0
+        self.capture = None
+        self.text = []
+
+    def start(self, name, attrs):
+
+        self.depth += 1
+
+        if self.capture is not None:
+            return
+
+        attrs = _attrs_dict(attrs)
+
+        if self.depth == 1:
+            self.start_root(attrs)
+
+        elif self.depth == 2:
+            if name == 'Link':
+                self.link = Link(
+                    rel=attrs.get('rel', ''),
+                    type=attrs.get('type', ''),
+                    href=attrs.get('href', ''),
+                    template=attrs.get('template', ''),
+                )
+            else:
+                self.capture = (self.depth, attrs, self.rd)
+
+        elif self.depth == 3 and self.link is not None:
+            self.capture = (self.depth, attrs, self.link)
+
+    def start_root(self, attrs):
+
+        self.rd = RD(attrs.get('xml:id', ''))
+
+        # match minidom, which lists namespace declarations first
+        names = sorted(attrs, key=lambda n: not (n == 'xmlns' or n.startswith('xmlns:')))
+        for name in names:
+            if name != 'xml:id':
+                self.rd.attributes.append((name, attrs[name]))
+
+    def end(self, name):
+
+        depth = self.depth
+        self.depth -= 1
+
+        if self.capture is not None:
+            if self.capture[0] == depth:
+                (_, attrs, obj) = self.capture
+                text = ''.join(self.text).strip() or None
+                self.capture = None
+                self.text = []
+                if obj is self.link:
+                    handler = self.link_handlers.get(name)
+                else:
+                    handler = self.rd_handlers.get(name, self.rd_unknown_handler)
+                if handler:
+                    handler(name, attrs, text, obj)
+
+        elif depth == 2 and self.link is not None:
+            self.rd.links.append(self.link)
+            self.link = None
+
+    def data(self, text):
+        if self.capture is not None:
+            self.text.append(text)
+
+
+def _make_parser(builder):
+    parser = expat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = builder.start
+    parser.EndElementHandler = builder.end
+    parser.CharacterDataHandler = builder.data
+    return parser
+
+
+def _chunks(content):
+    if hasattr(content, 'read'):
+        while True:
+            chunk = content.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for pos in range(0, len(content), CHUNK_SIZE):
+            yield content[pos:pos + CHUNK_SIZE]
+
+
+def _feed(parser, content):
+    if hasattr(content, 'read'):
+        for chunk in _chunks(content):
+            parser.Parse(chunk, False)
+        parser.Parse(b'', True)
+    else:
+        parser.Parse(content, True)
 
-    doc = parseString(content)
-    root = doc.documentElement
 
-    rd = RD(root.getAttribute('xml:id'))
+_DECLARED_ENCODING = re.compile(b'<\\?xml[^>]*?encoding\\s*=\\s*["\']([A-Za-z0-9._-]+)')
 
-    for name, value in root.attributes.items():
-        if name != 'xml:id':
-            rd.attributes.append((name, value))
 
-    for node in root.childNodes:
-        handle_node(node, rd)
-        if node.nodeName == 'Link':
-            link = rd.links[-1]
-            for child in node.childNodes:
-                handle_node(child, link)
+def _source_encoding(content):
+    # None unless the encoding can be told from the declaration alone
+    if content[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE) or content[:3] == codecs.BOM_UTF8:
+        return None
+    match = _DECLARED_ENCODING.match(content)
+    if match:
+        return match.group(1).decode('ascii')
+    return 'utf-8'
 
-    return rd
+
+def loads(content):
+
+    probe = instrument.probe('loads', 'xrd')
+
+    builder = _XRDBuilder()
+    _feed(_make_parser(builder), content)
+
+    if isinstance(content, bytes):
+        builder.rd._keep_source(XRD, content, _source_encoding(content))
+    else:
+        builder.rd._keep_source(XRD, content)
+
+    if probe:
+        # decoding and object building are interleaved when streaming
+        probe.mark('parse')
+        probe.input_size = instrument.size_of(content)
+        probe.count_rd(builder.rd)
+        probe.emit()
+
+    return builder.rd
+
+
+class _XRDSBuilder(object):
+
+    # Hands the events for each XRD in an XRDS document to a fresh
+    # _XRDBuilder and queues the RD when the XRD closes, so only one
+    # descriptor is being built at a time. A bare XRD is treated as an
+    # XRDS holding just that descriptor.
+    #
+    # XRDS and XRD are matched on namespace and local name, resolved from
+    # the declarations in scope. Prefixes are resolved here rather than by
+    # expat, which rejects the unbound prefixes the lenient XRD parser
+    # lets through. The XRD builder gets XRD elements by local name and
+    # anything else by its prefixed name, with the declarations inherited
+    # from the XRDS as attributes of the XRD.
+
+    def __init__(self):
+        self.ready = []
+        self.builder = None
+        self.depth = 0
+        self.scopes = [{'xml': 'http://www.w3.org/XML/1998/namespace'}]
+
+    def _resolve(self, name):
+        (prefix, _, local) = name.rpartition(':')
+        return (self.scopes[-1].get(prefix or None), local)
+
+    def _name(self, name):
+        (ns, local) = self._resolve(name)
+        return local if ns == XRD_NAMESPACE else name
+
+    def start(self, name, attrs):
+
+        scope = self.scopes[-1]
+        declared = [(attr, value) for (attr, value) in zip(attrs[::2], attrs[1::2])
+                    if attr == 'xmlns' or attr.startswith('xmlns:')]
+        if declared:
+            scope = dict(scope)
+            for (attr, value) in declared:
+                scope[attr[6:] or None] = value or None
+        self.scopes.append(scope)
+
+        self.depth += 1
+        (ns, local) = self._resolve(name)
+        if self.depth == 1 and (local != 'XRDS' or ns not in (XRDS_NAMESPACE, None)):
+            self.depth += 1
+        if self.depth == 2 and local == 'XRD' and ns in (XRD_NAMESPACE, None):
+            self.builder = _XRDBuilder()
+            own = set(attrs[::2])
+            for (prefix, uri) in sorted(self.scopes[-2].items(), key=lambda item: item[0] or ''):
+                attr = 'xmlns:%s' % prefix if prefix else 'xmlns'
+                if prefix != 'xml' and uri and uri != XRDS_NAMESPACE and attr not in own:
+                    attrs = [attr, uri] + attrs
+
+        if self.builder is not None:
+            self.builder.start(self._name(name), attrs)
+
+    def end(self, name):
+        if self.builder is not None:
+            self.builder.end(self._name(name))
+            if self.depth == 2:
+                self.ready.append(self.builder.rd)
+                self.builder = None
+        self.depth -= 1
+        self.scopes.pop()
+
+    def data(self, text):
+        if self.builder is not None:
+            self.builder.data(text)
+
+
+def iterloads(content):
+
+    # yields each XRD in an XRDS document as an RD while parsing
+
+    builder = _XRDSBuilder()
+    parser = _make_parser(builder)
+
+    for chunk in _chunks(content):
+        parser.Parse(chunk, False)
+        if builder.ready:
+            for rd in builder.ready:
+                yield rd
+            del builder.ready[:]
+
+    parser.Parse(b'', True)
+    for rd in builder.ready:
+        yield rd
 
 
 def dumps(xrd):
 
+    probe = instrument.probe('dumps', 'xrd')
+
     doc = getDOMImplementation().createDocument(XRD_NAMESPACE, "XRD", None)
     root = doc.documentElement
     root.setAttribute('xmlns', XRD_NAMESPACE)
@@ -142,22 +343,225 @@ def dumps(xrd):
         if link.template:
             link_node.setAttribute('template', link.template)
 
-        for title in link.titles:
-            node = doc.createElement('Title')
-            node.appendChild(doc.createTextNode(str(title)))
-            if title.lang:
-                node.setAttribute('xml:lang', title.lang)
-            link_node.appendChild(node)
-
-        for prop in link.properties:
-            node = doc.createElement('Property')
-            node.setAttribute('type', prop.type)
-            if prop.value:
-                node.appendChild(doc.createTextNode(str(prop.value)))
-            else:
-                node.setAttribute('xsi:nil', 'true')
-            link_node.appendChild(node)
+        if link.has_titles():
+            for title in link.titles:
+                node = doc.createElement('Title')
+                node.appendChild(doc.createTextNode(title.value))
+                if title.lang:
+                    node.setAttribute('xml:lang', title.lang)
+                link_node.appendChild(node)
+
+        if link.has_properties():
+            for prop in link.properties:
+                node = doc.createElement('Property')
+                node.setAttribute('type', prop.type)
+                if prop.value:
+                    node.appendChild(doc.createTextNode(str(prop.value)))
+                else:
+                    node.setAttribute('xsi:nil', 'true')
+                link_node.appendChild(node)
 
         root.appendChild(link_node)
 
+    if probe:
+        probe.mark('build')
+        probe.count_rd(xrd)
+        probe.emit()
+
     return doc
+
+
+#
+# direct text serialization
+#
+
+def _escape(data):
+    return data.replace("&", "&amp;").replace("<", "&lt;") \
+        .replace("\"", "&quot;").replace(">", "&gt;")
+
+
+def _start_tag(name, attrs, empty=False):
+    parts = ['<', name]
+    for (key, value) in attrs:
+        parts.append(' %s="%s"' % (key, _escape(value)))
+    parts.append('/>' if empty else '>')
+    return ''.join(parts)
+
+
+def _text_element(name, text, attrs=()):
+    if not text:
+        return _start_tag(name, attrs, empty=True)
+    return '%s%s</%s>' % (_start_tag(name, attrs), _escape(text), name)
+
+
+def _property_element(prop):
+    return _property_xml(prop.type, prop.value)
+
+
+def _property_xml(type_, value):
+    if value:
+        return _text_element('Property', str(value), [('type', type_)])
+    return _start_tag('Property', [('type', type_), ('xsi:nil', 'true')], empty=True)
+
+
+def _title_xml(value, lang):
+    attrs = [('xml:lang', lang)] if lang else []
+    return _text_element('Title', value, attrs)
+
+
+def _root_attrs(xrd):
+
+    # later attributes replace earlier ones of the same name in place,
+    # the same way setAttribute does on the DOM
+    attrs = [('xmlns', XRD_NAMESPACE)]
+    index = {'xmlns': 0}
+
+    def set_attr(name, value):
+        if name in index:
+            attrs[index[name]] = (name, value)
+        else:
+            index[name] = len(attrs)
+            attrs.append((name, value))
+
+    if xrd.xml_id:
+        set_attr('xml:id', xrd.xml_id)
+
+    for attr in xrd.attributes:
+        set_attr(attr.name, attr.value)
+
+    return attrs
+
+
+def _link_element(link):
+
+    titles = ()
+    if link.has_titles():
+        titles = ((title.value, title.lang) for title in link.titles)
+
+    properties = ()
+    if link.has_properties():
+        properties = ((prop.type, prop.value) for prop in link.properties)
+
+    return _link_xml(link.rel, link.type, link.href, link.template, titles, properties)
+
+
+def _link_xml(rel, type_, href, template, titles=(), properties=()):
+
+    # titles are (value, lang) and properties (type, value) pairs
+
+    if href and template:
+        raise ValueError('only one of href or template attributes may be specified')
+
+    attrs = []
+
+    if rel:
+        attrs.append(('rel', rel))
+
+    if type_:
+        attrs.append(('type', type_))
+
+    if href:
+        attrs.append(('href', href))
+
+    if template:
+        attrs.append(('template', template))
+
+    children = [_title_xml(value, lang) for (value, lang) in titles]
+    children.extend(_property_xml(ptype, pvalue) for (ptype, pvalue) in properties)
+
+    if not children:
+        return _start_tag('Link', attrs, empty=True)
+
+    children.insert(0, _start_tag('Link', attrs))
+    children.append('</Link>')
+    return ''.join(children)
+
+
+def _iter_xrd(xrd):
+
+    yield _start_tag('XRD', _root_attrs(xrd))
+
+    if xrd.expires:
+        yield _text_element('Expires', xrd.expires.isoformat())
+
+    if xrd.subject:
+        yield _text_element('Subject', xrd.subject)
+
+    for alias in xrd.aliases:
+        yield _text_element('Alias', alias)
+
+    for prop in xrd.properties:
+        yield _property_element(prop)
+
+    for element in xrd.elements:
+        yield _text_element(element.name, element.value)
+
+    for link in xrd.links:
+        yield _link_element(link)
+
+    yield '</XRD>'
+
+
+def _declaration(encoding=None):
+    if encoding:
+        return '<?xml version="1.0" encoding="%s"?>' % encoding
+    return '<?xml version="1.0" ?>'
+
+
+# Serialize to XRD text without building a DOM. An encoding produces
+# bytes, otherwise text is returned, yielded or written.
+
+def tostring(xrd, encoding=None):
+
+    probe = instrument.probe('dumps', 'xrd')
+
+    content = _declaration(encoding) + ''.join(_iter_xrd(xrd))
+    if encoding:
+        content = content.encode(encoding)
+
+    if probe:
+        probe.mark('encode')
+        probe.count_rd(xrd)
+        probe.output_size = instrument.size_of(content)
+        probe.emit()
+
+    return content
+
+
+def iterdumps(xrd, encoding=None):
+    return _iterencode(itertools.chain([_declaration(encoding)], _iter_xrd(xrd)), encoding)
+
+
+def iterdumps_xrds(xrds, encoding=None):
+
+    # each RD is serialized only when it's reached, so xrds may be a
+    # generator of any length
+
+    parts = itertools.chain(
+        [_declaration(encoding), _start_tag('XRDS', [('xmlns', XRDS_NAMESPACE)])],
+        itertools.chain.from_iterable(map(_iter_xrd, xrds)),
+        ['</XRDS>'],
+    )
+    return _iterencode(parts, encoding)
+
+
+def dump_xrds(xrds, fp, encoding=None):
+    for part in iterdumps_xrds(xrds, encoding):
+        fp.write(part)
+
+
+def dump(xrd, fp, encoding=None):
+
+    probe = instrument.probe('dumps', 'xrd')
+    size = 0
+
+    for part in iterdumps(xrd, encoding):
+        fp.write(part)
+        if probe:
+            size += instrument.size_of(part)
+
+    if probe:
+        probe.mark('encode')
+        probe.count_rd(xrd)
+        probe.output_size = size
+        probe.emit()
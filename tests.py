@@ -1,11 +1,30 @@
 from __future__ import unicode_literals
+import codecs
 import datetime
+import io
 import json
 import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 
 import pytz
-from rd import RD, Link, Property, Title, jrd, xrd
+import rd
+from rd import RD, Attribute, Element, Link, Property, Title, instrument, jrd, template, transcode, xrd
+from rd.cache import DescriptorCache
+from rd.collection import RDCollection
+
+try:
+    from rd.store import RDStore
+except ImportError:  # python 2
+    RDStore = None
+
+# the discovery client and server tests are in tests_discovery.py and
+# tests_server.py, they need python 3
 
 PWD = os.path.abspath(os.path.dirname(__file__))
 
@@ -166,6 +185,495 @@ class TestXRDTitle(unittest.TestCase):
         self.assertTrue(t1 != t2)
 
 
+class TestCompactModel(unittest.TestCase):
+
+    def testslots(self):
+        for obj in (Link(), Title('t'), Property('p'), Attribute('a', 'b'), Element('e', 'v')):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertFalse(hasattr(Link().titles, '__dict__'))
+
+    def testlazylists(self):
+        link = Link(rel='author')
+        self.assertFalse(link.has_titles())
+        self.assertFalse(link.has_properties())
+        self.assertIsNone(link._titles)
+
+        xrd.tostring(self.rd_with(link))
+        jrd.dumps(self.rd_with(link))
+        self.assertIsNone(link._titles)
+        self.assertIsNone(link._properties)
+
+        link.titles.append('Author')
+        self.assertTrue(link.has_titles())
+        self.assertEqual(link.titles[0].value, 'Author')
+
+    def testelementattrs(self):
+        elem = Element('e', 'v')
+        self.assertEqual(elem.attrs, {})
+        elem.attrs['k'] = 'v'
+        self.assertEqual(Element('e', 'v', {'k': 'v'}).attrs, elem.attrs)
+
+    def testpickle(self):
+        link = Link(rel='author', href='http://example.com/')
+        link.titles.append(('Author', 'en'))
+        link = pickle.loads(pickle.dumps(link, 2))
+        self.assertEqual(link.rel, 'author')
+        self.assertEqual(link.titles[0].lang, 'en')
+        self.assertIsNone(link._properties)
+
+    def rd_with(self, link):
+        rd = RD()
+        rd.links.append(link)
+        return rd
+
+
+class TestFrozenRD(unittest.TestCase):
+
+    def setUp(self):
+        self.rd = RD(subject='acct:bob@example.com')
+        self.rd.expires = datetime.datetime(2012, 10, 12, 20, 56, 11, tzinfo=pytz.utc)
+        self.rd.aliases.append('http://example.com/bob')
+        self.rd.properties.append(('mimetype', 'text/plain'))
+        link = Link(rel='author', href='http://example.com/bob')
+        link.titles.append(('Bob', 'en'))
+        link.properties.append(('http://example.com/ns/role', 'editor'))
+        self.rd.links.append(link)
+        self.rd.links.append(Link(rel='lrdd', template='http://example.com/{uri}'))
+
+    def testimmutable(self):
+        frozen = self.rd.freeze()
+        self.assertRaises(AttributeError, setattr, frozen, 'subject', 'acct:eve@example.com')
+        self.assertRaises(AttributeError, setattr, frozen.links[0], 'href', 'http://example.com/')
+        self.assertTrue(isinstance(frozen.links, tuple))
+
+    def testhashable(self):
+        frozen = self.rd.freeze()
+        other = self.rd.freeze().thaw()
+        other.links.append(Link(rel='extra'))
+        self.assertEqual(frozen, frozen.thaw().freeze())
+        self.assertEqual(hash(frozen), hash(frozen.thaw().freeze()))
+        self.assertNotEqual(frozen, other.freeze())
+        self.assertEqual(len(set([frozen, frozen.thaw().freeze(), other.freeze()])), 2)
+
+    def testsharing(self):
+        frozen = self.rd.freeze()
+        self.assertTrue(self.rd.freeze() is frozen)
+        self.rd.links[1].href = None
+        self.rd.links.append(Link(rel='extra'))
+        changed = self.rd.freeze()
+        self.assertFalse(changed is frozen)
+        self.assertTrue(changed.links[0] is frozen.links[0])
+        self.assertTrue(changed.links[0].titles[0] is frozen.links[0].titles[0])
+        self.assertTrue(changed.properties[0] is frozen.properties[0])
+
+    def testthaw(self):
+        frozen = self.rd.freeze()
+        rd = frozen.thaw()
+        rd.links[0].titles.append('Robert')
+        self.assertEqual(len(frozen.links[0].titles), 1)
+        self.assertEqual(rd.find_link('author').titles[1].value, 'Robert')
+        self.assertEqual(rd.expires, self.rd.expires)
+
+    def testextensions(self):
+        doc = {'subject': 'acct:bob@example.com', 'ext': {'k': 'v', 'n': [1, {'a': 2}]}}
+        descriptor = jrd.loads(json.dumps(doc))
+        frozen = descriptor.freeze()
+        self.assertEqual(hash(frozen), hash(jrd.loads(json.dumps(doc)).freeze()))
+        self.assertRaises(TypeError, frozen.elements[0].value.update, {})
+        self.assertEqual(frozen.elements[0].thaw().value, doc['ext'])
+        self.assertEqual(json.loads(frozen.to_json()), doc)
+        self.assertEqual(pickle.loads(pickle.dumps(frozen)), frozen)
+        descriptor.aliases.append('http://example.com/bob')
+        self.assertNotEqual(descriptor.freeze(), frozen)
+        changed = jrd.loads(json.dumps(dict(doc, ext={'k': 'w'})))
+        delta = rd.diff(jrd.loads(json.dumps(doc)), changed)
+        self.assertEqual(delta['elements'], {'removed': [['ext', doc['ext']]], 'added': [['ext', {'k': 'w'}]]})
+        patched = rd.patch(jrd.loads(json.dumps(doc)), json.loads(json.dumps(delta)))
+        self.assertEqual(patched.freeze(), changed.freeze())
+
+    def testserialization(self):
+        frozen = self.rd.freeze()
+        self.assertEqual(frozen.to_json(), self.rd.to_json())
+        self.assertEqual(frozen.to_xml(dom=False), self.rd.to_xml(dom=False))
+        self.assertEqual(frozen.find_link(['missing', 'lrdd'], 'template'), 'http://example.com/{uri}')
+        self.assertEqual(pickle.loads(pickle.dumps(frozen)), frozen)
+
+
+class TestSerializationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.rd = RD(subject='acct:bob@example.com')
+        link = Link(rel='author', href='http://example.com/bob')
+        link.titles.append(('Bob', 'en'))
+        self.rd.links.append(link)
+
+    def testreused(self):
+        content = self.rd.to_json()
+        self.assertTrue(self.rd.to_json() is content)
+        content = self.rd.to_xml(dom=False)
+        self.assertTrue(self.rd.to_xml(dom=False) is content)
+        self.assertEqual(self.rd.to_json(encoding='utf-8'), jrd.dumps(self.rd, encoding='utf-8'))
+
+    def testmutations(self):
+        mutations = [
+            lambda rd: setattr(rd, 'subject', 'acct:eve@example.com'),
+            lambda rd: setattr(rd, 'expires', datetime.datetime(2012, 1, 1, tzinfo=pytz.utc)),
+            lambda rd: rd.aliases.append('http://example.com/eve'),
+            lambda rd: rd.properties.append(('mimetype', 'text/plain')),
+            lambda rd: rd.attributes.append(('xmlns:ex', 'http://example.com/ns')),
+            lambda rd: rd.links.append(Link(rel='lrdd')),
+            lambda rd: rd.links.pop(),
+            lambda rd: rd.links[0].titles.append(('Robert', 'fr')),
+            lambda rd: rd.links[0].properties.append(('role', 'editor')),
+            lambda rd: setattr(rd.links[0], 'href', 'http://example.com/eve'),
+        ]
+        for mutate in mutations:
+            json_content = self.rd.to_json()
+            xml_content = self.rd.to_xml(dom=False)
+            frozen = self.rd.freeze()
+            mutate(self.rd)
+            self.assertNotEqual(self.rd.to_json(), json_content)
+            self.assertNotEqual(self.rd.to_xml(dom=False), xml_content)
+            self.assertNotEqual(self.rd.freeze(), frozen)
+
+    def testkeysetters(self):
+        self.rd.properties.append(('t', 'v'))
+        self.rd.attributes.append(('xmlns:ex', 'http://example.com/ns'))
+        self.rd.links[0].properties.append(('p', 'v'))
+        content = self.rd.to_json()
+        self.rd.properties[0].type = 'u'
+        self.assertEqual(json.loads(self.rd.to_json())['properties'], {'u': 'v'})
+        self.rd.links[0].properties[0].type = 'q'
+        self.assertEqual(json.loads(self.rd.to_json())['links'][0]['properties'], {'q': 'v'})
+        self.rd.attributes[0].name = 'xmlns:other'
+        self.assertTrue('xmlns:other' in self.rd.to_xml(dom=False))
+        self.assertNotEqual(self.rd.to_json(), content)
+
+    def testchanged(self):
+        content = self.rd.to_json()
+        self.rd.links[0].titles[0].value = 'Robert'
+        self.assertTrue(self.rd.to_json() is content)
+        self.rd.changed()
+        self.assertTrue('Robert' in self.rd.to_json())
+
+    def testsource(self):
+        content = '{"subject":  "acct:bob@example.com"}'
+        rd = jrd.loads(content)
+        self.assertTrue(rd.to_json() is content)
+        self.assertEqual(rd.to_json(encoding='utf-8'), content.encode('utf-8'))
+        rd = jrd.loads(content.encode('utf-8'), lazy=True)
+        self.assertEqual(rd.to_json(), content)
+        rd.links
+        self.assertEqual(rd.to_json(), content)
+        rd.subject = 'acct:eve@example.com'
+        self.assertEqual(json.loads(rd.to_json()), {'subject': 'acct:eve@example.com'})
+
+        content = xrd.tostring(self.rd, encoding='utf-8').replace(b'><', b'>\n<')
+        rd = xrd.loads(content)
+        self.assertTrue(rd.to_xml(dom=False, encoding='UTF-8') is content)
+        self.assertEqual(rd.to_xml(dom=False), content.decode('utf-8'))
+        rd.links[0].titles.append('Robert')
+        self.assertEqual(rd.to_xml(dom=False), xrd.tostring(rd))
+
+    def testlazylink(self):
+        content = '{"subject": "acct:bob@example.com", "links": [{"rel": "a", "href": "x"}]}'
+        rd = jrd.loads(content, lazy=True)
+        self.assertEqual(rd.to_json(), content)
+        rd.find_link('a').href = 'CHANGED'
+        self.assertEqual(json.loads(rd.to_json())['links'][0]['href'], 'CHANGED')
+        rd.links
+        self.assertEqual(json.loads(rd.to_json())['links'][0]['href'], 'CHANGED')
+
+    def testencodedsource(self):
+        content = '{"subject": "acct:bob@example.com"}'
+        for encoding in ('utf-16', 'utf-16-le', 'utf-32'):
+            rd = jrd.loads(content.encode(encoding), backend='json')
+            self.assertEqual(rd.to_json(), content)
+            self.assertEqual(rd.to_json(encoding='utf-8'), content.encode('utf-8'))
+
+    def testsharedlink(self):
+        other = RD(subject='acct:alice@example.com')
+        link = self.rd.links[0]
+        other.links.append(link)
+        self.rd.to_json()
+        other.to_json()
+        link.href = 'http://example.com/robert'
+        self.assertTrue('robert' in self.rd.to_json())
+        self.assertTrue('robert' in other.to_json())
+        link.titles.append('Robert')
+        self.assertTrue('Robert' in self.rd.to_json())
+        self.assertTrue('Robert' in other.to_json())
+
+    def testcopies(self):
+        content = self.rd.to_json()
+        rd = pickle.loads(pickle.dumps(self.rd))
+        rd.links[0].href = 'http://example.com/eve'
+        self.assertTrue(self.rd.to_json() is content)
+        self.assertTrue('eve' in rd.to_json())
+
+
+class TestDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.old = RD(subject='acct:bob@example.com')
+        self.old.aliases.append('http://example.com/bob')
+        self.old.properties.append(('mimetype', 'text/plain'))
+        link = Link(rel='author', href='http://example.com/bob')
+        link.titles.append(('Bob', 'en'))
+        self.old.links.append(link)
+        self.old.links.append(Link(rel='lrdd', template='http://example.com/{uri}'))
+        self.old.links.append(Link(rel='lrdd', template='http://example.com/{uri}'))
+
+        self.new = self.old.freeze().thaw()
+        self.new.subject = 'acct:robert@example.com'
+        self.new.expires = datetime.datetime(2012, 10, 12, 20, 56, 11, tzinfo=pytz.utc)
+        self.new.aliases.append('http://example.com/robert')
+        self.new.properties[0] = ('mimetype', 'text/html')
+        self.new.links[0].titles.append(('Robert', 'fr'))
+        self.new.links.pop()
+        self.new.links.append(Link(rel='avatar', href='http://example.com/bob.png'))
+        self.new.elements.append(Element('Foo', 'bar'))
+
+    def testequal(self):
+        self.assertEqual(rd.diff(self.old, self.old.freeze().thaw()), {})
+        self.assertEqual(rd.diff(self.old.freeze(), self.old), {})
+
+    def testdelta(self):
+        delta = rd.diff(self.old, self.new)
+        self.assertEqual(delta['subject'], ['acct:bob@example.com', 'acct:robert@example.com'])
+        self.assertEqual(delta['expires'], [None, '2012-10-12T20:56:11+00:00'])
+        self.assertEqual(delta['aliases'], {'added': ['http://example.com/robert']})
+        self.assertEqual(delta['properties'], {'removed': [['mimetype', 'text/plain']],
+                                               'added': [['mimetype', 'text/html']]})
+        self.assertEqual(delta['links']['removed'], [['lrdd', None, None, 'http://example.com/{uri}', 1]])
+        self.assertEqual(delta['links']['added'][0]['rel'], 'avatar')
+        self.assertEqual(delta['links']['changed'][0]['titles'], {'added': [['Robert', 'fr']]})
+        self.assertEqual(rd.delta.changed_rels(delta), set(['author', 'lrdd', 'avatar']))
+
+    def testpatch(self):
+        delta = json.loads(json.dumps(rd.diff(self.old, self.new)))
+        patched = rd.patch(self.old.freeze().thaw(), delta)
+        self.assertEqual(rd.diff(patched, self.new), {})
+        self.assertEqual(patched.expires, self.new.expires)
+        self.assertEqual(patched.elements[0].name, 'Foo')
+
+    def testconflict(self):
+        delta = rd.diff(self.old, self.new)
+        self.assertRaises(ValueError, rd.patch, self.new.freeze().thaw(), delta)
+        del delta['subject']
+        self.assertRaises(ValueError, rd.patch, RD(), delta)
+
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.hostmeta = RD()
+        self.hostmeta.expires = datetime.datetime(2012, 10, 12, tzinfo=pytz.utc)
+        self.hostmeta.properties.append(('http://example.com/ns/host', 'example.com'))
+        self.hostmeta.properties.append(('http://example.com/ns/tier', 'free'))
+        self.hostmeta.links.append(Link(rel='lrdd', template='https://example.com/lrdd?uri={uri}'))
+        self.hostmeta.links.append(Link(rel='copyright', href='http://example.com/copyright'))
+        self.hostmeta.links.append(Link(rel='author', href='http://example.com/staff'))
+
+        self.lrdd = RD(subject='acct:bob@example.com')
+        self.lrdd.expires = datetime.datetime(2012, 10, 11, tzinfo=pytz.utc)
+        self.lrdd.aliases.append('http://example.com/bob')
+        self.lrdd.properties.append(('http://example.com/ns/tier', 'paid'))
+        self.lrdd.links.append(Link(rel='author', href='http://example.com/bob'))
+
+    def testdefault(self):
+        merged = rd.merge(self.hostmeta, self.lrdd)
+        self.assertEqual(merged.subject, 'acct:bob@example.com')
+        self.assertEqual(merged.expires, self.lrdd.expires)
+        self.assertEqual([link.rel for link in merged.links], ['author', 'lrdd', 'copyright'])
+        self.assertEqual(merged.find_link('author', 'href'), 'http://example.com/bob')
+        self.assertEqual([(p.type, p.value) for p in merged.properties],
+                         [('http://example.com/ns/tier', 'paid'), ('http://example.com/ns/host', 'example.com')])
+
+    def testprecedence(self):
+        merged = rd.merge(self.hostmeta, self.lrdd, rels={'author': rd.merging.BASE},
+                          properties={'http://example.com/ns/tier': rd.merging.BOTH})
+        self.assertEqual(merged.find_link('author', 'href'), 'http://example.com/staff')
+        self.assertEqual(len(merged.links.lookup('author')), 1)
+        self.assertEqual(len(merged.properties.lookup('http://example.com/ns/tier')), 2)
+        merged = rd.merge(self.hostmeta, self.lrdd, default=rd.merging.BOTH)
+        self.assertEqual(len(merged.links.lookup('author')), 2)
+        self.assertRaises(ValueError, rd.merge, self.hostmeta, self.lrdd, default='first')
+
+    def testindependent(self):
+        merged = rd.merge(self.hostmeta, self.lrdd)
+        content = self.lrdd.to_json()
+        merged.find_link('author').href = 'http://example.com/robert'
+        self.assertEqual(self.lrdd.links[0].href, 'http://example.com/bob')
+        self.assertTrue(self.lrdd.to_json() is content)
+
+    def testview(self):
+        view = rd.merge(self.hostmeta, self.lrdd, view=True)
+        self.assertTrue(view.links[0] is self.lrdd.links[0])
+        self.assertEqual(view.find_link('author', 'href'), 'http://example.com/bob')
+        self.assertEqual(view.find_link(['copyright', 'lrdd'], 'rel'), 'lrdd')
+        self.assertEqual(json.loads(view.to_json()), json.loads(view.to_rd().to_json()))
+        self.lrdd.links.pop()
+        self.assertEqual(view.find_link('author', 'href'), 'http://example.com/staff')
+        view = rd.merge(self.hostmeta, self.lrdd.freeze(), rels={'lrdd': rd.merging.BASE}, view=True)
+        self.assertEqual(view.find_link('lrdd', 'template'), 'https://example.com/lrdd?uri={uri}')
+
+
+class TestURITemplate(unittest.TestCase):
+
+    def setUp(self):
+        self.values = {
+            'var': 'value',
+            'hello': 'Hello World!',
+            'path': '/foo/bar',
+            'list': ['red', 'green', 'blue'],
+            'keys': {'semi': ';'},
+            'x': '1024',
+            'y': '768',
+            'empty': '',
+        }
+
+    def testlevels(self):
+        examples = [
+            ('{var}', 'value'),
+            ('{hello}', 'Hello%20World%21'),
+            ('{+hello}', 'Hello%20World!'),
+            ('{+path}/here', '/foo/bar/here'),
+            ('{#path,x}/here', '#/foo/bar,1024/here'),
+            ('map?{x,y}', 'map?1024,768'),
+            ('{.list*}', '.red.green.blue'),
+            ('{/var:1,var}', '/v/value'),
+            ('{;x,y,empty}', ';x=1024;y=768;empty'),
+            ('{?x,y,undef}', '?x=1024&y=768'),
+            ('?fixed=yes{&x}', '?fixed=yes&x=1024'),
+            ('{?keys*}', '?semi=%3B'),
+            ('{list}', 'red,green,blue'),
+        ]
+        for (tpl, expected) in examples:
+            self.assertEqual(template.expand(tpl, self.values), expected)
+
+    def testcompile(self):
+        compiled = template.compile('https://example.com/lrdd?uri={uri}')
+        self.assertTrue(template.compile('https://example.com/lrdd?uri={uri}') is compiled)
+        self.assertEqual(compiled.variables, ['uri'])
+        expected = 'https://example.com/lrdd?uri=acct%3Abob%40example.com'
+        self.assertEqual(compiled.expand('acct:bob@example.com'), expected)
+        self.assertEqual(compiled.expand(uri='acct:bob@example.com'), expected)
+        self.assertEqual(compiled.expand({'uri': 'acct:bob@example.com'}), expected)
+        self.assertEqual(list(compiled.expand_all(['a', 'b'])),
+                         ['https://example.com/lrdd?uri=a', 'https://example.com/lrdd?uri=b'])
+
+    def testcompositekwarg(self):
+        # lists and dicts given by name go through the general path
+        self.assertEqual(template.expand('x{uri}', uri={'a': 'b'}), 'xa,b')
+        self.assertEqual(template.expand('x{uri}', uri=['a', 'b']), 'xa,b')
+        self.assertEqual(template.expand('x{uri}', other='y'), 'x')
+
+    def testinvalid(self):
+        for tpl in ('{uri', 'uri}', '{}', '{=uri}', '{uri:0}', '{a b}'):
+            self.assertRaises(template.TemplateError, template.compile, tpl)
+        self.assertRaises(ValueError, template.compile('{a}{b}').expand, 'value')
+
+    def testlink(self):
+        link = Link(rel='lrdd', template='http://example.com/{uri}')
+        self.assertEqual(link.expand('acct:bob@example.com'), 'http://example.com/acct%3Abob%40example.com')
+        self.assertEqual(link.freeze().expand(uri='x'), 'http://example.com/x')
+        self.assertEqual(list(link.expand_all(['a', 'b'])), ['http://example.com/a', 'http://example.com/b'])
+        self.assertRaises(ValueError, Link(rel='author', href='http://example.com/bob').expand, 'x')
+
+
+class TestIndexedLookups(unittest.TestCase):
+
+    def setUp(self):
+        self.rd = RD()
+        self.rd.links.append(Link(rel='author', href='http://example.com/1'))
+        self.rd.links.append(Link(rel='lrdd', template='http://example.com/{uri}'))
+        self.rd.links.append(Link(rel='author', href='http://example.com/2'))
+
+    def hrefs(self, rel):
+        return [link.href for link in self.rd.links(rel)]
+
+    def testlookup(self):
+        self.assertEqual(self.hrefs('author'), ['http://example.com/1', 'http://example.com/2'])
+        self.assertEqual(self.hrefs('missing'), [])
+
+    def testappend(self):
+        self.hrefs('author')
+        self.rd.links.append(Link(rel='author', href='http://example.com/3'))
+        self.rd.links.extend([Link(rel='author', href='http://example.com/4')])
+        self.assertEqual(len(self.hrefs('author')), 4)
+
+    def testsetitem(self):
+        self.hrefs('author')
+        self.rd.links[0] = Link(rel='other', href='http://example.com/0')
+        self.assertEqual(self.hrefs('author'), ['http://example.com/2'])
+        self.assertEqual(self.hrefs('other'), ['http://example.com/0'])
+
+    def testdelete(self):
+        self.hrefs('author')
+        del self.rd.links[0]
+        self.assertEqual(self.hrefs('author'), ['http://example.com/2'])
+        self.assertEqual(self.rd.find_link('lrdd'), self.rd.links[0])
+
+    def testslice(self):
+        self.hrefs('author')
+        self.rd.links[:2] = [Link(rel='author', href='http://example.com/0')]
+        self.assertEqual(self.hrefs('author'), ['http://example.com/0', 'http://example.com/2'])
+        self.assertIsNone(self.rd.find_link('lrdd'))
+
+    def testkeychange(self):
+        self.hrefs('author')
+        self.rd.links[1].rel = 'author'
+        self.assertEqual(len(self.hrefs('author')), 3)
+        self.assertIsNone(self.rd.find_link('lrdd'))
+
+    def testkeychangeotherlists(self):
+        # only the lists holding the link rebuild their indexes
+        other = RD()
+        other.links.append(Link(rel='author'))
+        shared = RD()
+        shared.links.append(self.rd.links[1])
+        for descriptor in (self.rd, other, shared):
+            descriptor.find_link('author')
+        self.rd.links[1].rel = 'author'
+        self.assertIsNotNone(other.links._index)
+        self.assertIsNone(shared.links._index)
+        self.assertEqual(len(list(shared.links('author'))), 1)
+        self.assertEqual(len(self.hrefs('author')), 3)
+
+    def testremovedkeychange(self):
+        # removed links forget the lists they were in
+        other = RD()
+        link = self.rd.links.pop(1)
+        other.links.append(link)
+        self.rd.links.insert(0, Link(rel='lrdd'))
+        self.rd.links[-1:] = []
+        self.assertTrue(link._owner is other.links)
+        self.assertTrue(all(item._owner is self.rd.links for item in self.rd.links))
+        self.rd.find_link('author')
+        link.rel = 'author'
+        self.assertIsNotNone(self.rd.links._index)
+        del other.links[:]
+        self.assertIsNone(link._owner)
+
+    def testfindlink(self):
+        link = self.rd.find_link(('lrdd', 'author'))
+        self.assertEqual(link.href, 'http://example.com/1')
+        self.assertEqual(self.rd.find_link('lrdd', 'template'), 'http://example.com/{uri}')
+        self.assertIsNone(self.rd.find_link('missing', 'href'))
+
+    def testproperties(self):
+        self.rd.properties.append(('http://example.com/p', '1'))
+        self.rd.properties.append(('http://example.com/q', '2'))
+        self.assertEqual([p.value for p in self.rd.properties('http://example.com/q')], ['2'])
+        self.rd.properties[1].type = 'http://example.com/p'
+        self.assertEqual(len(list(self.rd.properties('http://example.com/p'))), 2)
+
+    def testpickle(self):
+        links = pickle.loads(pickle.dumps(self.rd.links, 2))
+        self.assertEqual([link.href for link in links('author')], self.hrefs('author'))
+
+
 class TestJRDDeserialization(unittest.TestCase):
 
     def setUp(self):
@@ -200,6 +708,47 @@ class TestJRDDeserialization(unittest.TestCase):
                 self.assertEqual(title.value, "the real rel")
 
 
+class TestLazyJRDDeserialization(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.join(PWD, 'examples', 'jrd-rfc6415-A.json')
+        with open(path) as infile:
+            self.data = infile.read()
+
+    def testmatcheseager(self):
+        eager = jrd.loads(self.data)
+        lazy = jrd.loads(self.data, lazy=True)
+        self.assertEqual(lazy.subject, eager.subject)
+        self.assertEqual(lazy.expires, eager.expires)
+        self.assertEqual(lazy.aliases, eager.aliases)
+        self.assertEqual([str(p) for p in lazy.properties], [str(p) for p in eager.properties])
+        self.assertEqual(len(lazy.links), len(eager.links))
+        for (l, e) in zip(lazy.links, eager.links):
+            self.assertEqual((l.rel, l.type, l.href, l.template), (e.rel, e.type, e.href, e.template))
+            self.assertEqual([str(t) for t in l.titles], [str(t) for t in e.titles])
+            self.assertEqual([str(p) for p in l.properties], [str(p) for p in e.properties])
+        self.assertEqual(json.loads(lazy.to_json()), json.loads(eager.to_json()))
+
+    def testfindlink(self):
+        rd = jrd.loads(self.data, lazy=True)
+        link = rd.find_link('copyright')
+        self.assertEqual(link.template, 'http://example.com/copyright?id={uri}')
+        self.assertEqual(list(rd._built.keys()), [2])
+        self.assertIsNone(rd._links)
+        self.assertIsNone(link._titles)
+
+        # the link built for the lookup is reused once the list is built
+        self.assertTrue(rd.links[2] is link)
+        self.assertEqual(rd.find_link('author', 'href'), 'http://blog.example.com/author/steve')
+
+    def testlazylinktitles(self):
+        rd = jrd.loads(self.data, lazy=True)
+        link = rd.find_link('author')
+        self.assertTrue(link.has_titles())
+        self.assertIsNone(link._titles)
+        self.assertEqual(link.titles[0], Title('About the Author'))
+
+
 class TestXRDDeserialization(unittest.TestCase):
 
     def setUp(self):
@@ -231,6 +780,55 @@ class TestXRDDeserialization(unittest.TestCase):
         self.assertEqual(link.template, "http://google.com/{uri}")
 
 
+class TestXRDStreamingDeserialization(unittest.TestCase):
+
+    doc = """<?xml version="1.0" ?>
+        <XRD xmlns="http://docs.oasis-open.org/ns/xri/xrd-1.0" xml:id="1234">
+            <Subject>acct:bob@example.com</Subject>
+            <Link rel="lrdd" template="http://example.com/lrdd?uri={uri}">
+                <Title xml:lang="en">LRDD</Title>
+                <Property type="http://example.com/p">value</Property>
+            </Link>
+            <Link rel="author" href="http://example.com/bob" />
+        </XRD>
+        """
+
+    def assertDocument(self, rd):
+        self.assertEqual(rd.xml_id, "1234")
+        self.assertEqual(rd.subject, "acct:bob@example.com")
+        self.assertEqual(rd.attributes[0].name, "xmlns")
+        self.assertEqual(len(rd.links), 2)
+
+        link = rd.links[0]
+        self.assertEqual(link.rel, "lrdd")
+        self.assertEqual(link.template, "http://example.com/lrdd?uri={uri}")
+        self.assertEqual(link.titles[0].value, "LRDD")
+        self.assertEqual(link.titles[0].lang, "en")
+        self.assertEqual(link.properties[0].value, "value")
+
+        link = rd.links[1]
+        self.assertEqual(link.href, "http://example.com/bob")
+        self.assertEqual(len(link.titles), 0)
+
+    def teststr(self):
+        self.assertDocument(xrd.loads(self.doc))
+
+    def testbytes(self):
+        self.assertDocument(xrd.loads(self.doc.encode('utf-8')))
+
+    def testfile(self):
+        self.assertDocument(xrd.loads(io.BytesIO(self.doc.encode('utf-8'))))
+
+    def testchunked(self):
+        fp = io.BytesIO(self.doc.encode('utf-8'))
+        chunk_size = xrd.CHUNK_SIZE
+        xrd.CHUNK_SIZE = 16
+        try:
+            self.assertDocument(xrd.loads(fp))
+        finally:
+            xrd.CHUNK_SIZE = chunk_size
+
+
 class TestJRDSerialization(unittest.TestCase):
 
     def setUp(self):
@@ -249,6 +847,131 @@ class TestJRDSerialization(unittest.TestCase):
         self.assertEqual(link['template'], "http://google.com/{uri}")
 
 
+class TestStreamingSerialization(unittest.TestCase):
+
+    def setUp(self):
+        self.rd = RD(subject='acct:bob@example.com')
+        self.rd.aliases.append('http://example.com/bob')
+        self.rd.properties.append(('mimetype', 'text/plain'))
+        for i in range(3):
+            self.rd.links.append(Link(rel='r%d' % i, href='http://example.com/%d' % i))
+
+    def testjrdchunks(self):
+        parts = list(jrd.iterdumps(self.rd, backend='json'))
+        self.assertEqual(len(parts), 5)
+        self.assertEqual(''.join(parts), jrd.dumps(self.rd, backend='json'))
+        for backend in jrd.BACKENDS:
+            content = b''.join(jrd.iterdumps(self.rd, backend=backend, encoding='utf-8'))
+            self.assertEqual(json.loads(content.decode('utf-8')), json.loads(jrd.dumps(self.rd)))
+
+    def testjrdnolinks(self):
+        rd = RD(subject='acct:bob@example.com')
+        self.assertEqual(''.join(jrd.iterdumps(rd)), jrd.dumps(rd))
+        rd.links.append(Link(rel='author'))
+        self.assertEqual(json.loads(''.join(jrd.iterdumps(rd))), json.loads(jrd.dumps(rd)))
+
+    def testxrdchunks(self):
+        self.assertEqual(''.join(xrd.iterdumps(self.rd)), xrd.tostring(self.rd))
+        content = b''.join(xrd.iterdumps(self.rd, encoding='utf-8'))
+        self.assertEqual(content, xrd.tostring(self.rd, encoding='utf-8'))
+
+    def testutf16(self):
+        # a single byte order mark, and chunks that decode as one document
+        self.rd.links[0].titles.append(('caf\u00e9', 'fr'))
+        content = b''.join(jrd.iterdumps(self.rd, backend='json', encoding='utf-16'))
+        self.assertEqual(content.count(codecs.BOM_UTF16), 1)
+        self.assertEqual(json.loads(content.decode('utf-16')), json.loads(jrd.dumps(self.rd)))
+        content = b''.join(xrd.iterdumps(self.rd, encoding='utf-16'))
+        self.assertEqual(content, xrd.tostring(self.rd, encoding='utf-16'))
+
+    def testdump(self):
+        fp = io.StringIO()
+        jrd.dump(self.rd, fp)
+        self.assertEqual(json.loads(fp.getvalue()), json.loads(jrd.dumps(self.rd)))
+        fp = io.BytesIO()
+        rd.dump(self.rd, fp, 'application/xrd+xml', encoding='utf-8')
+        self.assertEqual(fp.getvalue(), xrd.tostring(self.rd, encoding='utf-8'))
+        self.assertRaises(ValueError, rd.iterdumps, self.rd, 'text/plain')
+
+    def testdumputf16(self):
+        fp = io.BytesIO()
+        xrd.dump(self.rd, fp, encoding='utf-16')
+        self.assertEqual(fp.getvalue(), xrd.tostring(self.rd, encoding='utf-16'))
+        fp = io.BytesIO()
+        xrd.dump_xrds([self.rd, self.rd], fp, encoding='utf-16')
+        self.assertEqual(fp.getvalue().count(codecs.BOM_UTF16), 1)
+        self.assertEqual(len(list(xrd.iterloads(fp.getvalue()))), 2)
+
+
+class TestJSONBackends(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.join(PWD, 'examples', 'jrd-rfc6415-A.json')
+        with open(path) as infile:
+            self.data = infile.read()
+        self.rd = jrd.loads(self.data, backend='json')
+
+    def testbackends(self):
+        expected = json.loads(jrd.dumps(self.rd, backend='json'))
+        for name in jrd.BACKENDS:
+            rd = jrd.loads(self.data, backend=name)
+            self.assertEqual(rd.subject, self.rd.subject)
+            self.assertEqual(json.loads(jrd.dumps(rd, backend=name)), expected)
+
+    def testdefaultoutput(self):
+        self.assertEqual(jrd.dumps(self.rd, backend='json'), json.dumps(json.loads(jrd.dumps(self.rd))))
+
+    def testbytes(self):
+        for name in jrd.BACKENDS:
+            content = jrd.dumps(self.rd, backend=name, encoding='utf-8')
+            self.assertTrue(isinstance(content, bytes))
+            self.assertEqual(json.loads(content.decode('utf-8'))['subject'], self.rd.subject)
+            self.assertEqual(jrd.loads(content, backend=name).subject, self.rd.subject)
+
+    def testsetbackend(self):
+        default = jrd.get_backend()
+        try:
+            jrd.set_backend('json')
+            self.assertEqual(jrd.get_backend().name, 'json')
+        finally:
+            jrd.set_backend(default)
+        self.assertTrue(jrd.get_backend() is default)
+        self.assertRaises(ValueError, jrd.set_backend, 'nope')
+
+    def testdefault(self):
+        # the fastest installed backend is picked
+        self.assertEqual(jrd.get_backend().name,
+                         [n for n in jrd.PREFERRED_BACKENDS if n in jrd.BACKENDS][0])
+
+    def testfallback(self):
+        # what a faster backend rejects is decoded with the standard library
+        def loads(content):
+            raise ValueError('rejected')
+        jrd.register_backend(jrd.Backend('picky', loads, json.dumps))
+        try:
+            self.assertEqual(jrd.loads(jrd.dumps(self.rd), backend='picky').subject, self.rd.subject)
+            self.assertRaises(ValueError, jrd.loads, '{not json', backend='picky')
+        finally:
+            del jrd.BACKENDS['picky']
+
+    def testutf16(self):
+        content = jrd.dumps(self.rd, encoding='utf-16')
+        for name in jrd.BACKENDS:
+            self.assertEqual(jrd.loads(content, backend=name).subject, self.rd.subject)
+
+    def testregister(self):
+        calls = []
+        def dumps(obj):
+            calls.append(obj)
+            return json.dumps(obj)
+        jrd.register_backend(jrd.Backend('recording', json.loads, dumps))
+        try:
+            jrd.dumps(self.rd, backend='recording')
+            self.assertEqual(calls[0]['subject'], self.rd.subject)
+        finally:
+            del jrd.BACKENDS['recording']
+
+
 class TestXRDSerialization(unittest.TestCase):
 
     def setUp(self):
@@ -264,19 +987,554 @@ class TestXRDSerialization(unittest.TestCase):
     def testproperty(self):
         prop = self.doc.getElementsByTagName('Property')[0]
         self.assertEqual(prop.getAttribute('type'), 'mimetype')
-        self.assertEqual(xrd._get_text(prop), 'text/plain')
+        self.assertEqual(prop.firstChild.nodeValue, 'text/plain')
 
     def testnilproperty(self):
         prop = self.doc.getElementsByTagName('Property')[1]
         self.assertEqual(prop.getAttribute('type'), 'none')
         self.assertEqual(prop.getAttribute('xsi:nil'), 'true')
-        self.assertTrue(xrd._get_text(prop) is None)
+        self.assertFalse(prop.hasChildNodes())
 
     def testlink(self):
         link = self.doc.getElementsByTagName('Link')[0]
         self.assertEqual(link.getAttribute('template'), "http://google.com/{uri}")
 
 
+class TestXRDTextSerialization(unittest.TestCase):
+
+    def setUp(self):
+        self.rd = RD('9876', subject='acct:bob@example.com')
+        self.rd.properties.append(('mimetype', 'text/plain'))
+        self.rd.properties.append('none')
+        link = Link(rel='author', href='http://example.com/?a=1&b=2')
+        link.titles.append(('Bob <the author>', 'en'))
+        link.titles.append('Bob')
+        self.rd.links.append(link)
+        self.rd.links.append(Link(template="http://google.com/{uri}"))
+
+    def testmatchesdom(self):
+        self.assertEqual(xrd.tostring(self.rd), xrd.dumps(self.rd).toxml())
+        self.assertEqual(self.rd.to_xml(dom=False), xrd.dumps(self.rd).toxml())
+
+    def testbytes(self):
+        content = xrd.tostring(self.rd, encoding='utf-8')
+        self.assertTrue(content.startswith(b'<?xml version="1.0" encoding="utf-8"?>'))
+        self.assertEqual(content, xrd.dumps(self.rd).toxml('utf-8'))
+
+    def testdump(self):
+        fp = io.StringIO()
+        xrd.dump(self.rd, fp)
+        self.assertEqual(fp.getvalue(), xrd.tostring(self.rd))
+
+    def testescaping(self):
+        content = xrd.tostring(self.rd)
+        self.assertTrue('href="http://example.com/?a=1&amp;b=2"' in content)
+        self.assertTrue('<Title xml:lang="en">Bob &lt;the author&gt;</Title>' in content)
+        self.assertTrue('<Title>Bob</Title>' in content)
+        self.assertTrue('<Property type="none" xsi:nil="true"/>' in content)
+
+    def testroundtrip(self):
+        rd = xrd.loads(xrd.tostring(self.rd))
+        self.assertEqual(rd.subject, 'acct:bob@example.com')
+        self.assertEqual(rd.links[0].titles[0].value, 'Bob <the author>')
+        self.assertEqual(rd.links[0].href, 'http://example.com/?a=1&b=2')
+
+    def testhreftemplate(self):
+        self.rd.links.append(Link(href='http://example.com/', template='http://example.com/{uri}'))
+        self.assertRaises(ValueError, xrd.tostring, self.rd)
+
+
+class TestXRDS(unittest.TestCase):
+
+    def setUp(self):
+        self.rds = []
+        for i in range(3):
+            rd = RD(subject='acct:user%d@example.com' % i)
+            rd.links.append(Link(rel='profile', href='http://example.com/%d' % i))
+            self.rds.append(rd)
+
+    def testroundtrip(self):
+        content = ''.join(xrd.iterdumps_xrds(iter(self.rds)))
+        self.assertTrue(content.startswith('<?xml version="1.0" ?><XRDS xmlns="xri://$xrds">'))
+        self.assertTrue('<XRD xmlns="%s">' % xrd.XRD_NAMESPACE in content)
+        rds = list(xrd.iterloads(content))
+        self.assertEqual([rd.subject for rd in rds], [rd.subject for rd in self.rds])
+        self.assertEqual(rds[2].links[0].href, 'http://example.com/2')
+
+    def testprefixed(self):
+        content = ('<xrds:XRDS xmlns:xrds="xri://$xrds">'
+                   '<XRD xmlns="%s" xml:id="a"><Subject>acct:a@example.com</Subject>'
+                   '<Link rel="profile"><Title xml:lang="en">A</Title></Link></XRD>'
+                   '<xrd:XRD xmlns:xrd="%s"><xrd:Subject>acct:b@example.com</xrd:Subject></xrd:XRD>'
+                   '</xrds:XRDS>') % (xrd.XRD_NAMESPACE, xrd.XRD_NAMESPACE)
+        rds = list(xrd.iterloads(content))
+        self.assertEqual([rd.subject for rd in rds], ['acct:a@example.com', 'acct:b@example.com'])
+        self.assertEqual(rds[0].xml_id, 'a')
+        self.assertEqual(rds[0].links[0].titles[0].lang, 'en')
+
+    def testdump(self):
+        fp = io.BytesIO()
+        xrd.dump_xrds(self.rds, fp, encoding='utf-8')
+        fp.seek(0)
+        self.assertEqual(len(list(xrd.iterloads(fp))), 3)
+
+    def testsinglexrd(self):
+        rds = list(xrd.iterloads(xrd.tostring(self.rds[0])))
+        self.assertEqual(len(rds), 1)
+        self.assertEqual(rds[0].subject, 'acct:user0@example.com')
+
+    def teststreaming(self):
+        rds = (RD(subject='acct:user%d@example.com' % i) for i in range(5000))
+        fp = io.BytesIO(b''.join(xrd.iterdumps_xrds(rds, encoding='utf-8')))
+        first = next(xrd.iterloads(fp))
+        self.assertEqual(first.subject, 'acct:user0@example.com')
+        self.assertTrue(fp.tell() < len(fp.getvalue()))
+
+
+class TestContentSniffing(unittest.TestCase):
+
+    jrd_doc = '{"subject": "acct:bob@example.com"}'
+    xrd_doc = ('<?xml version="1.0" encoding="UTF-8"?>'
+               '<XRD xmlns="http://docs.oasis-open.org/ns/xri/xrd-1.0">'
+               '<Subject>acct:bob@example.com</Subject></XRD>')
+
+    def testsniff(self):
+        self.assertEqual(rd.sniff(self.jrd_doc), rd.JRD)
+        self.assertEqual(rd.sniff('\n\t ' + self.xrd_doc), rd.XRD)
+        self.assertEqual(rd.sniff(b'\xef\xbb\xbf  {}'), rd.JRD)
+        self.assertEqual(rd.sniff('\ufeff<XRD/>'.encode('utf-16')), rd.XRD)
+        self.assertIsNone(rd.sniff(b'  '))
+        self.assertIsNone(rd.sniff('[]'))
+
+    def testmissingheader(self):
+        self.assertEqual(rd.loads(self.jrd_doc).subject, 'acct:bob@example.com')
+        self.assertEqual(rd.loads(self.xrd_doc.encode('utf-8')).subject, 'acct:bob@example.com')
+
+    def testwrongheader(self):
+        self.assertEqual(rd.loads(self.jrd_doc, 'application/xrd+xml').subject, 'acct:bob@example.com')
+        self.assertEqual(rd.loads(self.xrd_doc, 'text/json').subject, 'acct:bob@example.com')
+        self.assertEqual(rd.loads(self.xrd_doc, 'application/xml').subject, 'acct:bob@example.com')
+
+    def testbom(self):
+        self.assertEqual(rd.loads(codecs.BOM_UTF8 + self.jrd_doc.encode('utf-8')).subject, 'acct:bob@example.com')
+        self.assertEqual(rd.loads('\ufeff' + self.jrd_doc).subject, 'acct:bob@example.com')
+        self.assertEqual(rd.loads(codecs.BOM_UTF8 + self.xrd_doc.encode('utf-8')).subject, 'acct:bob@example.com')
+
+    def testcontentformat(self):
+        self.assertEqual(rd.content_format('Application/JRD+JSON; charset=utf-8'), rd.JRD)
+        self.assertEqual(rd.content_format('application/xml'), rd.XRD)
+        self.assertIsNone(rd.content_format('text/plain'))
+        self.assertIsNone(rd.content_format(None))
+
+    def testunknown(self):
+        self.assertIsNone(rd.loads('hello', 'text/plain'))
+
+
+class TestLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.jrd_path = os.path.join(PWD, 'examples', 'jrd-rfc6415-A.json')
+        self.xrd_path = os.path.join(PWD, 'examples', 'xrd-rfc6415-A.xml')
+        self.subject = 'http://blog.example.com/article/id/314'
+        self.threshold = rd.core.MMAP_THRESHOLD
+
+    def tearDown(self):
+        rd.core.MMAP_THRESHOLD = self.threshold
+
+    def testpath(self):
+        self.assertEqual(rd.load(self.jrd_path).subject, self.subject)
+        self.assertEqual(rd.load(self.xrd_path).subject, self.subject)
+
+    def testfile(self):
+        with open(self.xrd_path, 'rb') as infile:
+            self.assertEqual(len(rd.load(infile).links), 3)
+        with open(self.jrd_path, 'rb') as infile:
+            data = infile.read()
+        self.assertEqual(rd.load(io.BytesIO(data)).subject, self.subject)
+
+    def testbuffers(self):
+        with open(self.jrd_path, 'rb') as infile:
+            data = infile.read()
+        self.assertEqual(rd.load(memoryview(data)).subject, self.subject)
+        self.assertEqual(rd.load(bytearray(data)).subject, self.subject)
+        self.assertEqual(jrd.loads(memoryview(data), backend='json').subject, self.subject)
+
+    def testmmap(self):
+        rd.core.MMAP_THRESHOLD = 1
+        for path in (self.jrd_path, self.xrd_path):
+            self.assertEqual(rd.load(path).subject, self.subject)
+
+    def testmmapcopies(self):
+        # JRD is only mapped for a backend that reads buffers
+        rd.core.MMAP_THRESHOLD = 1
+        mapped = []
+        real = rd.core.mmap
+        class Recorder(object):
+            ACCESS_READ = real.ACCESS_READ
+            def mmap(self, *args, **kwargs):
+                mapped.append(args)
+                return real.mmap(*args, **kwargs)
+        default = jrd.get_backend()
+        rd.core.mmap = Recorder()
+        try:
+            jrd.set_backend('json')
+            self.assertEqual(rd.load(self.jrd_path).subject, self.subject)
+            self.assertEqual(len(mapped), 0)
+            self.assertEqual(rd.load(self.xrd_path).subject, self.subject)
+            self.assertEqual(len(mapped), 1)
+        finally:
+            rd.core.mmap = real
+            jrd.set_backend(default)
+
+    def testmmaperror(self):
+        rd.core.MMAP_THRESHOLD = 1
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'broken.json')
+            with open(path, 'w') as outfile:
+                outfile.write('{"subject": ')
+            self.assertRaises(ValueError, rd.load, path)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestRDCollection(unittest.TestCase):
+
+    def setUp(self):
+        self.bob = RD(subject='acct:bob@example.com')
+        self.bob.aliases.append('http://example.com/bob')
+        self.bob.links.append(Link(rel='avatar', type='image/png', href='http://example.com/bob.png'))
+        self.bob.links.append(Link(rel='blog', type='text/html', href='http://example.com/bob/blog'))
+        self.bob.properties.append(('http://example.com/ns/role', 'admin'))
+        self.alice = RD(subject='acct:alice@example.com')
+        self.alice.links.append(Link(rel='avatar', type='image/jpeg', href='http://example.com/alice.jpg'))
+        self.carol = RD(subject='acct:carol@example.com').freeze()
+        self.collection = RDCollection([self.bob, self.alice, self.carol])
+
+    def testlookups(self):
+        self.assertEqual(len(self.collection), 3)
+        self.assertTrue(self.collection.get('http://example.com/bob') is self.bob)
+        self.assertTrue(self.collection.get('acct:carol@example.com') is self.carol)
+        self.assertIsNone(self.collection.get('acct:dave@example.com'))
+        self.assertEqual(self.collection.find(rel='avatar'), [self.bob, self.alice])
+        self.assertEqual(self.collection.find(href='http://example.com/alice.jpg'), [self.alice])
+        self.assertEqual(self.collection.find(property='http://example.com/ns/role'), [self.bob])
+        self.assertEqual(self.collection.find(), [self.bob, self.alice, self.carol])
+
+    def testcompound(self):
+        self.assertEqual(self.collection.find(rel='avatar', type='image/jpeg'), [self.alice])
+        self.assertEqual(self.collection.find(rel='avatar', type='text/html'), [])
+        self.assertEqual(self.collection.find(rel='avatar', type='text/plain'), [])
+        self.assertEqual(self.collection.find(rel='blog', href='http://example.com/bob/blog'), [self.bob])
+        self.assertEqual(self.collection.find(rel='avatar', type='image/png',
+                                              href='http://example.com/bob.png'), [self.bob])
+        self.assertEqual(self.collection.count(rel='avatar', href='http://example.com/bob/blog'), 0)
+        self.assertEqual(self.collection.count(rel='avatar', alias='http://example.com/bob'), 1)
+
+    def testupdates(self):
+        self.collection.remove(self.alice)
+        self.assertEqual(self.collection.find(rel='avatar'), [self.bob])
+        self.assertRaises(ValueError, self.collection.remove, self.alice)
+        self.assertRaises(ValueError, self.collection.add, self.bob)
+        self.bob.links.pop(0)
+        self.assertEqual(self.collection.find(rel='avatar'), [self.bob])
+        self.collection.replace(self.bob, self.bob)
+        self.assertEqual(self.collection.find(rel='avatar'), [])
+        self.assertRaises(AttributeError, self.collection.replace, self.bob, object())
+        self.assertTrue(self.bob in self.collection)
+        dave = RD(subject='acct:dave@example.com')
+        self.collection.replace(self.carol, dave)
+        self.assertEqual(list(self.collection), [self.bob, dave])
+        self.assertIsNone(self.collection.get('acct:carol@example.com'))
+        self.assertEqual(self.collection._index['rel'], {'blog': set([0])})
+
+
+@unittest.skipIf(RDStore is None, 'requires python 3')
+class TestRDStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'descriptors.db')
+        self.store = RDStore(self.path)
+        self.rd = RD(xml_id='bob', subject='acct:bob@example.com')
+        self.rd.expires = datetime.datetime(2012, 10, 11, tzinfo=pytz.utc)
+        self.rd.aliases.append('http://example.com/bob')
+        self.rd.properties.append(('http://example.com/ns/role', 'admin'))
+        self.rd.properties.append(('http://example.com/ns/role', 'editor'))
+        link = Link(rel='author', href='http://example.com/bob')
+        link.titles.append(('Bob', 'en'))
+        link.titles.append(('Roberto', 'es'))
+        self.rd.links.append(link)
+        self.rd.elements.append(Element('Custom', 'value', {'kind': 'x'}))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def testroundtrip(self):
+        self.rd.elements.append(Element('ext', {'k': ['v', {'n': 1}]}))
+        self.store.put(self.rd)
+        self.assertEqual(self.store.get('acct:bob@example.com'), self.rd.freeze())
+        other = RDStore(self.path)
+        try:
+            self.assertEqual(other.get('http://example.com/bob'), self.rd.freeze())
+        finally:
+            other.close()
+        self.assertIsNone(self.store.get('acct:alice@example.com'))
+        self.assertIn('http://example.com/bob', self.store)
+
+    def testreplace(self):
+        self.store.put(self.rd)
+        bob = self.store.get('acct:bob@example.com')
+        self.assertTrue(self.store.get('http://example.com/bob') is bob)
+        edited = bob.thaw()
+        edited.aliases[:] = ['http://example.com/robert']
+        self.store.put(edited)
+        self.assertEqual(len(self.store), 1)
+        self.assertIsNone(self.store.get('http://example.com/bob'))
+        self.assertEqual(self.store.get('http://example.com/robert').aliases, ('http://example.com/robert',))
+        self.assertTrue(self.store.delete('acct:bob@example.com'))
+        self.assertFalse(self.store.delete('acct:bob@example.com'))
+        self.assertEqual(len(self.store), 0)
+
+    def testsharedkeys(self):
+        self.store.put(self.rd)
+        robert = RD(subject='acct:robert@example.com')
+        robert.aliases.append('http://example.com/bob')
+        self.store.put(robert)
+        self.assertEqual(len(self.store), 1)
+        self.assertIsNone(self.store.get('acct:bob@example.com'))
+        self.assertEqual(self.store.find('author'), [])
+        host_meta = RD()
+        host_meta.links.append(Link(rel='lrdd', template='http://example.com/lrdd?uri={uri}'))
+        self.assertRaises(ValueError, self.store.put, host_meta)
+        self.store.put(host_meta, keys=['example.com'])
+        self.store.put(host_meta, keys=['example.com'])
+        self.assertEqual(len(self.store.find('lrdd')), 1)
+        self.assertEqual(self.store.get('example.com'), host_meta.freeze())
+
+    def testfind(self):
+        alice = RD(subject='acct:alice@example.com')
+        alice.links.append(Link(rel='avatar', href='http://example.com/alice.png'))
+        self.assertEqual(self.store.put_many([self.rd, alice]), 2)
+        self.assertEqual([r.subject for r in self.store.find('author')], ['acct:bob@example.com'])
+        self.assertEqual([r.subject for r in self.store.find('avatar')], ['acct:alice@example.com'])
+        self.assertEqual(self.store.find('missing'), [])
+
+    def testimport(self):
+        examples = os.path.join(PWD, 'examples')
+        self.assertEqual(self.store.import_paths([examples]), 6)
+        self.assertEqual(self.store.import_paths([examples]), 6)
+        self.assertEqual(len(self.store), 4)
+        self.assertEqual(len(self.store.find('author')), 1)
+        self.assertEqual(self.store.get('acct:carol@example.com').subject, 'acct:carol@example.com')
+        with open(os.path.join(self.tmpdir, 'broken.json'), 'w') as outfile:
+            outfile.write('{"subject": ')
+        paths = [os.path.join(self.tmpdir, 'broken.json'), os.path.join(PWD, 'examples')]
+        self.assertRaises(ValueError, self.store.import_paths, paths)
+        self.assertEqual(self.store.import_paths(paths, skip_errors=True), 6)
+
+    def testreadonly(self):
+        self.store.put(self.rd)
+        with RDStore(self.path, readonly=True) as reader:
+            self.assertEqual(reader.get('acct:bob@example.com').xml_id, 'bob')
+            self.assertRaises(ValueError, reader.put, self.rd)
+
+    def testconcurrency(self):
+        self.store.put(self.rd)
+        errors = []
+        def read():
+            try:
+                for i in range(200):
+                    self.assertEqual(self.store.get('http://example.com/bob').subject,
+                                     'acct:bob@example.com')
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=read) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(50):
+            self.store.put(self.rd)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.store), 1)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.join(PWD, 'examples', 'jrd-rfc6415-A.json')
+        with open(path) as infile:
+            self.data = infile.read()
+        self.probes = []
+
+    def testdisabled(self):
+        self.assertIsNone(instrument.probe('loads', 'jrd'))
+
+    def testjrd(self):
+        with instrument.listening(self.probes.append):
+            rd = jrd.loads(self.data)
+            content = jrd.dumps(rd)
+        (loads, dumps) = self.probes
+
+        self.assertEqual((loads.operation, loads.format), ('loads', 'jrd'))
+        self.assertEqual(sorted(loads.timings), ['build', 'decode'])
+        self.assertEqual(loads.counts, {'links': 3, 'properties': 3, 'titles': 4, 'unknown': 0})
+        self.assertEqual(loads.input_size, len(self.data))
+
+        self.assertEqual(sorted(dumps.timings), ['build', 'encode'])
+        self.assertEqual(dumps.counts['links'], 3)
+        self.assertEqual(dumps.output_size, len(content))
+
+    def testbytesizes(self):
+        # text is measured in UTF-8 bytes, not characters
+        rd = RD(subject='acct:caf\u00e9@example.com')
+        with instrument.listening(self.probes.append):
+            content = xrd.tostring(rd)
+            xrd.loads(content)
+            xrd.dump(rd, io.StringIO())
+        (dumps, loads, dump) = self.probes
+        self.assertEqual(dumps.output_size, len(content) + 1)
+        self.assertEqual(loads.input_size, len(content) + 1)
+        self.assertEqual(dump.output_size, len(content) + 1)
+        self.assertEqual(instrument.size_of(memoryview(b'ab')), 2)
+
+    def testlazy(self):
+        with instrument.listening(self.probes.append):
+            rd = jrd.loads(self.data, lazy=True)
+        self.assertEqual(self.probes[0].counts['links'], 3)
+        self.assertIsNone(rd._links)
+
+    def testxrd(self):
+        rd = jrd.loads(self.data)
+        with instrument.listening(self.probes.append):
+            content = xrd.tostring(rd, encoding='utf-8')
+            xrd.loads(content)
+        (dumps, loads) = self.probes
+        self.assertEqual(dumps.output_size, len(content))
+        self.assertEqual(list(loads.timings), ['parse'])
+        self.assertEqual(loads.counts['properties'], 3)
+        self.assertTrue(loads.total >= 0)
+
+    def testfailinglistener(self):
+        def fail(probe):
+            raise RuntimeError('broken metrics')
+        with instrument.listening(fail):
+            with instrument.listening(self.probes.append):
+                rd = jrd.loads(self.data)
+        self.assertEqual(rd.subject, 'http://blog.example.com/article/id/314')
+        self.assertEqual(len(self.probes), 1)
+        self.assertEqual(instrument.listeners, [])
+
+
+class TestBatch(unittest.TestCase):
+
+    jrd_doc = '{"subject": "acct:bob@example.com"}'
+    xrd_doc = ('<XRD xmlns="http://docs.oasis-open.org/ns/xri/xrd-1.0">'
+               '<Subject>acct:alice@example.com</Subject></XRD>')
+
+    def testlazyimport(self):
+        code = "import sys, rd; sys.exit('concurrent.futures' in sys.modules)"
+        self.assertEqual(subprocess.call([sys.executable, '-c', code], cwd=PWD), 0)
+        from rd.batch import Result
+        self.assertTrue(rd.Result is Result)
+
+    def testloadsmany(self):
+        docs = [
+            (self.jrd_doc, 'application/json'),
+            (self.xrd_doc, 'application/xrd+xml; charset=utf-8'),
+            ('{not json', 'application/json'),
+        ]
+        results = list(rd.loads_many(docs, max_workers=2))
+        self.assertEqual([r.index for r in results], [0, 1, 2])
+        self.assertEqual(results[0].value.subject, 'acct:bob@example.com')
+        self.assertEqual(results[1].value.subject, 'acct:alice@example.com')
+        self.assertIsNone(results[2].value)
+        self.assertTrue(isinstance(results[2].error, ValueError))
+        (result,) = rd.loads_many(['garbage'])
+        self.assertIsNone(result.value)
+        self.assertEqual(str(result.error), 'unrecognized document')
+
+    def testunordered(self):
+        docs = [self.jrd_doc] * 20
+        results = list(rd.loads_many(docs, 'application/json', ordered=False, chunksize=3))
+        self.assertEqual(sorted(r.index for r in results), list(range(20)))
+        self.assertTrue(all(r.error is None for r in results))
+
+    def testprocesspool(self):
+        docs = [self.xrd_doc] * 4
+        results = list(rd.loads_many(docs, 'text/xml', executor='process', max_workers=2, chunksize=2))
+        self.assertEqual([r.value.subject for r in results], ['acct:alice@example.com'] * 4)
+
+    def testdumpsmany(self):
+        descriptor = RD(subject='acct:bob@example.com')
+        items = [descriptor, (descriptor, 'application/xrd+xml'), (descriptor, 'text/plain')]
+        results = list(rd.dumps_many(items))
+        self.assertEqual(json.loads(results[0].value)['subject'], 'acct:bob@example.com')
+        self.assertTrue('<Subject>acct:bob@example.com</Subject>' in results[1].value)
+        self.assertTrue(isinstance(results[2].error, ValueError))
+
+
+class TestDescriptorCache(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000000000.0
+        self.cache = DescriptorCache(maxsize=3, default_ttl=60, clock=lambda: self.now)
+
+    def testdefaultttl(self):
+        rd = RD(subject='acct:bob@example.com')
+        self.cache.set(rd.subject, rd)
+        self.assertTrue(self.cache.get(rd.subject) is rd)
+        self.now += 61
+        self.assertIsNone(self.cache.get(rd.subject))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def testexpires(self):
+        rd = RD(subject='acct:bob@example.com')
+        rd.expires = datetime.datetime.fromtimestamp(self.now + 3600, pytz.utc)
+        self.cache.set(rd.subject, rd)
+        self.now += 600
+        self.assertTrue(self.cache.get(rd.subject) is rd)
+        self.now += 3000
+        self.assertIsNone(self.cache.get(rd.subject))
+
+    def testexpired(self):
+        rd = RD(subject='acct:bob@example.com')
+        rd.expires = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+        self.cache.set(rd.subject, rd)
+        self.assertEqual(len(self.cache), 0)
+
+    def testlru(self):
+        for i in range(3):
+            self.cache.set(i, RD(subject=str(i)))
+        self.cache.get(0)
+        self.cache.set(3, RD(subject='3'))
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(self.cache.get(0).subject, '0')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (2, 1, 1))
+
+    def testgetsizeof(self):
+        cache = DescriptorCache(maxsize=4, getsizeof=lambda rd: len(rd.links) + 1)
+        big = RD()
+        big.links.extend([Link(rel='a'), Link(rel='b')])
+        cache.set('big', big)
+        cache.set('small', RD())
+        cache.set('other', RD())
+        self.assertIsNone(cache.get('big'))
+        self.assertEqual(cache.stats()['size'], 2)
+
+    def testgetorload(self):
+        loaded = []
+        def loader(key):
+            loaded.append(key)
+            return RD(subject=key)
+        self.cache.get_or_load('acct:bob@example.com', loader)
+        self.cache.get_or_load('acct:bob@example.com', loader)
+        self.assertEqual(loaded, ['acct:bob@example.com'])
+
+
 class ExamplesTestCase(unittest.TestCase):
 
     def load_example(self, filename):
@@ -370,10 +1628,16 @@ class TestXRDExamples(ExamplesTestCase):
         self.assertEqual(prop.type, "http://spec.example.net/created/1.0")
         self.assertEqual(prop.value, "1970-01-01")
 
-    # signature stuff is not yet supported
-    # def test10b2(self):
-    #     data = self.load_example("xrd-1.0-b2.xml")
-    #     xrd.loads(data)
+    def test10b2(self):
+
+        data = self.load_example("xrd-1.0-b2.xml")
+        rd = xrd.loads(data)
+
+        # signature stuff is not yet supported, but it must not break parsing
+        self.assertEqual(rd.xml_id, "foo")
+        self.assertEqual(rd.aliases[1], "acct:gpburdell@example.com")
+        self.assertEqual(rd.elements[0].name, "ds:Signature")
+        self.assertEqual(rd.links[0].href, "http://services.example.com/auth")
 
 
 class TestJRDExamples(ExamplesTestCase):
@@ -424,5 +1688,53 @@ class TestJRDExamples(ExamplesTestCase):
             self.assertEqual(link.href, href)
 
 
+class TestTranscode(ExamplesTestCase):
+
+    def testxrdtojrd(self):
+        for filename in ("xrd-1.0-b1.xml", "xrd-rfc6415-A.xml"):
+            data = self.load_example(filename)
+            self.assertEqual(json.loads(transcode.xrd_to_jrd(data)),
+                             json.loads(jrd.dumps(xrd.loads(data))))
+
+    def testjrdtoxrd(self):
+        for filename in ("jrd-rfc6415-A.json", "jrd-wf02-4.1-lrdd.json"):
+            data = self.load_example(filename)
+            self.assertEqual(transcode.jrd_to_xrd(data), xrd.tostring(jrd.loads(data)))
+        content = transcode.jrd_to_xrd(data, encoding='utf-8')
+        self.assertEqual(content, xrd.tostring(jrd.loads(data), encoding='utf-8'))
+
+    def teststreaming(self):
+        rd = RD(subject='acct:bob@example.com')
+        for i in range(100):
+            rd.links.append(Link(rel='r%d' % i, href='http://example.com/%d' % i))
+        fp = io.BytesIO(xrd.tostring(rd, encoding='utf-8'))
+        parts = list(transcode.iter_xrd_to_jrd(fp))
+        self.assertEqual(json.loads(''.join(parts)), json.loads(jrd.dumps(rd)))
+
+    def testempty(self):
+        self.assertEqual(json.loads(transcode.xrd_to_jrd(xrd.tostring(RD()))), {})
+        rd = RD()
+        rd.links.append(Link(rel='author'))
+        self.assertEqual(json.loads(transcode.xrd_to_jrd(xrd.tostring(rd))),
+                         {'links': [{'rel': 'author'}]})
+
+    def testunrepresentable(self):
+        self.assertRaises(transcode.TranscodeError, transcode.xrd_to_jrd,
+                          self.load_example("xrd-1.0-b2.xml"))
+        self.assertRaises(transcode.TranscodeError, transcode.xrd_to_jrd,
+                          '<XRD><Link rel="a"><Title>x</Title><Title>y</Title></Link></XRD>')
+        self.assertRaises(transcode.TranscodeError, transcode.xrd_to_jrd,
+                          '<XRD><Property type="a"/><Property type="a"/></XRD>')
+        self.assertRaises(transcode.TranscodeError, transcode.xrd_to_jrd,
+                          '<XRD><Link rel="a"><Foo>x</Foo></Link></XRD>')
+        self.assertRaises(transcode.TranscodeError, transcode.jrd_to_xrd,
+                          '{"titles": {"default": "x"}}')
+        self.assertRaises(transcode.TranscodeError, transcode.jrd_to_xrd,
+                          '{"links": [{"rel": "a", "foo": "b"}]}')
+        self.assertRaises(transcode.TranscodeError, transcode.jrd_to_xrd,
+                          '{"links": [{"href": "a", "template": "b"}]}')
+        self.assertRaises(ValueError, transcode.jrd_to_xrd, '{"foo": 1}')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,127 @@
+from __future__ import unicode_literals
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from rd.cache import DescriptorCache
+from rd.discovery import DiscoveryClient, DiscoveryError, resource_host
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    host_meta = ('<XRD xmlns="http://docs.oasis-open.org/ns/xri/xrd-1.0">'
+                 '<Link rel="lrdd" type="application/xrd+xml" template="/xrd?uri={uri}" />'
+                 '<Link rel="lrdd" type="application/json" template="%s/lrdd?uri={uri}" />'
+                 '</XRD>')
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        self.server.accepts.append(self.headers.get('Accept'))
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path == '/.well-known/host-meta':
+            base = 'http://%s:%s' % self.server.server_address
+            self.respond('application/xrd+xml', self.host_meta % base)
+        elif parts.path == '/lrdd':
+            self.respond('application/json; charset=utf-8', json.dumps({'subject': query['uri'][0]}))
+        elif parts.path == '/.well-known/webfinger':
+            doc = {'subject': query['resource'][0], 'links': [{'rel': r} for r in query.get('rel', [])]}
+            self.respond('application/jrd+json', json.dumps(doc))
+        elif parts.path == '/plain':
+            self.respond('text/plain', 'hello')
+        elif parts.path == '/broken.xml':
+            self.respond('application/xrd+xml', '<XRD><Subject>')
+        elif parts.path == '/broken.json':
+            self.respond('application/jrd+json', '{"subject": ')
+        elif parts.path == '/expires.json':
+            self.respond('application/jrd+json', '{"expires": "soon"}')
+        else:
+            self.send_error(404)
+
+    def respond(self, content_type, body):
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestDiscovery(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.connections = set()
+        self.server.accepts = []
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,))
+        self.thread.daemon = True
+        self.thread.start()
+        self.host = '%s:%s' % self.server.server_address
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_client(self, func, **kwargs):
+        async def run():
+            async with DiscoveryClient(scheme='http', timeout=5, **kwargs) as client:
+                return await func(client)
+        return asyncio.run(run())
+
+    def testhostmeta(self):
+        host_meta = self.run_client(lambda c: c.host_meta(self.host))
+        self.assertEqual(len(list(host_meta.links('lrdd'))), 2)
+        self.assertTrue(self.server.accepts[0].startswith('application/json'))
+
+    def testlrdd(self):
+        rd = self.run_client(lambda c: c.lrdd('acct:bob@example.com', host=self.host))
+        self.assertEqual(rd.subject, 'acct:bob@example.com')
+
+    def testwebfinger(self):
+        rd = self.run_client(lambda c: c.webfinger('acct:bob@%s' % self.host, rels=['avatar']))
+        self.assertEqual(rd.subject, 'acct:bob@%s' % self.host)
+        self.assertEqual(rd.links[0].rel, 'avatar')
+
+    def testcache(self):
+        async def lookups(client):
+            for i in range(3):
+                await client.lrdd('acct:user%d@example.com' % i, host=self.host)
+        cache = DescriptorCache()
+        self.run_client(lookups, cache=cache)
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(len(self.server.accepts), 4)
+
+    def testpooling(self):
+        async def lookups(client):
+            resources = ['acct:user%d@example.com' % i for i in range(20)]
+            return await asyncio.gather(*[client.lrdd(r, host=self.host) for r in resources])
+        rds = self.run_client(lookups, max_concurrency=2)
+        self.assertEqual(rds[5].subject, 'acct:user5@example.com')
+        self.assertTrue(len(self.server.connections) <= 2)
+
+    def testerrors(self):
+        self.assertRaises(DiscoveryError, self.run_client,
+                          lambda c: c.fetch('http://%s/missing' % self.host))
+        self.assertRaises(DiscoveryError, self.run_client,
+                          lambda c: c.fetch('http://%s/plain' % self.host))
+        for path in ('/broken.xml', '/broken.json', '/expires.json'):
+            self.assertRaises(DiscoveryError, self.run_client,
+                              lambda c: c.fetch('http://%s%s' % (self.host, path)))
+
+    def testresourcehost(self):
+        self.assertEqual(resource_host('acct:bob@example.com'), 'example.com')
+        self.assertEqual(resource_host('http://bob@example.com:8080/x'), 'example.com:8080')
+        self.assertRaises(DiscoveryError, resource_host, 'bob')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+from __future__ import unicode_literals
+import asyncio
+import datetime
+import json
+import threading
+import unittest
+
+import pytz
+from rd import RD, Link, jrd, xrd
+from rd.discovery import DiscoveryClient
+from rd.server import Server, make_server, negotiate
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1349913600.0
+        self.rd = RD(subject='acct:bob@example.com')
+        self.rd.expires = datetime.datetime(2012, 10, 11, 1, tzinfo=pytz.utc)
+        self.rd.aliases.append('http://example.com/bob')
+        self.rd.links.append(Link(rel='avatar', href='http://example.com/bob.png'))
+        self.rd.links.append(Link(rel='author', href='http://example.com/bob'))
+        self.host_meta = RD()
+        self.host_meta.links.append(Link(rel='lrdd', template='http://example.com/lrdd?uri={uri}'))
+        self.server = Server({'acct:bob@example.com': self.rd}, host_meta=self.host_meta,
+                             clock=lambda: self.now)
+
+    def webfinger(self, query='resource=acct%3Abob%40example.com', **headers):
+        return self.server.respond('GET', '/.well-known/webfinger', query, headers)
+
+    def testnegotiate(self):
+        self.assertEqual(negotiate(None), 'jrd')
+        self.assertEqual(negotiate('application/xrd+xml'), 'xrd')
+        self.assertEqual(negotiate('application/xrd+xml;q=0.5, */*;q=0.9'), 'jrd')
+        self.assertEqual(negotiate('*/*', default='xrd'), 'xrd')
+        self.assertEqual(negotiate('application/xml'), 'xrd')
+        self.assertIsNone(negotiate('text/html'))
+
+    def testwebfinger(self):
+        (status, headers, body) = self.webfinger()
+        headers = dict(headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Content-Type'], 'application/jrd+json')
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(headers['Access-Control-Allow-Origin'], '*')
+        self.assertEqual(json.loads(body.decode('utf-8'))['subject'], 'acct:bob@example.com')
+        (status, headers, body) = self.webfinger(accept='application/xrd+xml')
+        self.assertEqual(xrd.loads(body).subject, 'acct:bob@example.com')
+        (status, headers, body) = self.webfinger('resource=acct%3Abob%40example.com&rel=author')
+        self.assertEqual([link['rel'] for link in json.loads(body.decode('utf-8'))['links']], ['author'])
+
+    def testerrors(self):
+        self.assertEqual(self.webfinger('resource=acct%3Aalice%40example.com')[0], 404)
+        self.assertEqual(self.webfinger('')[0], 400)
+        self.assertEqual(self.webfinger(accept='text/html')[0], 406)
+        self.assertEqual(self.server.respond('POST', '/.well-known/webfinger')[0], 405)
+        self.assertEqual(self.server.respond('GET', '/missing')[0], 404)
+        self.assertEqual(Server({}).respond('GET', '/.well-known/host-meta')[0], 404)
+
+    def testconditional(self):
+        (status, headers, body) = self.webfinger()
+        headers = dict(headers)
+        self.assertEqual(self.webfinger(**{'if-none-match': headers['ETag']})[0], 304)
+        self.assertEqual(self.webfinger(**{'if-none-match': 'W/' + headers['ETag']})[0], 304)
+        self.assertFalse('Last-Modified' in headers)
+        self.assertTrue(self.webfinger()[2] is body)
+        self.rd.links.pop()
+        self.now += 60
+        (status, changed, changed_body) = self.webfinger(**{'if-none-match': headers['ETag']})
+        self.assertEqual(status, 200)
+        self.assertNotEqual(dict(changed)['ETag'], headers['ETag'])
+        self.assertEqual(dict(changed)['Cache-Control'], 'public, max-age=3540')
+        self.assertEqual(len(json.loads(changed_body.decode('utf-8'))['links']), 1)
+
+    def testeviction(self):
+        # the least recently used entry makes way
+        server = Server({'acct:bob@example.com': self.rd}, host_meta=self.host_meta, maxsize=1)
+        server.respond('GET', '/.well-known/webfinger', 'resource=acct%3Abob%40example.com')
+        server.respond('GET', '/.well-known/webfinger', 'resource=acct%3Abob%40example.com')
+        self.assertEqual(server._entries.stats()['hits'], 1)
+        server.respond('GET', '/.well-known/host-meta')
+        self.assertEqual(len(server._entries), 1)
+        self.assertEqual(server._entries.stats()['evictions'], 1)
+
+    def testextensions(self):
+        # the ETag of a descriptor with an extension object can be computed
+        doc = {'subject': 'bob', 'ext': {'k': ['v', {'n': 1}]}}
+        server = Server({'bob': jrd.loads(json.dumps(doc))})
+        for i in range(2):
+            self.assertEqual(server.respond('GET', '/.well-known/webfinger', 'resource=bob')[0], 200)
+
+    def testhostmeta(self):
+        (status, headers, body) = self.server.respond('GET', '/.well-known/host-meta')
+        self.assertEqual(dict(headers)['Content-Type'], 'application/xrd+xml')
+        self.assertEqual(dict(headers)['Cache-Control'], 'no-cache')
+        self.assertEqual(xrd.loads(body).find_link('lrdd', 'template'), 'http://example.com/lrdd?uri={uri}')
+        (status, headers, body) = self.server.respond('HEAD', '/.well-known/host-meta.json', '',
+                                                      {'accept': 'application/xrd+xml'})
+        self.assertEqual(dict(headers)['Content-Type'], 'application/jrd+json')
+        self.assertEqual(body, b'')
+
+    def testwsgi(self):
+        responses = []
+        body = self.server({
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': '/.well-known/webfinger',
+            'QUERY_STRING': 'resource=acct%3Abob%40example.com',
+            'HTTP_ACCEPT': 'application/xrd+xml',
+        }, lambda status, headers: responses.append((status, headers)))
+        self.assertEqual(responses[0][0], '200 OK')
+        self.assertEqual(xrd.loads(b''.join(body)).subject, 'acct:bob@example.com')
+
+    def testasgi(self):
+        sent = []
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+        async def send(message):
+            sent.append(message)
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/.well-known/webfinger',
+            'query_string': b'resource=acct%3Abob%40example.com',
+            'headers': [(b'accept', b'application/jrd+json')],
+        }
+        asyncio.run(self.server.asgi(scope, receive, send))
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'application/jrd+json'),
+                      [(name.lower(), value) for (name, value) in sent[0]['headers']])
+        self.assertEqual(jrd.loads(sent[1]['body']).subject, 'acct:bob@example.com')
+
+    def testdiscovery(self):
+        httpd = make_server(self.server, port=0)
+        thread = threading.Thread(target=httpd.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        host = '%s:%s' % httpd.server_address
+        self.host_meta.links[0].template = 'http://%s/.well-known/webfinger?resource={uri}' % host
+        async def run():
+            async with DiscoveryClient(scheme='http', timeout=5) as client:
+                return await client.lrdd('acct:bob@example.com', host=host)
+        try:
+            self.assertEqual(asyncio.run(run()).find_link('author', 'href'), 'http://example.com/bob')
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()